@@ -1,5 +1,6 @@
-import os, re, json, base64, struct, binascii, logging
+import os, re, signal, logging, threading
 from glob import glob
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from typing import Dict, Optional
 from tqdm import tqdm
 
@@ -9,19 +10,42 @@ from mutagen.mp3 import EasyMP3
 from mutagen.mp4 import MP4, MP4Cover
 from rapidfuzz import fuzz
 from rapidfuzz import process as rf_process
-import unicodedata, time
+import unicodedata
 from mutagen import File as MFile
-try:
-    from PIL import Image
-except Exception:
-    Image = None
-import requests
+
+from netease_api import get_client, configure_client, NeteaseAPIError
+from ncm_container import scan_directory
+from ncm_index import open_index
+from cover_index import CoverIndex
+from cover_cache import CoverCache, CoverVariants, CoverPolicy
 
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
 log = logging.getLogger("artwork")
 
-def build_img_index(meta_img_dir: str) -> Dict[str, str]:
-    """索引meta目录中的track-<id>图片，有重复时选择较大文件"""
+# 整个运行共用的封面缓存：同一张封面（同一专辑）只读取、转码一次
+covers = CoverVariants(CoverCache())
+
+def build_img_index(meta_img_dir: str, index_path: Optional[str] = None, use_index: bool = True,
+                    reindex: bool = False) -> Dict[str, str]:
+    """
+    索引meta目录中的track-<id>图片，有重复时选择较大文件
+    use_index 时使用持久化的封面索引：目录没有变化时不再列目录，只读取新增/变化的图片；
+    reindex 时即使目录没有变化也重新列目录（原地覆盖过图片时使用）；
+    索引中的内容哈希同时登记到封面缓存，相同封面不必再读取文件
+    """
+    if use_index:
+        with CoverIndex(index_path) as index:
+            stats = index.refresh(meta_img_dir, force=reindex)
+            idx = index.best_paths(meta_img_dir)
+            for path, (digest, size, mtime_ns) in index.digests(meta_img_dir).items():
+                covers.remember_digest(path, digest, size, mtime_ns)
+        if stats["scanned"]:
+            log.info(f"封面索引：{len(idx)} 张（{stats['unchanged']} 个未变化，{stats['parsed']} 个新读取，"
+                     f"{stats['removed']} 个已移除）")
+        else:
+            log.info(f"封面索引：{len(idx)} 张（目录未变化）")
+        return idx
+
     idx: Dict[str, str] = {}
     patterns = ["track-*.jpg", "track-*.jpeg", "track-*.png", "track-*.webp"]
     for pat in patterns:
@@ -37,49 +61,53 @@ def build_img_index(meta_img_dir: str) -> Dict[str, str]:
     log.info(f"封面索引：{len(idx)} 张")
     return idx
 
-CORE_KEY = binascii.a2b_hex('687A4852416D736F356B496E62617857')
-META_KEY = binascii.a2b_hex('2331346C6A6B5F215C5D2630553C2728')
-def aes_ecb_decrypt(data: bytes, key: bytes) -> bytes:
-    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-    from cryptography.hazmat.backends import default_backend
-    decryptor = Cipher(algorithms.AES(key), modes.ECB(), backend=default_backend()).decryptor()
-    return decryptor.update(data) + decryptor.finalize()
-
-def unpad(bs: bytes) -> bytes:
-    pad = bs[-1] if isinstance(bs[-1], int) else ord(bs[-1])
-    return bs[:-pad]
-
-def read_ncm_meta(ncm_path: str) -> Optional[dict]:
-    with open(ncm_path, "rb") as f:
-        if binascii.b2a_hex(f.read(8)) != b'4354454e4644414d':
-            return None
-        f.seek(2, 1)
-        key_len = struct.unpack('<I', f.read(4))[0]
-        key_data = bytearray(f.read(key_len))
-        for i in range(len(key_data)):
-            key_data[i] ^= 0x64
-        key_data = unpad(aes_ecb_decrypt(bytes(key_data), CORE_KEY))[17:]
-
-        meta_len = struct.unpack('<I', f.read(4))[0]
-        meta_data = bytearray(f.read(meta_len))
-        for i in range(len(meta_data)):
-            meta_data[i] ^= 0x63
-        meta_data = base64.b64decode(bytes(meta_data)[22:])
-        meta = json.loads(unpad(aes_ecb_decrypt(meta_data, META_KEY)).decode("utf-8")[6:])
-        return meta
-
-def find_matching_audio(decoded_dir: str, stem: str):
-    """匹配音频文件"""
-    for ext in (".flac", ".mp3", ".m4a", ".alac", ".aac"):
-        p = os.path.join(decoded_dir, f"{stem}{ext}")
-        if os.path.exists(p):
-            return p
-    norm = re.sub(r"\s+", "", stem).lower()
-    for p in glob(os.path.join(decoded_dir, "*")):
-        s = re.sub(r"\s+", "", os.path.splitext(os.path.basename(p))[0]).lower()
-        if s == norm:
-            return p
-    return None
+AUDIO_EXTS = (".flac", ".mp3", ".m4a", ".alac", ".aac")
+
+def _loose_stem(stem: str) -> str:
+    return re.sub(r"\s+", "", stem).lower()
+
+def _nfkc_stem(stem: str) -> str:
+    return _loose_stem(unicodedata.normalize("NFKC", stem)).casefold()
+
+class AudioIndex:
+    """
+    已解码音频目录的索引：一次 os.scandir 建立 原文件名 / 去空白小写 / NFKC 三种 stem → 路径 的映射，
+    之后每次匹配都是字典查找；同一 stem 有多种格式时按 AUDIO_EXTS 的顺序优先
+    """
+
+    def __init__(self, decoded_dir: str):
+        self.decoded_dir = decoded_dir
+        self.paths = []
+        self.exact: Dict[str, str] = {}
+        self.loose: Dict[str, str] = {}
+        self.nfkc: Dict[str, str] = {}
+        entries = []
+        with os.scandir(decoded_dir) as it:
+            for e in it:
+                stem, ext = os.path.splitext(e.name)
+                if ext.lower() in AUDIO_EXTS and e.is_file():
+                    entries.append((AUDIO_EXTS.index(ext.lower()), e.name, stem, e.path))
+        for _, _, stem, path in sorted(entries):
+            self.paths.append(path)
+            self.exact.setdefault(stem, path)
+            self.loose.setdefault(_loose_stem(stem), path)
+            self.nfkc.setdefault(_nfkc_stem(stem), path)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def find(self, stem: str) -> Optional[str]:
+        return (self.exact.get(stem) or self.loose.get(_loose_stem(stem))
+                or self.nfkc.get(_nfkc_stem(stem)))
+
+def build_audio_index(decoded_dir: str) -> AudioIndex:
+    idx = AudioIndex(decoded_dir)
+    log.info(f"音频索引：{len(idx)} 个文件")
+    return idx
+
+def find_matching_audio(decoded_dir: str, stem: str, audio_index: Optional[AudioIndex] = None):
+    """匹配音频文件（多次匹配时传入 build_audio_index 建好的索引，避免每次扫描目录）"""
+    return (audio_index or AudioIndex(decoded_dir)).find(stem)
 
 def _infer_mime(img_path: str) -> str:
     ext = os.path.splitext(img_path)[1].lower()
@@ -91,22 +119,29 @@ def _infer_mime(img_path: str) -> str:
         return "image/webp"
     return "application/octet-stream"
 
-def embed_cover(audio_path: str, img_path: str):
+def load_cover(img_path: str, policy: Optional[CoverPolicy] = None):
+    """
+    返回可嵌入的 (图片数据, MIME)：JPEG/PNG 原样，WebP 转为 PNG；经过封面缓存
+    指定 policy 时超大的封面缩小并重新压缩为 JPEG
+    """
+    try:
+        return covers.get(img_path, policy=policy)
+    except OSError:
+        raise
+    except Exception:
+        # Pillow 无法解码时按原来的方式原样嵌入
+        with open(img_path, "rb") as f:
+            return f.read(), _infer_mime(img_path)
+
+def embed_cover(audio_path: str, img_path: str, policy: Optional[CoverPolicy] = None):
+    """写入封面，返回 (原图字节数, 实际嵌入字节数)"""
+    img_bytes, img_mime = load_cover(img_path, policy)
+    write_cover(audio_path, img_bytes, img_mime)
+    return os.path.getsize(img_path), len(img_bytes)
+
+def write_cover(audio_path: str, img_bytes: bytes, img_mime: str):
+    """用 mutagen 把封面数据写入 FLAC / MP3 / M4A（替换原有封面）"""
     ext = os.path.splitext(audio_path)[1].lower()
-    img_mime = _infer_mime(img_path)
-    with open(img_path, "rb") as f:
-        img_bytes = f.read()
-    if img_mime == "image/webp" and Image is not None:
-        try:
-            from io import BytesIO
-            im = Image.open(img_path).convert("RGB")
-            buf = BytesIO()
-            im.save(buf, format="PNG")
-            img_bytes = buf.getvalue()
-            img_mime = "image/png"
-        except Exception:
-            pass
-
     if ext == ".flac":
         audio = FLAC(audio_path)
         pic = Picture()
@@ -164,22 +199,11 @@ def make_title_artist_candidates(stem: str):
 
     return cands
 
-def _req_json(url: str, data: dict, retries: int = 2) -> Optional[dict]:
-    headers = {
-        "User-Agent": "Mozilla/5.0",
-        "Referer": "https://music.163.com",
-        "Content-Type": "application/x-www-form-urlencoded",
-    }
-    for i in range(retries + 1):
-        try:
-            r = requests.post(url, data=data, headers=headers, timeout=8)
-            r.raise_for_status()
-            return r.json()
-        except Exception:
-            if i < retries:
-                time.sleep(0.6)
-            else:
-                return None
+def _search_songs(q: str, limit: int, cloud: bool) -> list:
+    try:
+        return get_client().search(q, limit=limit, cloud=cloud)
+    except NeteaseAPIError:
+        return []
 
 def search_netease_track_id(title: str, artist: str, want_seconds: Optional[float]) -> Optional[str]:
     """搜索网易云音乐track ID"""
@@ -205,13 +229,9 @@ def search_netease_track_id(title: str, artist: str, want_seconds: Optional[floa
         return int(s)
 
     for q in queries:
-        js1 = _req_json("https://music.163.com/api/cloudsearch/pc",
-                        {"type": 1, "s": q, "offset": 0, "total": "true", "limit": 15})
-        songs = (js1 or {}).get("result", {}).get("songs", []) or []
+        songs = _search_songs(q, 15, cloud=True)
         if not songs:
-            js2 = _req_json("https://music.163.com/api/search/get/web",
-                            {"csrf_token": "", "type": 1, "s": q, "offset": 0, "total": "true", "limit": 10})
-            songs = (js2 or {}).get("result", {}).get("songs", []) or []
+            songs = _search_songs(q, 10, cloud=False)
 
         for s in songs:
             name = s.get("name", "")
@@ -239,60 +259,197 @@ def guess_title_artist(stem: str):
     artist = unicodedata.normalize("NFKC", artist).strip()
     return title, artist
 
-def main(decoded_dir: str, meta_img_dir: str, ncm_dir: Optional[str] = None):
-    img_idx = build_img_index(meta_img_dir)
+def search_cover(audio: str, img_idx: Dict[str, str]):
+    """
+    无 NCM 的音频：已有封面的 FLAC 跳过，否则按文件名和时长搜索 trackId，
+    返回 (是否跳过, 第一个在 meta 中有封面的候选对应的图片路径或 None)
+    """
+    stem = os.path.splitext(os.path.basename(audio))[0]
+    if os.path.splitext(audio)[1].lower()==".flac":
+        try:
+            if FLAC(audio).pictures:
+                return True, None
+        except: pass
+    cands = make_title_artist_candidates(stem)
+
+    length = None
+    try:
+        length = MFile(audio).info.length
+    except Exception:
+        pass
+
+    for c in cands:
+        tid = search_netease_track_id(c["title"], c["artist"], length)
+        if tid and tid in img_idx:
+            return False, img_idx[tid]
+    return False, None
+
+def _ncm_records(ncm_dir: str, index_path: Optional[str] = None, use_index: bool = True):
+    """NCM 目录的 (stem, musicId) 列表；使用索引时未变化的 NCM 文件不再读取"""
+    if not use_index:
+        ncm_total = len(glob(os.path.join(ncm_dir, "*.ncm")))
+        for rec in tqdm(scan_directory(ncm_dir), total=ncm_total, desc="读取 NCM 元数据"):
+            if "error" not in rec:
+                yield os.path.splitext(os.path.basename(rec["path"]))[0], rec.get("musicId")
+        return
+    with open_index(ncm_dir, index_path) as index:
+        entries = index.entries(ncm_dir)
+    for e in entries:
+        meta = e["meta"]
+        if meta is not None:
+            yield e["stem"], meta.get("musicId") or meta.get("musicid")
+
+def _format_size(n: float) -> str:
+    for unit in ("B", "KB", "MB"):
+        if abs(n) < 1024:
+            return f"{n:.1f} {unit}" if unit != "B" else f"{n:.0f} B"
+        n /= 1024
+    return f"{n:.2f} GB"
+
+def prepare_covers(imgs, policy: Optional[CoverPolicy], cover_jobs: Optional[int] = None, what: str = ""):
+    """按封面尺寸策略用进程池并行压缩一批要用到的封面（每张不同的封面一次），写入时直接命中缓存"""
+    if policy is None:
+        return
+    shrunk = covers.prepare([img for img in imgs if img], policy, cover_jobs)
+    log.info(f"封面策略{what}：压缩了 {shrunk} 张超限封面")
+
+def _init_writer():
+    # Ctrl-C 由主进程统一处理，子进程忽略 SIGINT
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def embed_concurrently(pairs, audio_paths, img_idx: Dict[str, str], workers: int,
+                       policy: Optional[CoverPolicy] = None, cover_jobs: Optional[int] = None):
+    """
+    并发模式：workers 个线程同时搜索无 NCM 音频的 trackId，封面写入（mutagen 改写 FLAC/ID3/MP4）交给进程池；
+    封面仍在主进程中经过封面缓存读取/转码，子进程只改写音频文件。
+    与逐个处理一样先写完含 NCM 的文件，再检查、搜索其余音频（刚写入封面的 FLAC 会被跳过），
+    搜索全部完成后把匹配到的封面一起交给 prepare_covers 并行压缩，再提交写入。
+    pairs 为 (音频路径, 图片路径)，图片为 None 表示找不到图片或音频（此时音频路径为 stem）。
+    返回 (成功数, 未完成列表, [原图总字节, 嵌入总字节])，未完成列表的顺序与逐个处理时相同
+    """
+    processes = max(min(workers, os.cpu_count() or 1), 1)
+    # 限制已读入封面、等待写入的文件数，避免整个曲库的封面数据同时留在内存中
+    slots = threading.BoundedSemaphore(processes * 4)
+
+    def submit(pool, audio, img):
+        """返回 (音频, 未完成原因, (写入任务, 原图字节, 嵌入字节))"""
+        try:
+            img_bytes, img_mime = load_cover(img, policy)
+            original = os.path.getsize(img)
+        except Exception as e:
+            return audio, f"写封面失败: {e}", None
+        slots.acquire()
+        future = pool.submit(write_cover, audio, img_bytes, img_mime)
+        future.add_done_callback(lambda _: slots.release())
+        return audio, None, (future, original, len(img_bytes))
+
+    done, miss, cover_bytes = 0, [], [0, 0]
+
+    def collect(outcomes):
+        nonlocal done
+        for audio, why, job in outcomes:
+            if job is not None:
+                future, original, embedded = job
+                try:
+                    future.result()
+                except Exception as e:
+                    why = f"写封面失败: {e}"
+                else:
+                    done += 1
+                    cover_bytes[0] += original
+                    cover_bytes[1] += embedded
+                    continue
+            miss.append((audio, why))
+
+    pool = ProcessPoolExecutor(max_workers=processes, initializer=_init_writer)
+    lookup_pool = None
+    try:
+        # fork 方式下首次提交时一次性创建全部子进程：在启动查找线程之前完成
+        pool.submit(os.getpid).result()
+
+        collect([submit(pool, audio, img) if img else (audio, "找不到图片或音频", None)
+                 for audio, img in tqdm(pairs, desc="处理含 NCM 的文件")])
+
+        lookup_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="artwork-lookup")
+        results = lookup_pool.map(lambda audio: search_cover(audio, img_idx), audio_paths)
+        matches = [(audio, img) for audio, (skip, img) in tqdm(zip(audio_paths, results), total=len(audio_paths),
+                                                                desc="搜索无 NCM 的音频") if not skip]
+        prepare_covers([img for _, img in matches], policy, cover_jobs, "（搜索匹配）")
+        collect([submit(pool, audio, img) if img else (audio, "未能匹配到 trackId 或 meta 无此封面", None)
+                 for audio, img in tqdm(matches, desc="处理无 NCM 的音频")])
+    except KeyboardInterrupt:
+        # 取消还在排队的搜索和写入，只等正在进行的请求和正在改写的文件
+        log.info(f"⚠️ 已中断，正在取消剩余任务（已写入 {done} 首）...")
+        if lookup_pool is not None:
+            lookup_pool.shutdown(wait=True, cancel_futures=True)
+        pool.shutdown(wait=True, cancel_futures=True)
+        raise
+    lookup_pool.shutdown()
+    pool.shutdown(wait=True)
+    return done, miss, cover_bytes
+
+def main(decoded_dir: str, meta_img_dir: str, ncm_dir: Optional[str] = None,
+         index_path: Optional[str] = None, use_index: bool = True,
+         cover_index_path: Optional[str] = None, policy: Optional[CoverPolicy] = None,
+         cover_jobs: Optional[int] = None, workers: int = 1, reindex: bool = False):
+    img_idx = build_img_index(meta_img_dir, cover_index_path, use_index, reindex)
+    audio_idx = build_audio_index(decoded_dir)
     done, miss = 0, []
+    # 已写入封面的 原图 / 实际嵌入 总字节数
+    cover_bytes = [0, 0]
 
+    def embed(audio, img):
+        nonlocal done
+        try:
+            original, embedded = embed_cover(audio, img, policy)
+        except Exception as e:
+            miss.append((audio, f"写封面失败: {e}"))
+            return
+        done += 1
+        cover_bytes[0] += original
+        cover_bytes[1] += embedded
+
+    pairs = []
     if ncm_dir and os.path.isdir(ncm_dir):
-        for ncm in tqdm(glob(os.path.join(ncm_dir, "*.ncm")), desc="处理含 NCM 的文件"):
-            stem = os.path.splitext(os.path.basename(ncm))[0]
-            meta = read_ncm_meta(ncm)
-            if not meta:
-                continue
-            tid = str(meta.get("musicId") or meta.get("musicId".lower(), ""))
+        for stem, music_id in tqdm(list(_ncm_records(ncm_dir, index_path, use_index)), desc="匹配含 NCM 的文件"):
+            tid = str(music_id or "")
             if not tid:
                 continue
             img = img_idx.get(tid)
-            audio = find_matching_audio(decoded_dir, stem)
+            audio = audio_idx.find(stem)
             if img and audio:
-                try:
-                    embed_cover(audio, img)
-                    done += 1
-                except Exception as e:
-                    miss.append((audio, f"写封面失败: {e}"))
+                pairs.append((audio, img))
             else:
-                miss.append((stem, "找不到图片或音频"))
-
-    for audio in tqdm([p for p in glob(os.path.join(decoded_dir,"*")) if os.path.splitext(p)[1].lower() in (".flac",".mp3",".m4a",".alac",".aac")],
-                      desc="处理无 NCM 的音频"):
-        stem = os.path.splitext(os.path.basename(audio))[0]
-        if os.path.splitext(audio)[1].lower()==".flac":
-            try:
-                if FLAC(audio).pictures:
-                    continue
-            except: pass
-        cands = make_title_artist_candidates(stem)
+                pairs.append((stem, None))
 
-        length = None
-        try:
-            length = MFile(audio).info.length
-        except Exception:
-            pass
-
-        matched = False
-        for c in cands:
-            tid = search_netease_track_id(c["title"], c["artist"], length)
-            if tid and tid in img_idx:
-                try:
-                    embed_cover(audio, img_idx[tid])
-                    done += 1
-                except Exception as e:
-                    miss.append((audio, f"写封面失败: {e}"))
-                matched = True
-                break
+        prepare_covers([img for _, img in pairs], policy, cover_jobs, "（含 NCM）")
 
-        if not matched:
-            miss.append((audio, "未能匹配到 trackId 或 meta 无此封面"))
+    if workers > 1:
+        try:
+            done, miss, cover_bytes = embed_concurrently(pairs, audio_idx.paths, img_idx, workers, policy,
+                                                         cover_jobs)
+        except KeyboardInterrupt:
+            log.info("⚠️ 用户中断")
+            raise SystemExit(130)
+    else:
+        for audio, img in tqdm(pairs, desc="处理含 NCM 的文件"):
+            if img:
+                embed(audio, img)
+            else:
+                miss.append((audio, "找不到图片或音频"))
+
+        # 先搜索全部音频，匹配到的封面一起压缩后再写入（顺序与结果都与边搜索边写入相同）
+        matches = []
+        for audio in tqdm(audio_idx.paths, desc="搜索无 NCM 的音频"):
+            skip, img = search_cover(audio, img_idx)
+            if not skip:
+                matches.append((audio, img))
+        prepare_covers([img for _, img in matches], policy, cover_jobs, "（搜索匹配）")
+        for audio, img in tqdm(matches, desc="处理无 NCM 的音频"):
+            if img:
+                embed(audio, img)
+            else:
+                miss.append((audio, "未能匹配到 trackId 或 meta 无此封面"))
 
     log.info(f"✅ 已写入封面：{done} 首")
     if miss:
@@ -301,13 +458,63 @@ def main(decoded_dir: str, meta_img_dir: str, ncm_dir: Optional[str] = None):
             log.info(f"- {a} | {why}")
         if len(miss) > 50:
             log.info(f"... 还有 {len(miss)-50} 条省略")
+    if done:
+        original, embedded = cover_bytes
+        saved = original - embedded
+        log.info(f"封面体积：原图 {_format_size(original)}，实际嵌入 {_format_size(embedded)}，"
+                 f"节省 {_format_size(saved)}（{saved / max(original, 1):.0%}）")
+    if covers.cache is not None:
+        pruned = covers.cache.prune()
+        if pruned:
+            log.info(f"封面缓存：删除了 {pruned} 个最久没有使用的转码版本")
+    log.info(covers.summary())
+    log.info(get_client().summary())
     log.info("完成。")
 
+def _parse_size(text: str) -> int:
+    """把 500K / 2M / 300000 这样的大小转为字节数"""
+    m = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([kKmM]?)[bB]?\s*", text)
+    if not m:
+        raise ValueError(text)
+    return int(float(m.group(1)) * {"": 1, "k": 1024, "m": 1024 * 1024}[m.group(2).lower()])
+
 if __name__ == "__main__":
     import argparse
     ap = argparse.ArgumentParser()
     ap.add_argument("--audios", required=True, help="已解码音频所在文件夹（你的 flac 和 mp3 文件夹）")
     ap.add_argument("--meta_imgs", required=True, help="meta 里的封面图文件夹（含 track-*.jpg）")
     ap.add_argument("--ncm_dir", default=None, help="仍然保留的 .ncm 文件夹（可选）")
+    ap.add_argument("--index", default=None, help="NCM 元数据索引文件路径（默认 ~/.cache/ncm-decoding/ncm_index.sqlite）")
+    ap.add_argument("--cover-index", default=None, help="封面图片索引文件路径（默认 ~/.cache/ncm-decoding/cover_index.sqlite）")
+    ap.add_argument("--no-index", action="store_true", help="不使用 NCM 元数据索引和封面索引，每次直接读取 NCM 文件头、列出封面目录")
+    ap.add_argument("--reindex", action="store_true",
+                    help="重新扫描封面目录并更新封面索引（原地覆盖过封面图片后使用）")
+    ap.add_argument("--no-cache", action="store_true", help="不使用 API 响应缓存，全部重新请求")
+    ap.add_argument("--cover-max-px", type=int, default=None, help="封面长边超过此像素时缩小并重新压缩为 JPEG（默认不限制）")
+    ap.add_argument("--cover-max-bytes", type=_parse_size, default=None,
+                    help="封面超过此大小时重新压缩为 JPEG，可写 500K、2M（默认不限制）")
+    ap.add_argument("--cover-quality", type=int, default=85, help="重新压缩封面时的 JPEG 质量（默认 85）")
+    ap.add_argument("--cover-jobs", type=int, default=None, help="压缩封面的进程数（默认 CPU 核数）")
+    ap.add_argument("--no-cover-cache", action="store_true", help="不在磁盘上保存/使用转码后的封面（只在本次运行的内存中缓存）")
+    ap.add_argument("--cover-cache-max", type=_parse_size, default=None,
+                    help="磁盘上转码封面的总大小上限，超过时删除最久没有使用的，可写 500M（默认 256M）")
+    ap.add_argument("--workers", type=int, default=1,
+                    help="同时搜索 trackId 的线程数，写入封面使用同样多（不超过 CPU 核数）的进程（默认 1，逐个处理）")
     args = ap.parse_args()
-    main(args.audios, args.meta_imgs, args.ncm_dir)
\ No newline at end of file
+    client_options = {}
+    if args.no_cache:
+        client_options["use_cache"] = False
+    if args.workers > 8:
+        # 默认客户端最多同时 8 个请求，线程更多时放宽
+        client_options["concurrency"] = args.workers
+    if client_options:
+        configure_client(**client_options)
+    if args.no_cover_cache:
+        covers.cache = None
+    elif args.cover_cache_max is not None:
+        covers.cache.max_variant_bytes = args.cover_cache_max
+    policy = None
+    if args.cover_max_px or args.cover_max_bytes:
+        policy = CoverPolicy(args.cover_max_px, args.cover_quality, args.cover_max_bytes)
+    main(args.audios, args.meta_imgs, args.ncm_dir, args.index, not args.no_index, args.cover_index,
+         policy, args.cover_jobs, args.workers, args.reindex)
\ No newline at end of file
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+attach_artwork 基准测试
+在合成目录上对比旧的逐个 glob 匹配与一次建立的音频索引、每次 glob 封面目录与持久化封面索引、
+每首歌重新读取/转码封面与封面变体缓存，以及封面尺寸策略节省的体积
+"""
+
+import io
+import os
+import re
+import time
+import random
+import tempfile
+import unicodedata
+from glob import glob
+from pathlib import Path
+
+from attach_artwork import AudioIndex
+from cover_index import CoverIndex
+from cover_cache import CoverCache, CoverVariants, CoverPolicy
+
+
+def legacy_find_matching_audio(decoded_dir: str, stem: str):
+    """旧版 find_matching_audio：逐个扩展名 exists，失败后 glob 整个目录并逐个规范化"""
+    for ext in (".flac", ".mp3", ".m4a", ".alac", ".aac"):
+        p = os.path.join(decoded_dir, f"{stem}{ext}")
+        if os.path.exists(p):
+            return p
+    norm = re.sub(r"\s+", "", stem).lower()
+    for p in glob(os.path.join(decoded_dir, "*")):
+        s = re.sub(r"\s+", "", os.path.splitext(os.path.basename(p))[0]).lower()
+        if s == norm:
+            return p
+    return None
+
+
+def make_audio_dir(root: Path, count: int, seed: int = 0):
+    """
+    生成 count 个空音频文件，返回 (目录, NCM 侧的 stem 列表)
+    约 1/10 的 NCM stem 与文件名只差空白/大小写，1/20 只差全角/半角，1/50 没有对应文件
+    """
+    rng = random.Random(seed)
+    exts = [".flac", ".mp3", ".m4a"]
+    root.mkdir(parents=True, exist_ok=True)
+    stems = []
+    for i in range(count):
+        name = f"Artist {i % 997} - Title {i}"
+        (root / f"{name}{rng.choice(exts)}").touch()
+        r = rng.random()
+        if r < 0.1:
+            stems.append(name.replace(" - ", "-").upper())
+        elif r < 0.15:
+            stems.append(unicodedata.normalize("NFKC", name).replace("Title", "Ｔｉｔｌｅ"))
+        elif r < 0.17:
+            stems.append(name + " (missing)")
+        else:
+            stems.append(name)
+    return root, stems
+
+
+def bench_audio_lookup(count: int, workdir, legacy_sample: int = 200):
+    """
+    返回 (旧写法 次/秒, 索引建立耗时, 索引 次/秒, 旧写法处理全部 stem 的估计耗时)
+    旧写法每次未命中都要扫描整个目录，只测 legacy_sample 个 stem 再按比例估算
+    """
+    decoded_dir, stems = make_audio_dir(Path(workdir) / "audio", count)
+    decoded_dir = str(decoded_dir)
+    sample = random.Random(1).sample(stems, min(legacy_sample, len(stems)))
+
+    t0 = time.perf_counter()
+    legacy = [legacy_find_matching_audio(decoded_dir, s) for s in sample]
+    legacy_rate = len(sample) / (time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    idx = AudioIndex(decoded_dir)
+    build = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for s in stems:
+        idx.find(s)
+    index_rate = len(stems) / max(time.perf_counter() - t0, 1e-9)
+
+    # 旧写法能找到的，索引必须找到同一个文件（索引额外处理了全角/半角）
+    for s, expected in zip(sample, legacy):
+        if expected is not None:
+            assert idx.find(s) == expected, s
+    return legacy_rate, build, index_rate, len(stems) / legacy_rate
+
+
+def legacy_build_img_index(meta_img_dir: str):
+    """旧版 build_img_index：glob 四种扩展名，每个文件两次正则，重复时两次 getsize"""
+    idx = {}
+    for pat in ["track-*.jpg", "track-*.jpeg", "track-*.png", "track-*.webp"]:
+        for p in glob(os.path.join(meta_img_dir, pat)):
+            fn = os.path.basename(p)
+            fn = re.sub(r"\s*\(\d+\)(?=\.(jpe?g|png|webp)$)", "", fn, flags=re.I)
+            m = re.match(r"track-(\d+)\.(jpe?g|png|webp)$", fn, flags=re.I)
+            if not m:
+                continue
+            tid = m.group(1)
+            if tid not in idx or os.path.getsize(p) > os.path.getsize(idx[tid]):
+                idx[tid] = p
+    return idx
+
+
+def make_cover_dir(root: Path, count: int, seed: int = 0):
+    """生成 count 张 track-<id>.jpg（少量小图的拷贝），约 1/20 另有较大的 " (1)" 重复文件"""
+    from PIL import Image
+
+    rng = random.Random(seed)
+    images = []
+    for i in range(8):
+        buf = io.BytesIO()
+        Image.new("RGB", (64 + i, 64 + i), (i * 30, 100, 200)).save(buf, format="JPEG")
+        images.append(buf.getvalue())
+    root.mkdir(parents=True, exist_ok=True)
+    for i in range(count):
+        data = rng.choice(images)
+        (root / f"track-{100000 + i}.jpg").write_bytes(data)
+        if rng.random() < 0.05:
+            (root / f"track-{100000 + i} (1).jpg").write_bytes(data + b"\0" * 16)
+    _age(root)
+    return root
+
+
+def _age(path: Path, seconds: int = 60):
+    # 模拟已存在一段时间的目录（刚修改过的目录 mtime 不会被记录）
+    t = time.time() - seconds
+    os.utime(path, (t, t))
+
+
+def bench_cover_index(count: int, workdir):
+    """返回 {阶段: 耗时秒}：旧写法、首次建立索引、目录未变化、新增一张后"""
+    meta_dir = make_cover_dir(Path(workdir) / "meta", count)
+    db_path = Path(workdir) / "cover_index.sqlite"
+    times = {}
+
+    t0 = time.perf_counter()
+    legacy = legacy_build_img_index(str(meta_dir))
+    times["旧写法 glob"] = time.perf_counter() - t0
+
+    for name in ("首次建立索引", "目录未变化"):
+        t0 = time.perf_counter()
+        with CoverIndex(db_path) as index:
+            index.refresh(meta_dir)
+            best = index.best_paths(meta_dir)
+        times[name] = time.perf_counter() - t0
+        assert best == legacy
+
+    (meta_dir / f"track-{100000 + count}.jpg").write_bytes(
+        (meta_dir / "track-100000.jpg").read_bytes())
+    _age(meta_dir)
+    t0 = time.perf_counter()
+    with CoverIndex(db_path) as index:
+        stats = index.refresh(meta_dir)
+        index.best_paths(meta_dir)
+    times["新增一张后"] = time.perf_counter() - t0
+    assert stats["parsed"] == 1
+    return times
+
+
+def legacy_load_cover(img_path: str):
+    """旧版 embed_cover 的取图部分：每次读取文件，WebP 每次解码后重新编码为 PNG"""
+    from PIL import Image
+
+    with open(img_path, "rb") as f:
+        img_bytes = f.read()
+    if img_path.endswith(".webp"):
+        im = Image.open(img_path).convert("RGB")
+        buf = io.BytesIO()
+        im.save(buf, format="PNG")
+        img_bytes = buf.getvalue()
+    return img_bytes
+
+
+def bench_cover_variants(albums: int, tracks: int, workdir, size: int = 1000):
+    """
+    albums 张专辑封面（WebP，size x size），每张专辑 tracks 首歌各有一份 track-<id>.webp
+    返回 (旧写法耗时, 缓存耗时, 缓存统计)
+    """
+    from PIL import Image
+
+    meta_dir = Path(workdir) / "album_meta"
+    meta_dir.mkdir()
+    rng = random.Random(0)
+    paths = []
+    for a in range(albums):
+        im = Image.frombytes("RGB", (size, size), rng.randbytes(3 * 64 * 64)[:3] * (size * size))
+        buf = io.BytesIO()
+        im.save(buf, format="WEBP")
+        for t in range(tracks):
+            path = meta_dir / f"track-{a * 100 + t}.webp"
+            path.write_bytes(buf.getvalue())
+            paths.append(str(path))
+
+    t0 = time.perf_counter()
+    for path in paths:
+        legacy_load_cover(path)
+    legacy = time.perf_counter() - t0
+
+    # 与 attach_artwork 相同：哈希来自封面索引，缓存根目录为临时目录
+    with CoverIndex(Path(workdir) / "variants_index.sqlite") as index:
+        index.refresh(meta_dir)
+        digests = index.digests(meta_dir)
+    variants = CoverVariants(CoverCache(Path(workdir) / "cover_cache"))
+    for path, (digest, size, mtime_ns) in digests.items():
+        variants.remember_digest(path, digest, size, mtime_ns)
+    t0 = time.perf_counter()
+    for path in paths:
+        data, mime = variants.get(path)
+        assert mime == "image/png"
+    cached = time.perf_counter() - t0
+    return legacy, cached, variants.summary()
+
+
+def bench_cover_policy(albums: int, tracks: int, workdir, size: int = 1500, workers=None):
+    """
+    albums 张 size x size 的 PNG 专辑封面（随机噪点，接近最坏情况），每张专辑 tracks 首歌
+    按 --cover-max-px 1000 --cover-max-bytes 500K 的策略处理
+    返回 (原图总字节, 嵌入总字节, 进程池预处理耗时, 逐首取封面耗时, 缓存统计)，字节数按每首歌累计
+    """
+    from PIL import Image
+
+    meta_dir = Path(workdir) / "policy_meta"
+    meta_dir.mkdir()
+    rng = random.Random(0)
+    paths = []
+    for a in range(albums):
+        im = Image.frombytes("RGB", (size, size), rng.randbytes(3 * size * size))
+        buf = io.BytesIO()
+        im.save(buf, format="PNG")
+        for t in range(tracks):
+            path = meta_dir / f"track-{a * 100 + t}.png"
+            path.write_bytes(buf.getvalue())
+            paths.append(str(path))
+
+    with CoverIndex(Path(workdir) / "policy_index.sqlite") as index:
+        index.refresh(meta_dir)
+        digests = index.digests(meta_dir)
+    variants = CoverVariants(CoverCache(Path(workdir) / "policy_cache"))
+    for path, (digest, size, mtime_ns) in digests.items():
+        variants.remember_digest(path, digest, size, mtime_ns)
+    policy = CoverPolicy(1000, 85, 500 * 1024)
+
+    t0 = time.perf_counter()
+    shrunk = variants.prepare(paths, policy, workers)
+    prepare = time.perf_counter() - t0
+    assert shrunk == albums
+
+    original = embedded = 0
+    t0 = time.perf_counter()
+    for path in paths:
+        data, mime = variants.get(path, policy=policy)
+        assert mime == "image/jpeg" and len(data) <= policy.max_bytes
+        original += os.path.getsize(path)
+        embedded += len(data)
+    fetch = time.perf_counter() - t0
+    return original, embedded, prepare, fetch, variants.summary()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="attach_artwork 基准测试")
+    parser.add_argument('--files', type=int, default=20000, help='合成音频目录的文件数（默认 20000）')
+    parser.add_argument('--covers', type=int, default=20000, help='合成封面目录的图片数（默认 20000，0 不测试）')
+    parser.add_argument('--albums', type=int, default=20, help='封面缓存测试的专辑数（默认 20，每张 12 首，0 不测试）')
+    parser.add_argument('--policy-albums', type=int, default=6,
+                        help='封面尺寸策略测试的专辑数（默认 6，每张 4 首，PNG 1500x1500，0 不测试）')
+    parser.add_argument('--cover-jobs', type=int, default=None, help='封面尺寸策略预处理的进程数（默认 CPU 核数）')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        legacy_rate, build, index_rate, legacy_total = bench_audio_lookup(args.files, workdir)
+        print(f"匹配音频 ({args.files} 个文件)")
+        print(f"  旧写法 glob:   {legacy_rate:10.0f} 次/秒  全部匹配约 {legacy_total:.0f}s")
+        print(f"  音频索引:      {index_rate:10.0f} 次/秒  建立索引 {build * 1000:.0f}ms，"
+              f"全部匹配 {build + args.files / index_rate:.2f}s")
+
+        if args.covers:
+            print(f"封面索引 ({args.covers} 张图片)")
+            for name, elapsed in bench_cover_index(args.covers, workdir).items():
+                print(f"  {name}: {elapsed * 1000:10.1f}ms")
+
+        if args.albums:
+            legacy, cached, summary = bench_cover_variants(args.albums, 12, workdir)
+            print(f"取封面 ({args.albums} 张专辑 x 12 首，WebP 1000x1000)")
+            print(f"  旧写法 每首转码: {legacy:8.2f}s")
+            print(f"  封面变体缓存:    {cached:8.2f}s  ({summary})")
+
+        if args.policy_albums:
+            MB = 1024 * 1024
+            original, embedded, prepare, fetch, summary = bench_cover_policy(
+                args.policy_albums, 4, workdir, workers=args.cover_jobs)
+            print(f"封面尺寸策略 ({args.policy_albums} 张专辑 x 4 首，PNG 1500x1500 → 长边 1000、500K 以内)")
+            print(f"  进程池预处理: {prepare:8.2f}s  逐首取封面: {fetch:8.3f}s  ({summary})")
+            print(f"  嵌入体积: {original / MB:8.1f} MB → {embedded / MB:.1f} MB，"
+                  f"节省 {(original - embedded) / max(original, 1):.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+NCM 解码基准测试
+生成合成 NCM 文件，对比逐字节参考实现与整块密钥流引擎的吞吐量
+"""
+
+import sys
+import json
+import time
+import base64
+import random
+import struct
+import tempfile
+from pathlib import Path
+from Crypto.Cipher import AES
+
+from ncm_container import CORE_KEY, META_KEY, NCMHeader, unpad, build_key_box, scan_directory
+from ncm_universal import NCMUniversalDecoder
+
+MB = 1024 * 1024
+
+
+def pkcs7_pad(data: bytes) -> bytes:
+    pad = 16 - len(data) % 16
+    return data + bytes([pad]) * pad
+
+
+def make_synthetic_ncm(path, audio_size, fmt='flac', method=1, cover=b'', meta=None, seed=0, audio=None):
+    """
+    生成一个可被 NCMUniversalDecoder 解码的合成 NCM 文件
+    audio 为空时生成以格式魔数开头的随机数据；返回明文音频数据，便于校验解码结果
+    """
+    rng = random.Random(seed)
+    if audio is None:
+        magic = {'flac': b'fLaC', 'mp3': b'ID3\x04', 'ogg': b'OggS'}[fmt]
+        audio = magic + rng.randbytes(max(audio_size - len(magic), 0))
+
+    rc4_key = rng.randbytes(96)
+    key_data = b'neteasecloudmusic' + rc4_key
+    key_data = AES.new(NCMUniversalDecoder.CORE_KEY, AES.MODE_ECB).encrypt(pkcs7_pad(key_data))
+    key_data = bytes(b ^ 0x64 for b in key_data)
+
+    meta = meta or {
+        'musicId': 100000 + seed,
+        'musicName': f'Track {seed}',
+        'artist': [['Artist', 1]],
+        'album': 'Album',
+        'format': fmt,
+    }
+    meta_data = b'music:' + json.dumps(meta, ensure_ascii=False).encode('utf-8')
+    meta_data = AES.new(NCMUniversalDecoder.META_KEY, AES.MODE_ECB).encrypt(pkcs7_pad(meta_data))
+    meta_data = b"163 key(Don't modify):" + base64.b64encode(meta_data)
+    meta_data = bytes(b ^ 0x63 for b in meta_data)
+
+    key_box = NCMUniversalDecoder.build_key_box(rc4_key)
+    if method == 1:
+        keystream = NCMUniversalDecoder.method1_keystream(key_box)
+    else:
+        keystream = NCMUniversalDecoder.method3_keystream(key_box)
+
+    with open(path, 'wb') as f:
+        f.write(b'CTENFDAM' + b'\x01\x70')
+        f.write(struct.pack('<I', len(key_data)) + key_data)
+        f.write(struct.pack('<I', len(meta_data)) + meta_data)
+        f.write(b'\x00' * 4 + b'\x00' * 5)
+        f.write(struct.pack('<I', len(cover)) + cover)
+        f.write(NCMUniversalDecoder.xor_keystream(audio, keystream))
+    return audio
+
+
+def best_time(func, repeat=3):
+    """返回 func() 多次运行中最快一次的耗时（秒）"""
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return max(best, 1e-9)
+
+
+def measure(func, nbytes, repeat=3):
+    """返回 func() 多次运行中最快一次的吞吐量（MB/s）"""
+    return nbytes / MB / best_time(func, repeat)
+
+
+def bench_keystream(ref_size, size):
+    key_box = NCMUniversalDecoder.build_key_box(random.Random(1).randbytes(96))
+    keystream = NCMUniversalDecoder.method1_keystream(key_box)
+    ref_data = random.Random(2).randbytes(ref_size)
+    data = random.Random(3).randbytes(size)
+
+    ref = measure(lambda: NCMUniversalDecoder.reference_method1(key_box, ref_data), ref_size, repeat=1)
+
+    def vectorized():
+        for pos in range(0, size, NCMUniversalDecoder.CHUNK_SIZE):
+            NCMUniversalDecoder.xor_keystream(data[pos:pos + NCMUniversalDecoder.CHUNK_SIZE], keystream, pos)
+
+    vec = measure(vectorized, size)
+    assert NCMUniversalDecoder.xor_keystream(ref_data, keystream) == \
+        NCMUniversalDecoder.reference_method1(key_box, ref_data)
+    return ref, vec
+
+
+def bench_decode(ncm_path, audio, workdir, **decoder_args):
+    decoder = NCMUniversalDecoder(verbose=False, **decoder_args)
+    output = Path(workdir) / (Path(ncm_path).stem + '.flac')
+
+    def run():
+        assert decoder.decode(ncm_path, workdir)
+
+    rate = measure(run, len(audio))
+    assert output.read_bytes() == audio
+    return rate
+
+
+def legacy_parse_header(data):
+    """旧版各工具中 read_ncm_meta 的写法：逐字节异或、每次新建 AES 对象"""
+    pos = 10
+    key_len = struct.unpack('<I', data[pos:pos + 4])[0]
+    pos += 4
+    key_data = bytearray(data[pos:pos + key_len])
+    pos += key_len
+    for i in range(len(key_data)):
+        key_data[i] ^= 0x64
+    key_data = unpad(AES.new(CORE_KEY, AES.MODE_ECB).decrypt(bytes(key_data)))[17:]
+    key_box = build_key_box(key_data)
+
+    meta_len = struct.unpack('<I', data[pos:pos + 4])[0]
+    pos += 4
+    meta_data = bytearray(data[pos:pos + meta_len])
+    for i in range(len(meta_data)):
+        meta_data[i] ^= 0x63
+    meta_data = base64.b64decode(bytes(meta_data)[22:])
+    meta = json.loads(unpad(AES.new(META_KEY, AES.MODE_ECB).decrypt(meta_data)).decode('utf-8')[6:])
+    return key_box, meta
+
+
+def bench_headers(count, workdir):
+    """解析 count 个 NCM 头部（密钥盒 + 元数据），返回 (旧写法 头/秒, NCMHeader 头/秒)"""
+    ncm_path = Path(workdir) / 'header.ncm'
+    make_synthetic_ncm(ncm_path, 4096, cover=b'\xff\xd8' + bytes(30000))
+    data = ncm_path.read_bytes()
+
+    def legacy():
+        for _ in range(count):
+            legacy_parse_header(data)
+
+    def shared():
+        for _ in range(count):
+            header = NCMHeader(data)
+            header.key_box
+            header.meta
+
+    legacy_rate = count / best_time(legacy, 1)
+    shared_rate = count / best_time(shared, 1)
+    assert legacy_parse_header(data) == (NCMHeader(data).key_box, NCMHeader(data).meta)
+    return legacy_rate, shared_rate
+
+
+def bench_scan(count, workdir, workers):
+    """生成 count 个小 NCM 文件，返回 scan_directory 的耗时（秒）"""
+    scan_dir = Path(workdir) / 'scan'
+    scan_dir.mkdir()
+    for i in range(count):
+        make_synthetic_ncm(scan_dir / f'{i:05d}.ncm', 1024, seed=i)
+    return best_time(lambda: sum(1 for _ in scan_directory(scan_dir, workers)), 1)
+
+
+def bench_ranges(ncm_path, audio, count=2000, length=0x10000):
+    """DecodedNCMReader 随机区间读取（模拟 HTTP Range 请求），返回 (每秒请求数, MB/s)"""
+    from ncm_universal import DecodedNCMReader
+
+    rng = random.Random(1)
+    starts = [rng.randrange(0, len(audio) - length) for _ in range(count)]
+    with DecodedNCMReader(ncm_path) as reader:
+        for start in starts[:8]:
+            assert reader.read_range(start, length) == audio[start:start + length]
+
+        def run():
+            for start in starts:
+                reader.read_range(start, length)
+
+        elapsed = best_time(run)
+    return count / elapsed, count * length / MB / elapsed
+
+
+def peak_rss_mb():
+    # ru_maxrss 会继承 fork 出子进程时父进程的 RSS，Linux 上优先读取本进程的 VmHWM
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 计，macOS 以字节计
+    return rss / MB if sys.platform == 'darwin' else rss / 1024
+
+
+def child_decode(ncm_path, workdir, use_mmap):
+    """在独立子进程中解码一次，输出吞吐量、峰值 RSS 和每字节经过的用户态缓冲区字节数（JSON）"""
+    decoder = NCMUniversalDecoder(verbose=False, use_mmap=use_mmap)
+    t0 = time.perf_counter()
+    r = decoder.decode_file(ncm_path, workdir)
+    elapsed = time.perf_counter() - t0
+    assert r['success'], r
+    print(json.dumps({
+        'rate': r['bytes'] / MB / max(elapsed, 1e-9),
+        'rss': peak_rss_mb(),
+        'copies': decoder.copied_bytes / max(r['bytes'], 1),
+    }))
+
+
+def run_child_decode(ncm_path, workdir, use_mmap):
+    import subprocess
+    out = subprocess.run([sys.executable, __file__, '--child-decode', 'mmap' if use_mmap else 'buffered',
+                          str(ncm_path), str(workdir)],
+                         check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="NCM 解码吞吐量基准测试")
+    parser.add_argument('--size', type=float, default=64, help='合成音频大小 MB（默认 64）')
+    parser.add_argument('--ref-size', type=float, default=2, help='逐字节参考实现的测试大小 MB（默认 2）')
+    parser.add_argument('--segment-jobs', type=int, default=0,
+                        help='同时测试分段并行解码的进程数（默认不测试）')
+    parser.add_argument('--headers', type=int, default=10000, help='头部解析微基准的文件头数量（默认 10000）')
+    parser.add_argument('--scan', type=int, default=0, help='同时测试扫描 N 个 NCM 文件头的耗时（默认不测试）')
+    parser.add_argument('--child-decode', nargs=3, metavar=('MODE', 'NCM', 'DIR'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child_decode:
+        mode, ncm_path, workdir = args.child_decode
+        child_decode(ncm_path, workdir, mode == 'mmap')
+        return
+
+    size = int(args.size * MB)
+    ref_size = int(args.ref_size * MB)
+
+    print(f"Python {sys.version.split()[0]}")
+    ref, vec = bench_keystream(ref_size, size)
+    print(f"密钥流异或  逐字节参考: {ref:8.1f} MB/s")
+    print(f"密钥流异或  整块引擎:   {vec:8.1f} MB/s  (x{vec / ref:.0f})")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        if args.headers:
+            legacy_rate, shared_rate = bench_headers(args.headers, workdir)
+            print(f"解析 {args.headers} 个头部  旧写法: {legacy_rate:8.0f} 个/秒")
+            print(f"解析 {args.headers} 个头部  NCMHeader: {shared_rate:6.0f} 个/秒  (x{shared_rate / legacy_rate:.1f})")
+
+        if args.scan:
+            elapsed = bench_scan(args.scan, workdir, 8)
+            print(f"scan {args.scan} 个文件 (8 线程): {elapsed:.2f}s")
+
+        ncm_path = Path(workdir) / 'bench.ncm'
+        audio = make_synthetic_ncm(ncm_path, size)
+        rate = bench_decode(ncm_path, audio, workdir)
+        print(f"完整解码 {args.size:.0f} MB FLAC:   {rate:8.1f} MB/s")
+
+        requests_per_s, range_rate = bench_ranges(ncm_path, audio)
+        print(f"随机区间读取 64KB:  {requests_per_s:8.0f} 次/秒  {range_rate:8.1f} MB/s")
+
+        print(f"{'输入路径':<10}{'MB/s':>10}{'峰值RSS(MB)':>14}{'复制/字节':>10}")
+        for use_mmap in (False, True):
+            r = run_child_decode(ncm_path, workdir, use_mmap)
+            name = 'mmap' if use_mmap else 'read/write'
+            print(f"{name:<12}{r['rate']:>10.1f}{r['rss']:>14.1f}{r['copies']:>12.2f}")
+
+        if args.segment_jobs > 1:
+            NCMUniversalDecoder.SEGMENT_MIN_SIZE = 0
+            rate = bench_decode(ncm_path, audio, workdir, segment_jobs=args.segment_jobs)
+            print(f"分段并行解码 ({args.segment_jobs} 进程): {rate:8.1f} MB/s")
+
+
+if __name__ == '__main__':
+    main()
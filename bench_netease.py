@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+网络工具基准测试
+启动本地回放服务器（netease_stub.py），生成合成曲库，分别运行 fetch_lyrics、fetch_album_info、
+attach_artwork 和 attach_artwork.search_netease_track_id，报告每个工具的 首/秒 和各接口的请求数
+"""
+
+import io
+import os
+import sys
+import time
+import struct
+import tempfile
+import subprocess
+from pathlib import Path
+
+from bench_ncm import make_synthetic_ncm
+from ncm_tags import vorbis_comment_body
+from netease_stub import Recordings, StubServer
+
+HERE = Path(__file__).resolve().parent
+
+# 支持 --workers 的工具
+CONCURRENT_TOOLS = {'lyrics', 'album', 'artwork'}
+
+
+def make_flac(path, seconds: int = 180, sample_rate: int = 44100, tags=None):
+    """只有 STREAMINFO（和可选的 VORBIS_COMMENT）的最小 FLAC 文件，mutagen 可以读取时长并写入标签"""
+    total = seconds * sample_rate
+    info = struct.pack('>HH', 4096, 4096) + b'\x00' * 6
+    # 采样率 20 位 | 声道数-1 3 位 | 位深-1 5 位 | 总采样数 36 位
+    packed = (sample_rate << 44) | (1 << 41) | (15 << 36) | total
+    info += packed.to_bytes(8, 'big') + b'\x00' * 16
+    blocks = [(0, info)]
+    if tags:
+        blocks.append((4, vorbis_comment_body(tags)))
+    with open(path, 'wb') as f:
+        f.write(b'fLaC')
+        for i, (block_type, body) in enumerate(blocks):
+            last = 0x80 if i == len(blocks) - 1 else 0
+            f.write(bytes([last | block_type]) + len(body).to_bytes(3, 'big') + body)
+
+
+def make_library(root: Path, tracks: int, ncm_share: float):
+    """
+    生成 tracks 首 "Artist N - Title N.flac"（带标题/艺术家标签），
+    其中前 ncm_share 比例带对应的 NCM 文件（已知 musicId）
+    """
+    audio_dir = root / "audio"
+    ncm_dir = root / "ncm"
+    audio_dir.mkdir(parents=True)
+    ncm_dir.mkdir()
+    with_ncm = int(tracks * ncm_share)
+    for i in range(tracks):
+        stem = f"Artist {i} - Title {i}"
+        make_flac(audio_dir / f"{stem}.flac", tags={"title": f"Title {i}", "artist": f"Artist {i}"})
+        if i < with_ncm:
+            make_synthetic_ncm(ncm_dir / f"{stem}.ncm", 1024, seed=i)
+    return audio_dir, ncm_dir
+
+
+def run_tool(server, env, script, args, tracks):
+    server.reset_counts()
+    t0 = time.perf_counter()
+    subprocess.run([sys.executable, str(HERE / script)] + args, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    elapsed = time.perf_counter() - t0
+    return tracks / elapsed, dict(server.counts)
+
+
+def make_covers(meta_dir: Path, tracks: int, ncm_share: float):
+    """为带 NCM 的曲目（musicId 100000 + N）生成 track-<id>.jpg，无 NCM 的曲目搜索后找不到封面"""
+    from PIL import Image
+
+    meta_dir.mkdir(parents=True)
+    buf = io.BytesIO()
+    Image.new("RGB", (300, 300), (200, 80, 40)).save(buf, format="JPEG")
+    for i in range(int(tracks * ncm_share)):
+        (meta_dir / f"track-{100000 + i}.jpg").write_bytes(buf.getvalue())
+    return meta_dir
+
+
+def run_search(server, audio_dir, tracks):
+    """在本进程中对每个文件调用 attach_artwork.search_netease_track_id（与 attach_artwork 的无 NCM 流程相同）"""
+    from attach_artwork import make_title_artist_candidates, search_netease_track_id
+
+    server.reset_counts()
+    t0 = time.perf_counter()
+    for path in sorted(audio_dir.glob("*.flac")):
+        for c in make_title_artist_candidates(path.stem):
+            if search_netease_track_id(c["title"], c["artist"], 180.0):
+                break
+    elapsed = time.perf_counter() - t0
+    return tracks / elapsed, dict(server.counts)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="网络工具基准测试（使用本地回放服务器）")
+    parser.add_argument('--tracks', type=int, default=100, help='合成曲目数（默认 100）')
+    parser.add_argument('--ncm-share', type=float, default=0.5, help='带 NCM 文件（已知 musicId）的曲目比例（默认 0.5）')
+    parser.add_argument('--latency', type=float, default=20, help='回放服务器每个请求的平均延迟毫秒（默认 20）')
+    parser.add_argument('--error-rate', type=float, default=0, help='返回 503 的比例')
+    parser.add_argument('--throttle-rate', type=float, default=0, help='返回 429 的比例')
+    parser.add_argument('--rate', type=float, default=0, help='客户端每秒初始请求数（默认 0 不限速）')
+    parser.add_argument('--recordings', help='回放的录制文件（默认全部使用合成数据）')
+    parser.add_argument('--workers', type=int, default=1, help='支持并发的工具使用的线程数（默认 1）')
+    parser.add_argument('--tools', default='lyrics,album,artwork,search',
+                        help='要测试的工具（默认 lyrics,album,artwork,search）')
+    args = parser.parse_args()
+
+    tools = set(args.tools.split(','))
+    recordings = Recordings(args.recordings)
+    with tempfile.TemporaryDirectory() as workdir, \
+            StubServer(recordings, latency=args.latency / 1000, error_rate=args.error_rate,
+                       throttle_rate=args.throttle_rate, seed=0) as server:
+        # 缓存目录和服务器地址都指向临时位置，不影响真实的索引和响应缓存
+        env = dict(os.environ, NCM_CACHE_DIR=str(Path(workdir) / "cache"),
+                   NETEASE_API_BASE=server.url, NETEASE_API_RATE=str(args.rate))
+        os.environ.update(env)
+
+        print(f"回放服务器: {server.url}  延迟 {args.latency:.0f}ms  错误率 {args.error_rate:.0%}  "
+              f"限流率 {args.throttle_rate:.0%}")
+        print(f"{'工具':<22}{'首/秒':>8}  请求数")
+        jobs = [
+            ('lyrics', 'fetch_lyrics', 'fetch_lyrics.py', ['--no-cache']),
+            ('album', 'fetch_album_info', 'fetch_album_info.py', ['--force', '--no-cache']),
+        ]
+        for n, (key, name, script, extra) in enumerate(jobs):
+            if key not in tools:
+                continue
+            if key in CONCURRENT_TOOLS and args.workers > 1:
+                extra = extra + ['--workers', str(args.workers)]
+            # 每个工具使用新生成的曲库，前一个工具写入的标签不影响后一个
+            audio_dir, ncm_dir = make_library(Path(workdir) / f"lib{n}", args.tracks, args.ncm_share)
+            rate, counts = run_tool(server, env, script, [str(audio_dir), '--ncm_dir', str(ncm_dir)] + extra,
+                                    args.tracks)
+            print(f"{name:<24}{rate:>8.1f}  {_format_counts(counts)}")
+
+        if 'artwork' in tools:
+            audio_dir, ncm_dir = make_library(Path(workdir) / "lib_artwork", args.tracks, args.ncm_share)
+            meta_dir = make_covers(Path(workdir) / "meta_artwork", args.tracks, args.ncm_share)
+            extra = ['--no-cache'] + (['--workers', str(args.workers)] if args.workers > 1 else [])
+            rate, counts = run_tool(server, env, 'attach_artwork.py',
+                                    ['--audios', str(audio_dir), '--meta_imgs', str(meta_dir),
+                                     '--ncm_dir', str(ncm_dir)] + extra, args.tracks)
+            print(f"{'attach_artwork':<24}{rate:>8.1f}  {_format_counts(counts)}")
+
+        if 'search' in tools:
+            from netease_api import configure_client
+            configure_client(use_cache=False)
+            audio_dir, _ = make_library(Path(workdir) / "lib_search", args.tracks, 0)
+            rate, counts = run_search(server, audio_dir, args.tracks)
+            print(f"{'search_netease_track_id':<24}{rate:>8.1f}  {_format_counts(counts)}")
+
+
+def _format_counts(counts) -> str:
+    total = sum(counts.values())
+    return f"{total} (" + ", ".join(f"{k} {v}" for k, v in sorted(counts.items())) + ")"
+
+
+if __name__ == '__main__':
+    main()
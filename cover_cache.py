@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+封面缓存
+按内容哈希保存封面图片，同一张专辑封面在缓存中只存一份；
+CoverVariants 在此之上缓存转码/缩小后的版本（磁盘 + 内存 LRU），同一专辑的封面只转码一次；
+CoverPolicy 描述嵌入前对超大封面的缩小/重新压缩规则
+"""
+
+import io
+import os
+import hashlib
+import threading
+from collections import OrderedDict, Counter
+from pathlib import Path
+from typing import Iterable, Optional, Tuple
+
+from ncm_index import cache_dir
+
+try:
+    from PIL import Image
+except Exception:
+    Image = None
+
+# 内存中保留的封面（原图 + 各变体）总字节数
+DEFAULT_MEMORY_BYTES = 64 * 1024 * 1024
+# 磁盘上转码版本的总字节数上限，超过时 prune 按最近使用时间删除
+DEFAULT_VARIANT_BYTES = 256 * 1024 * 1024
+
+_EXTS = {'jpeg': 'jpg', 'png': 'png'}
+
+# 超过 max_bytes 时逐步降低质量、再缩小尺寸，但不低于以下下限
+MIN_QUALITY = 60
+MIN_DIM = 300
+
+
+def image_type(data: bytes):
+    """根据文件头判断图片格式，返回 (扩展名, MIME)；无法识别时返回 (None, None)"""
+    if data[:3] == b'\xff\xd8\xff':
+        return 'jpg', 'image/jpeg'
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'png', 'image/png'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp', 'image/webp'
+    return None, None
+
+
+def default_cover_dir() -> Path:
+    return cache_dir() / "covers"
+
+
+class CoverCache:
+    """
+    内容寻址的封面缓存: <root>/<sha1 前两位>/<sha1>.<ext>
+    写入先落到临时文件再改名，多个进程同时写同一张封面也不会得到半个文件
+    转码版本 <sha1>-<tag>.<ext> 命中时更新 mtime，prune 把它们的总大小限制在 max_variant_bytes 以内
+    """
+
+    def __init__(self, root=None, max_variant_bytes: int = DEFAULT_VARIANT_BYTES):
+        self.root = Path(root) if root else default_cover_dir()
+        self.max_variant_bytes = max_variant_bytes
+
+    def path_for(self, digest: str, ext: str) -> Path:
+        return self.root / digest[:2] / f"{digest}.{ext}"
+
+    def put(self, data: bytes) -> Optional[Path]:
+        """保存封面并返回缓存路径，已存在时不重复写入；不是图片时返回 None"""
+        ext, _ = image_type(data)
+        if not ext:
+            return None
+        path = self.path_for(hashlib.sha1(data).hexdigest(), ext)
+        if not path.exists():
+            self._write(path, data)
+        return path
+
+    def variant_path(self, digest: str, tag: str, ext: str) -> Path:
+        return self.root / digest[:2] / f"{digest}-{tag}.{ext}"
+
+    def get_variant(self, digest: str, tag: str, ext: str) -> Optional[bytes]:
+        path = self.variant_path(digest, tag, ext)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        try:
+            # 记录最近使用时间（不依赖 atime，很多系统以 noatime/relatime 挂载）
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def put_variant(self, digest: str, tag: str, ext: str, data: bytes):
+        """保存原图 digest 的一个转码版本（tag 描述格式/尺寸/质量）"""
+        self._write(self.variant_path(digest, tag, ext), data)
+
+    def prune(self) -> int:
+        """转码版本总大小超过 max_variant_bytes 时删除最久没有使用的，返回删除的文件数；原图不受影响"""
+        entries = []
+        try:
+            with os.scandir(self.root) as top:
+                for sub in top:
+                    if not sub.is_dir():
+                        continue
+                    with os.scandir(sub.path) as it:
+                        for e in it:
+                            if '-' not in e.name or e.name.endswith('.tmp'):
+                                continue
+                            try:
+                                st = e.stat()
+                            except OSError:
+                                continue
+                            entries.append((st.st_mtime_ns, st.st_size, e.path))
+        except FileNotFoundError:
+            return 0
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_variant_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
+
+    @staticmethod
+    def _write(path: Path, data: bytes):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+
+def transcode(data: bytes, fmt: str, max_dim: Optional[int] = None, quality: int = 90) -> bytes:
+    """用 Pillow 把图片转为 fmt（'jpeg' / 'png'），max_dim 不为空时把长边缩小到 max_dim 以内"""
+    with Image.open(io.BytesIO(data)) as im:
+        im.load()
+        if max_dim and max(im.size) > max_dim:
+            im.thumbnail((max_dim, max_dim), Image.LANCZOS)
+        if fmt == 'jpeg':
+            if im.mode not in ('RGB', 'L'):
+                im = im.convert('RGB')
+        elif im.mode not in ('RGB', 'RGBA', 'L', 'LA', 'P'):
+            im = im.convert('RGBA')
+        buf = io.BytesIO()
+        if fmt == 'jpeg':
+            im.save(buf, format='JPEG', quality=quality, optimize=True)
+        else:
+            im.save(buf, format='PNG', optimize=True)
+        return buf.getvalue()
+
+
+class CoverPolicy:
+    """
+    封面尺寸策略：长边超过 max_dim 像素、或文件超过 max_bytes 字节的封面，
+    缩小到 max_dim 以内并重新压缩为 quality 质量的 JPEG；仍超过 max_bytes 时
+    每次把质量降低 10（不低于 MIN_QUALITY），再每次把长边缩小 1/4（不低于 MIN_DIM）。
+    没有超限的 JPEG/PNG 原样保留，其它格式（WebP）按 quality 转为 JPEG
+    """
+
+    def __init__(self, max_dim: Optional[int] = None, quality: int = 85, max_bytes: Optional[int] = None):
+        self.max_dim = max_dim
+        self.quality = quality
+        self.max_bytes = max_bytes
+
+    @property
+    def tag(self) -> str:
+        """磁盘/内存缓存中区分不同策略的变体名"""
+        return f"fit{self.max_dim or 0}-q{self.quality}-b{self.max_bytes or 0}"
+
+    def apply(self, data: bytes) -> Optional[bytes]:
+        """返回按策略压缩后的 JPEG；不需要处理（或压缩后反而更大）时返回 None"""
+        with Image.open(io.BytesIO(data)) as im:
+            longest = max(im.size)
+            too_big = bool(self.max_dim) and longest > self.max_dim
+            too_heavy = bool(self.max_bytes) and len(data) > self.max_bytes
+            keep = im.format in ('JPEG', 'PNG')
+            if keep and not too_big and not too_heavy:
+                return None
+            im.load()
+            im = _flatten(im)
+
+        dim = min(longest, self.max_dim) if self.max_dim else longest
+        quality = self.quality
+        while True:
+            scaled = im
+            if dim < longest:
+                scaled = im.copy()
+                scaled.thumbnail((dim, dim), Image.LANCZOS)
+            buf = io.BytesIO()
+            scaled.save(buf, format='JPEG', quality=quality, optimize=True)
+            out = buf.getvalue()
+            if not self.max_bytes or len(out) <= self.max_bytes:
+                break
+            if quality > MIN_QUALITY:
+                quality = max(quality - 10, MIN_QUALITY)
+            elif dim > MIN_DIM:
+                dim = max(int(dim * 0.75), MIN_DIM)
+            else:
+                break
+
+        if keep and not too_big and len(out) >= len(data):
+            return None
+        return out
+
+
+def _flatten(im):
+    """转为 JPEG 可保存的模式，透明部分铺白底"""
+    if im.mode in ('RGB', 'L'):
+        return im
+    if im.mode in ('RGBA', 'LA') or (im.mode == 'P' and 'transparency' in im.info):
+        im = im.convert('RGBA')
+        bg = Image.new('RGB', im.size, (255, 255, 255))
+        bg.paste(im, mask=im.getchannel('A'))
+        return bg
+    return im.convert('RGB')
+
+
+def _apply_policy(path: str, policy: CoverPolicy):
+    """
+    进程池中执行：读取原图并按策略压缩，返回 (路径, 哈希, 大小, mtime_ns, 压缩结果或 None)；
+    读取/解码失败返回 None
+    """
+    try:
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            data = f.read()
+        return path, hashlib.sha1(data).hexdigest(), st.st_size, st.st_mtime_ns, policy.apply(data)
+    except Exception:
+        return None
+
+
+def _mime_from_name(path: str) -> Optional[str]:
+    ext = os.path.splitext(path)[1].lower()
+    return {'.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.png': 'image/png', '.webp': 'image/webp'}.get(ext)
+
+
+class CoverVariants:
+    """
+    可直接嵌入的封面版本缓存
+    以原图内容哈希 + 变体（格式、长边上限、质量）为键：先查内存 LRU，再查磁盘 CoverCache，
+    都没有时才读取原图并用 Pillow 转码。同一专辑的多首歌共用一张封面时只读取/转码一次。
+    已知图片哈希时（封面索引中有）可以用 remember_digest 登记，命中缓存时不必再读取原图；
+    登记时带上大小和 mtime 的，使用前先 stat 核对，原地覆盖过的图片重新读取。
+    线程安全；stats 统计 内存命中/磁盘命中/读取原图/转码/哈希过期 次数
+    """
+
+    def __init__(self, cache: Optional[CoverCache] = None, memory_bytes: int = DEFAULT_MEMORY_BYTES):
+        self.cache = cache
+        self.memory_bytes = memory_bytes
+        self.stats = Counter()
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._digests = {}
+        # 按策略不需要改动的封面 (哈希, 策略标签)：直接使用原图，不再重复执行策略
+        self._unchanged = set()
+        self._lock = threading.Lock()
+
+    def remember_digest(self, path, digest: str, size: Optional[int] = None, mtime_ns: Optional[int] = None):
+        with self._lock:
+            self._digests[os.fspath(path)] = (digest, size, mtime_ns)
+
+    def _known_digest(self, path: str) -> Optional[str]:
+        """登记过且文件没有变化时返回哈希，否则返回 None（需要重新读取）"""
+        with self._lock:
+            item = self._digests.get(path)
+        if item is None:
+            return None
+        digest, size, mtime_ns = item
+        if size is not None:
+            try:
+                st = os.stat(path)
+            except OSError:
+                return None
+            if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+                self.stats["stale"] += 1
+                with self._lock:
+                    self._digests.pop(path, None)
+                return None
+        return digest
+
+    def _remember(self, key, data: bytes, mime: str):
+        with self._lock:
+            if key in self._memory:
+                return
+            self._memory[key] = (data, mime)
+            self._memory_size += len(data)
+            while self._memory_size > self.memory_bytes and len(self._memory) > 1:
+                _, (old, _) = self._memory.popitem(last=False)
+                self._memory_size -= len(old)
+                self.stats["evict"] += 1
+
+    def _recall(self, key):
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None:
+                self._memory.move_to_end(key)
+            return item
+
+    def _read_original(self, path: str) -> Tuple[str, bytes]:
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            data = f.read()
+        self.stats["read"] += 1
+        digest = hashlib.sha1(data).hexdigest()
+        self.remember_digest(path, digest, st.st_size, st.st_mtime_ns)
+        return digest, data
+
+    @staticmethod
+    def _target(fmt, max_dim, mime) -> Optional[str]:
+        """要转成的格式；None 表示原样使用"""
+        if fmt:
+            return fmt
+        if mime in ('image/jpeg', 'image/png'):
+            return None if not max_dim else ('jpeg' if mime == 'image/jpeg' else 'png')
+        return 'png'
+
+    def get(self, path, fmt: Optional[str] = None, max_dim: Optional[int] = None,
+            quality: int = 90, policy: Optional[CoverPolicy] = None) -> Tuple[bytes, str]:
+        """
+        返回 (图片数据, MIME)
+        fmt 为 None 时 JPEG/PNG 原样返回、其它格式（WebP）转为 PNG；
+        fmt 为 'jpeg' / 'png' 时转为该格式；max_dim 限制长边像素；
+        指定 policy 时忽略 fmt/max_dim/quality，按封面尺寸策略处理
+        """
+        path = os.fspath(path)
+        digest = self._known_digest(path)
+        data = None
+        if digest is None:
+            digest, data = self._read_original(path)
+        if policy is not None and Image is not None:
+            return self._get_with_policy(path, digest, data, policy)
+
+        # 还没读原图时按扩展名判断格式，已知哈希的封面命中缓存时完全不读文件
+        mime = image_type(data)[1] if data is not None else _mime_from_name(path)
+        target = self._target(fmt, max_dim, mime) if Image is not None else None
+        if target is None:
+            tag = "original"
+        else:
+            tag = f"{target}-{max_dim or 0}" + (f"-q{quality}" if target == 'jpeg' else "")
+
+        item = self._recall((digest, tag))
+        if item is not None:
+            self.stats["memory_hit"] += 1
+            return item
+
+        out = None
+        if target is not None and self.cache is not None:
+            out = self.cache.get_variant(digest, tag, _EXTS[target])
+            if out is not None:
+                self.stats["disk_hit"] += 1
+        if out is None:
+            if data is None:
+                digest, data = self._read_original(path)
+            if target is None:
+                out = data
+            else:
+                out = transcode(data, target, max_dim, quality)
+                self.stats["transcode"] += 1
+                if self.cache is not None:
+                    self.cache.put_variant(digest, tag, _EXTS[target], out)
+
+        if target is None:
+            item = (out, image_type(out)[1] or mime or 'application/octet-stream')
+        else:
+            item = (out, 'image/jpeg' if target == 'jpeg' else 'image/png')
+        self._remember((digest, tag), *item)
+        return item
+
+    def _get_with_policy(self, path: str, digest: str, data: Optional[bytes], policy: CoverPolicy):
+        key = (digest, policy.tag)
+        item = self._recall(key)
+        if item is not None:
+            self.stats["memory_hit"] += 1
+            return item
+        with self._lock:
+            unchanged = key in self._unchanged
+        out = None
+        if not unchanged and self.cache is not None:
+            out = self.cache.get_variant(digest, policy.tag, 'jpg')
+        if out is not None:
+            self.stats["disk_hit"] += 1
+            item = (out, 'image/jpeg')
+        else:
+            if data is None:
+                digest, data = self._read_original(path)
+                key = (digest, policy.tag)
+                with self._lock:
+                    unchanged = key in self._unchanged
+            out = None if unchanged else policy.apply(data)
+            if out is None:
+                with self._lock:
+                    self._unchanged.add(key)
+                item = (data, image_type(data)[1] or _mime_from_name(path) or 'application/octet-stream')
+            else:
+                self.stats["transcode"] += 1
+                if self.cache is not None:
+                    self.cache.put_variant(digest, policy.tag, 'jpg', out)
+                item = (out, 'image/jpeg')
+        self._remember(key, *item)
+        return item
+
+    def _has_variant(self, digest: str, policy: CoverPolicy) -> bool:
+        with self._lock:
+            if (digest, policy.tag) in self._unchanged:
+                return True
+        if self._recall((digest, policy.tag)) is not None:
+            return True
+        return self.cache is not None and self.cache.variant_path(digest, policy.tag, 'jpg').exists()
+
+    def prepare(self, paths: Iterable, policy: CoverPolicy, workers: Optional[int] = None) -> int:
+        """
+        用进程池预先按策略处理一批封面（相同哈希只处理一次，已有缓存的跳过），
+        结果写入磁盘/内存缓存，不需要压缩的记为原样使用，之后 get(path, policy=policy)
+        直接命中、不再重复执行策略；返回实际压缩的封面数
+        """
+        if Image is None:
+            return 0
+        todo, seen = [], set()
+        for path in dict.fromkeys(os.fspath(p) for p in paths):
+            digest = self._known_digest(path)
+            if digest is not None:
+                if digest in seen or self._has_variant(digest, policy):
+                    continue
+                seen.add(digest)
+            todo.append(path)
+        if not todo:
+            return 0
+
+        if workers == 1 or len(todo) == 1:
+            results = [_apply_policy(path, policy) for path in todo]
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_apply_policy, todo, [policy] * len(todo)))
+
+        shrunk = 0
+        for result in results:
+            if result is None:
+                continue
+            path, digest, size, mtime_ns, out = result
+            self.stats["read"] += 1
+            self.remember_digest(path, digest, size, mtime_ns)
+            if out is None:
+                with self._lock:
+                    self._unchanged.add((digest, policy.tag))
+                continue
+            shrunk += 1
+            self.stats["transcode"] += 1
+            if self.cache is not None:
+                self.cache.put_variant(digest, policy.tag, 'jpg', out)
+            self._remember((digest, policy.tag), out, 'image/jpeg')
+        return shrunk
+
+    def summary(self) -> str:
+        s = self.stats
+        return (f"封面缓存: 读取原图 {s['read']}，转码 {s['transcode']}，内存命中 {s['memory_hit']}，"
+                f"磁盘命中 {s['disk_hit']}，淘汰 {s['evict']}"
+                + (f"，哈希过期 {s['stale']}" if s['stale'] else ""))
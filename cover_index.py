@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+封面图片索引
+把 meta 目录中 track-<id> 图片的 大小、mtime、尺寸、内容哈希 保存在 SQLite 中；
+目录 mtime 没有变化时不再列目录，只需一次 stat，目录有变化时也只读取新增/变化的图片
+"""
+
+import io
+import os
+import re
+import time
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+
+from ncm_index import cache_dir
+
+try:
+    from PIL import Image
+except Exception:
+    Image = None
+
+# track-<id>.jpg，允许下载工具加上的 " (1)" 之类的重复后缀
+_TRACK_NAME = re.compile(r"track-(\d+)(?:\s*\(\d+\))?\.(jpe?g|png|webp)$", re.I)
+
+# 目录 mtime 距现在不足这么多秒时不记录：同一时间片内再新增的文件不会改变 mtime，下次仍需重新列目录
+_RACY_SECONDS = 2
+
+
+def default_cover_index_path() -> Path:
+    return cache_dir() / "cover_index.sqlite"
+
+
+def track_id_from_name(name: str) -> Optional[str]:
+    m = _TRACK_NAME.match(name)
+    return m.group(1) if m else None
+
+
+def _probe(path: str) -> Optional[dict]:
+    """读取图片，返回内容哈希和尺寸；读取失败返回 None"""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    width = height = None
+    if Image is not None:
+        try:
+            with Image.open(io.BytesIO(data)) as im:
+                width, height = im.size
+        except Exception:
+            pass
+    return {"sha1": hashlib.sha1(data).hexdigest(), "width": width, "height": height}
+
+
+class CoverIndex:
+    """
+    封面图片索引
+    每行记录: path, dir, track_id, size, mtime_ns, width, height, sha1
+    另记录每个目录上次列目录时的 mtime
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS covers (
+            path TEXT PRIMARY KEY,
+            dir TEXT NOT NULL,
+            track_id TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            width INTEGER,
+            height INTEGER,
+            sha1 TEXT
+        );
+        CREATE INDEX IF NOT EXISTS covers_dir ON covers (dir);
+        CREATE TABLE IF NOT EXISTS cover_dirs (
+            dir TEXT PRIMARY KEY,
+            mtime_ns INTEGER NOT NULL
+        );
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = Path(db_path) if db_path else default_cover_index_path()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.executescript(self.SCHEMA)
+        self._lock = threading.Lock()
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def refresh(self, meta_dir, workers=8, force=False) -> Dict[str, int]:
+        """
+        增量刷新目录。目录 mtime 与上次相同时直接返回（新增、删除、改名都会改变目录 mtime；
+        原地覆盖图片内容不会，这种情况用 force=True）。
+        否则列目录，只读取大小或 mtime 变化的图片，并移除已删除的图片。
+        返回 {"unchanged", "parsed", "removed", "scanned"} 计数，scanned 为 0 表示没有列目录
+        """
+        meta_dir = os.path.abspath(meta_dir)
+        dir_mtime = os.stat(meta_dir).st_mtime_ns
+        with self._lock:
+            row = self._conn.execute("SELECT mtime_ns FROM cover_dirs WHERE dir = ?", (meta_dir,)).fetchone()
+            count = self._conn.execute("SELECT COUNT(*) FROM covers WHERE dir = ?", (meta_dir,)).fetchone()[0]
+        if row and row[0] == dir_mtime and not force:
+            return {"unchanged": count, "parsed": 0, "removed": 0, "scanned": 0}
+
+        with self._lock:
+            known = {r[0]: (r[1], r[2]) for r in self._conn.execute(
+                "SELECT path, size, mtime_ns FROM covers WHERE dir = ?", (meta_dir,))}
+
+        seen = {}
+        with os.scandir(meta_dir) as it:
+            for entry in it:
+                track_id = track_id_from_name(entry.name)
+                if not track_id:
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                seen[entry.path] = (track_id, st.st_size, st.st_mtime_ns)
+
+        stale = [p for p, (_, size, mtime_ns) in seen.items() if known.get(p) != (size, mtime_ns)]
+        removed = [p for p in known if p not in seen]
+
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            probed = list(executor.map(_probe, stale))
+
+        with self._lock, self._conn:
+            for path, info in zip(stale, probed):
+                if info is None:
+                    continue
+                track_id, size, mtime_ns = seen[path]
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO covers (path, dir, track_id, size, mtime_ns, width, height, sha1) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (path, meta_dir, track_id, size, mtime_ns, info["width"], info["height"], info["sha1"]))
+            self._conn.executemany("DELETE FROM covers WHERE path = ?", [(p,) for p in removed])
+            if time.time() - dir_mtime / 1e9 > _RACY_SECONDS:
+                self._conn.execute("INSERT OR REPLACE INTO cover_dirs (dir, mtime_ns) VALUES (?, ?)",
+                                   (meta_dir, dir_mtime))
+            else:
+                self._conn.execute("DELETE FROM cover_dirs WHERE dir = ?", (meta_dir,))
+
+        return {"unchanged": len(seen) - len(stale), "parsed": len(stale), "removed": len(removed),
+                "scanned": 1}
+
+    def best(self, meta_dir) -> Dict[str, dict]:
+        """trackId -> 该 trackId 最大的图片（与原 build_img_index 的选择规则一致），调用前应先 refresh"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path, track_id, size, mtime_ns, width, height, sha1 FROM covers "
+                "WHERE dir = ? ORDER BY size, path DESC", (os.path.abspath(meta_dir),)).fetchall()
+        # 按大小升序写入，同一 trackId 留下最大的
+        return {row[1]: self._entry(row) for row in rows}
+
+    def best_paths(self, meta_dir) -> Dict[str, str]:
+        """trackId -> 最大图片的路径（只取路径，比 best 快）"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT track_id, path FROM covers WHERE dir = ? ORDER BY size, path DESC",
+                (os.path.abspath(meta_dir),)).fetchall()
+        return dict(rows)
+
+    def digests(self, meta_dir) -> Dict[str, Tuple[str, int, int]]:
+        """
+        路径 -> (内容哈希 sha1, 大小, mtime_ns)，供封面缓存在不读文件的情况下识别相同的封面；
+        大小和 mtime 用来在使用前核对文件是否在索引之后被原地覆盖
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path, sha1, size, mtime_ns FROM covers WHERE dir = ? AND sha1 IS NOT NULL",
+                (os.path.abspath(meta_dir),)).fetchall()
+        return {path: (sha1, size, mtime_ns) for path, sha1, size, mtime_ns in rows}
+
+    @staticmethod
+    def _entry(row) -> dict:
+        return {
+            "path": row[0],
+            "track_id": row[1],
+            "size": row[2],
+            "mtime_ns": row[3],
+            "width": row[4],
+            "height": row[5],
+            "sha1": row[6],
+        }
+
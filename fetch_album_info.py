@@ -7,11 +7,14 @@
 
 import os
 import sys
-import json
 import time
-import requests
+import queue
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Optional, List
+from typing import Dict, Optional, List, Tuple
 from tqdm import tqdm
 import unicodedata
 import re
@@ -23,28 +26,48 @@ from mutagen.mp4 import MP4
 from mutagen.easyid3 import EasyID3
 from mutagen import File as MFile
 
+# 网易云API客户端
+from netease_api import get_client, configure_client
+
+
+class StageTimer:
+    """按阶段累计耗时和次数（多个线程共用），用于最后的汇总"""
+
+    def __init__(self):
+        self.total = Counter()
+        self.count = Counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.total[name] += elapsed
+                self.count[name] += 1
+
+    def report(self) -> List[str]:
+        lines = []
+        for name, total in self.total.items():
+            n = self.count[name]
+            lines.append(f"  {name}: {total:.1f}s，{n} 次，平均 {total / n * 1000:.1f}ms")
+        return lines
+
+
+stage_times = StageTimer()
+
 
 def get_lyrics(song_id: int) -> Optional[str]:
     """获取歌词（带时间轴的LRC格式）"""
     if not song_id:
         return None
 
-    headers = {
-        "User-Agent": "Mozilla/5.0",
-        "Referer": "https://music.163.com"
-    }
-
     try:
-        url = "https://music.163.com/api/song/lyric"
-        params = {
-            "id": song_id,
-            "lv": 1,  # 原始歌词
-            "tv": 1  # 翻译歌词
-        }
-
-        resp = requests.get(url, params=params, headers=headers, timeout=10)
-        resp.raise_for_status()
-        result = resp.json()
+        with stage_times.stage("歌词"):
+            result = get_client().lyric(song_id)
 
         # 获取原始歌词
         lrc = None
@@ -68,167 +91,143 @@ def get_lyrics(song_id: int) -> Optional[str]:
 
 
 # NCM元数据读取（如果需要）
-import struct
-import binascii
-import base64
-from Crypto.Cipher import AES
-
-# 固定密钥
-CORE_KEY = binascii.a2b_hex('687A4852416D736F356B496E62617857')
-META_KEY = binascii.a2b_hex('2331346C6A6B5F215C5D2630553C2728')
-
-
-def unpad(s):
-    """移除PKCS7填充"""
-    if not s:
-        return s
-    pad = s[-1] if isinstance(s[-1], int) else ord(s[-1])
-    if pad > len(s) or pad == 0:
-        return s
-    return s[:-pad]
+import ncm_container
+from ncm_index import open_index
 
 
 def read_ncm_meta(ncm_path: str) -> Optional[dict]:
     """读取NCM文件的元数据"""
     try:
-        with open(ncm_path, 'rb') as f:
-            # 验证文件头
-            if binascii.b2a_hex(f.read(8)) != b'4354454e4644414d':
-                return None
-            f.seek(2, 1)
-
-            # 读取并解密密钥
-            key_len = struct.unpack('<I', f.read(4))[0]
-            key_data = bytearray(f.read(key_len))
-            for i in range(len(key_data)):
-                key_data[i] ^= 0x64
-
-            cipher = AES.new(CORE_KEY, AES.MODE_ECB)
-            key_data = unpad(cipher.decrypt(bytes(key_data)))[17:]
-
-            # 跳到meta区
-            meta_len = struct.unpack('<I', f.read(4))[0]
-            if meta_len == 0:
-                return None
-
-            meta_data = bytearray(f.read(meta_len))
-            for i in range(len(meta_data)):
-                meta_data[i] ^= 0x63
-
-            meta_data = base64.b64decode(bytes(meta_data)[22:])
-            cipher = AES.new(META_KEY, AES.MODE_ECB)
-            meta_data = unpad(cipher.decrypt(meta_data))
-
-            meta = json.loads(meta_data.decode('utf-8')[6:])
-            return meta
+        return ncm_container.read_ncm_meta(ncm_path)
     except Exception as e:
         print(f"读取NCM元数据失败: {e}")
         return None
 
 
-def search_song_info(title: str, artist: str = "") -> Optional[Dict]:
-    """搜索歌曲获取详细信息"""
-    headers = {
-        "User-Agent": "Mozilla/5.0",
-        "Referer": "https://music.163.com",
-        "Content-Type": "application/x-www-form-urlencoded",
-    }
-
+def search_first_song(title: str, artist: str = "") -> Optional[Dict]:
+    """搜索歌曲，返回第一个匹配的结果"""
     # 构建搜索关键词
     query = f"{artist} {title}".strip() if artist else title
 
     try:
         # 使用网易云搜索API
-        url = "https://music.163.com/api/search/get/web"
-        data = {
-            "csrf_token": "",
-            "type": 1,
-            "s": query,
-            "offset": 0,
-            "total": "true",
-            "limit": 10
-        }
-
-        resp = requests.post(url, data=data, headers=headers, timeout=10)
-        resp.raise_for_status()
-        result = resp.json()
-
-        songs = result.get("result", {}).get("songs", [])
-        if not songs:
-            return None
-
-        # 返回第一个匹配的结果
-        song = songs[0]
-
-        # 获取更详细的歌曲信息
-        song_id = song.get("id")
-        if song_id:
-            detail = get_song_detail(song_id)
-            if detail:
-                return detail
-
-        # 如果获取详情失败，返回基础信息
-        return {
-            "title": song.get("name", ""),
-            "artist": " / ".join([a.get("name", "") for a in song.get("artists", [])]),
-            "album": song.get("album", {}).get("name", ""),
-            "albumartist": " / ".join([a.get("name", "") for a in song.get("album", {}).get("artists", [])]),
-            "date": "",
-            "genre": "",
-            "tracknumber": str(song.get("position", "")),
-            "discnumber": str(song.get("disc", ""))
-        }
+        with stage_times.stage("搜索"):
+            songs = get_client().search(query, limit=10)
+        return songs[0] if songs else None
 
     except Exception as e:
         print(f"搜索失败: {e}")
         return None
 
 
-def get_song_detail(song_id: int) -> Optional[Dict]:
-    """获取歌曲详细信息"""
-    headers = {
-        "User-Agent": "Mozilla/5.0",
-        "Referer": "https://music.163.com"
+def _basic_song_info(song: Dict) -> Dict:
+    """搜索结果中的基础信息（获取详情失败时使用）"""
+    return {
+        "title": song.get("name", ""),
+        "artist": " / ".join([a.get("name", "") for a in song.get("artists", [])]),
+        "album": song.get("album", {}).get("name", ""),
+        "albumartist": " / ".join([a.get("name", "") for a in song.get("album", {}).get("artists", [])]),
+        "date": "",
+        "genre": "",
+        "tracknumber": str(song.get("position", "")),
+        "discnumber": str(song.get("disc", ""))
     }
 
+
+def search_song_info(title: str, artist: str = "") -> Optional[Dict]:
+    """搜索歌曲获取详细信息"""
+    song = search_first_song(title, artist)
+    if not song:
+        return None
+
+    # 获取更详细的歌曲信息
+    song_id = song.get("id")
+    if song_id:
+        detail = get_song_detail(song_id)
+        if detail:
+            return detail
+
+    # 如果获取详情失败，返回基础信息
+    return _basic_song_info(song)
+
+
+# musicId -> 批量预取的歌曲详情（None 表示服务端没有返回）
+_prefetched_details: Dict[int, Optional[Dict]] = {}
+
+
+# 预取详情前已检查过标签的文件 -> 是否已有完整标签，lookup_track 不再重复读取
+_complete_tags: Dict[str, bool] = {}
+
+
+def has_complete_tags(audio_path: str) -> bool:
+    """已有专辑和艺术家标签（读取失败按没有处理）"""
     try:
-        # 使用详情API
-        url = "https://music.163.com/api/song/detail"
-        params = {
-            "id": song_id,
-            "ids": f"[{song_id}]"
-        }
+        with stage_times.stage("读取标签"):
+            audio = MFile(audio_path)
+        return bool(audio and audio.get("album") and audio.get("artist"))
+    except Exception:
+        return False
 
-        resp = requests.get(url, params=params, headers=headers, timeout=10)
-        resp.raise_for_status()
-        result = resp.json()
 
-        songs = result.get("songs", [])
+def prefetch_song_details(song_ids) -> int:
+    """
+    按批量请求预取歌曲详情，之后 get_song_detail 直接使用预取结果
+    返回预取的 ID 数
+    """
+    ids = [int(i) for i in dict.fromkeys(song_ids) if i and int(i) not in _prefetched_details]
+    if not ids:
+        return 0
+    try:
+        songs = get_client().song_details(ids)
+    except Exception as e:
+        print(f"批量获取详情失败: {e}")
+        return 0
+    for song_id in ids:
+        song = songs.get(song_id)
+        _prefetched_details[song_id] = _song_detail_info(song, song_id) if song else None
+    return len(ids)
+
+
+def _song_detail_info(song: Dict, song_id: int) -> Dict:
+    album = song.get("album", {})
+
+    # 提取发行日期
+    publish_time = album.get("publishTime", 0)
+    if publish_time:
+        date = time.strftime("%Y-%m-%d", time.localtime(publish_time / 1000))
+    else:
+        date = ""
+
+    return {
+        "title": song.get("name", ""),
+        "artist": " / ".join([a.get("name", "") for a in song.get("artists", [])]),
+        "album": album.get("name", ""),
+        "albumartist": " / ".join([a.get("name", "") for a in album.get("artists", [])]),
+        "date": date,
+        "genre": "",  # 网易云API不提供流派信息
+        "tracknumber": str(song.get("position", "")),
+        "discnumber": str(song.get("disc", "")),
+        "comment": album.get("description", "")[:500] if album.get("description") else "",
+        "song_id": song_id  # 保存ID用于获取歌词
+    }
+
+
+def get_song_detail(song_id: int) -> Optional[Dict]:
+    """获取歌曲详细信息（已批量预取的直接返回）"""
+    try:
+        if int(song_id) in _prefetched_details:
+            return _prefetched_details[int(song_id)]
+    except (TypeError, ValueError):
+        pass
+
+    try:
+        # 使用详情API
+        with stage_times.stage("详情"):
+            songs = get_client().song_detail(song_id)
         if not songs:
             return None
 
-        song = songs[0]
-        album = song.get("album", {})
-
-        # 提取发行日期
-        publish_time = album.get("publishTime", 0)
-        if publish_time:
-            date = time.strftime("%Y-%m-%d", time.localtime(publish_time / 1000))
-        else:
-            date = ""
-
-        return {
-            "title": song.get("name", ""),
-            "artist": " / ".join([a.get("name", "") for a in song.get("artists", [])]),
-            "album": album.get("name", ""),
-            "albumartist": " / ".join([a.get("name", "") for a in album.get("artists", [])]),
-            "date": date,
-            "genre": "",  # 网易云API不提供流派信息
-            "tracknumber": str(song.get("position", "")),
-            "discnumber": str(song.get("disc", "")),
-            "comment": album.get("description", "")[:500] if album.get("description") else "",
-            "song_id": song_id  # 保存ID用于获取歌词
-        }
+        return _song_detail_info(songs[0], song_id)
 
     except Exception as e:
         print(f"获取详情失败: {e}")
@@ -331,84 +330,189 @@ def parse_filename(filename: str) -> tuple:
     return stem, ""
 
 
-def process_audio_file(audio_path: str, ncm_path: str = None, force_update: bool = False,
-                       save_lyrics: bool = True) -> bool:
-    """处理单个音频文件"""
+def lookup_track(audio_path: str, ncm_path: str = None, force_update: bool = False,
+                 want_lyrics: bool = True, ncm_meta: Optional[dict] = None, log=print,
+                 request_pool: Optional[ThreadPoolExecutor] = None) -> Tuple[str, Optional[Dict], Optional[str]]:
+    """
+    查找单个文件的专辑信息和歌词（读取标签和网络请求，不写文件）
+    request_pool 不为空时同一首歌的详情和歌词请求同时进行
+    返回 (状态, 歌曲信息, 歌词)，状态为 "跳过" / "找到" / "未找到"
+    """
     filename = Path(audio_path).name
 
     # 检查是否已有完整标签
     if not force_update:
-        try:
-            audio = MFile(audio_path)
-            if audio and audio.get("album") and audio.get("artist"):
-                print(f"跳过 {filename} (已有完整标签)")
-                return True
-        except:
-            pass
+        complete = _complete_tags.pop(audio_path, None)
+        if complete is None:
+            complete = has_complete_tags(audio_path)
+        if complete:
+            log(f"跳过 {filename} (已有完整标签)")
+            return "跳过", None, None
 
     # 首先尝试从对应的NCM文件获取信息
     song_info = None
+    song_id = None
+
+    meta = ncm_meta
+    if meta is None and ncm_path and Path(ncm_path).exists():
+        with stage_times.stage("读取NCM"):
+            meta = read_ncm_meta(ncm_path)
+    if meta:
+        # 从NCM元数据构建信息
+        song_info = {
+            "title": meta.get("musicName", ""),
+            "artist": " / ".join([a[0] for a in meta.get("artist", [])]),
+            "album": meta.get("album", ""),
+            "albumartist": " / ".join([a[0] for a in meta.get("artist", [])]),
+            "date": "",
+            "genre": "",
+            "tracknumber": "",
+            "discnumber": "",
+            "song_id": meta.get("musicId")  # 保存音乐ID
+        }
+        song_id = meta.get("musicId")
+    else:
+        # 如果没有NCM信息，从文件名解析并搜索
+        title, artist = parse_filename(filename)
+        song = search_first_song(title, artist)
+        if song:
+            song_info = _basic_song_info(song)
+            song_id = song.get("id")
 
-    if ncm_path and Path(ncm_path).exists():
-        meta = read_ncm_meta(ncm_path)
-        if meta:
-            # 从NCM元数据构建信息
-            song_info = {
-                "title": meta.get("musicName", ""),
-                "artist": " / ".join([a[0] for a in meta.get("artist", [])]),
-                "album": meta.get("album", ""),
-                "albumartist": " / ".join([a[0] for a in meta.get("artist", [])]),
-                "date": "",
-                "genre": "",
-                "tracknumber": "",
-                "discnumber": "",
-                "song_id": meta.get("musicId")  # 保存音乐ID
-            }
-
-            # 如果有musicId，尝试获取更详细信息
-            music_id = meta.get("musicId")
-            if music_id:
-                detail = get_song_detail(music_id)
-                if detail:
-                    song_info.update(detail)
-
-    # 如果没有从NCM获取到信息，从文件名解析并搜索
     if not song_info:
-        title, artist = parse_filename(filename)
-        song_info = search_song_info(title, artist)
-
-    if song_info:
-        print(f"更新 {filename}")
-        print(f"  标题: {song_info.get('title', '')}")
-        print(f"  艺术家: {song_info.get('artist', '')}")
-        print(f"  专辑: {song_info.get('album', '')}")
-        print(f"  日期: {song_info.get('date', '')}")
-
-        # 获取并保存歌词
-        if save_lyrics and song_info.get('song_id'):
-            lyrics = get_lyrics(song_info.get('song_id'))
-            if lyrics:
-                # 保存为独立的LRC文件
-                lrc_path = Path(audio_path).with_suffix('.lrc')
-                try:
-                    with open(lrc_path, 'w', encoding='utf-8') as f:
-                        f.write(lyrics)
-                    print(f"  ✓ 已保存歌词: {lrc_path.name}")
-                except:
-                    print(f"  ⚠ 保存歌词失败")
-
-        # 移除song_id（不需要写入标签）
-        song_info.pop('song_id', None)
-
-        if update_audio_tags(audio_path, song_info):
-            print(f"  ✅ 成功")
-            return True
-        else:
-            print(f"  ❌ 失败")
-            return False
-    else:
-        print(f"❌ 未找到 {filename} 的信息")
+        log(f"❌ 未找到 {filename} 的信息")
+        return "未找到", None, None
+
+    # 详情和歌词都只依赖歌曲ID，并发模式下同时请求
+    lyrics_future = None
+    if want_lyrics and song_id and request_pool is not None:
+        lyrics_future = request_pool.submit(get_lyrics, song_id)
+
+    # 如果有musicId，尝试获取更详细信息
+    if song_id:
+        detail = get_song_detail(song_id)
+        if detail:
+            song_info.update(detail)
+
+    lyrics = None
+    if lyrics_future is not None:
+        lyrics = lyrics_future.result()
+    elif want_lyrics and song_id:
+        lyrics = get_lyrics(song_id)
+
+    log(f"更新 {filename}")
+    log(f"  标题: {song_info.get('title', '')}")
+    log(f"  艺术家: {song_info.get('artist', '')}")
+    log(f"  专辑: {song_info.get('album', '')}")
+    log(f"  日期: {song_info.get('date', '')}")
+    return "找到", song_info, lyrics
+
+
+def write_track(audio_path: str, song_info: Dict, lyrics: Optional[str] = None, log=print) -> bool:
+    """保存歌词文件并写入标签（写盘阶段）"""
+    if lyrics:
+        # 保存为独立的LRC文件
+        lrc_path = Path(audio_path).with_suffix('.lrc')
+        try:
+            with open(lrc_path, 'w', encoding='utf-8') as f:
+                f.write(lyrics)
+            log(f"  ✓ 已保存歌词: {lrc_path.name}")
+        except:
+            log(f"  ⚠ 保存歌词失败")
+
+    # 移除song_id（不需要写入标签）
+    song_info.pop('song_id', None)
+
+    with stage_times.stage("写标签"):
+        ok = update_audio_tags(audio_path, song_info)
+    log(f"  ✅ 成功" if ok else f"  ❌ 失败")
+    return ok
+
+
+def process_audio_file(audio_path: str, ncm_path: str = None, force_update: bool = False,
+                       save_lyrics: bool = True, ncm_meta: Optional[dict] = None) -> bool:
+    """处理单个音频文件（ncm_meta 为已从索引取得的NCM元数据，提供时不再读取NCM文件）"""
+    status, song_info, lyrics = lookup_track(audio_path, ncm_path, force_update, save_lyrics, ncm_meta)
+    if status == "跳过":
+        return True
+    if status == "未找到":
         return False
+    return write_track(audio_path, song_info, lyrics)
+
+
+def process_files_concurrently(jobs, workers: int, force_update: bool = False,
+                               save_lyrics: bool = True) -> Counter:
+    """
+    并发处理: workers 个线程同时查找（每首歌的详情和歌词请求也同时进行），
+    查到的结果放进队列，由单独的写入线程依次写歌词文件和标签
+    jobs 为 (音频路径, NCM路径, NCM元数据) 列表；每个文件的输出在完成后整体打印，
+    返回结果统计（成功 / 跳过 / 各失败原因的文件数）
+    """
+    results = Counter()
+    lock = threading.Lock()
+    bar = tqdm(total=len(jobs), desc="处理进度")
+    # 写入跟不上时查找线程在 put 处等待，内存中最多积压 workers * 2 个结果
+    write_queue = queue.Queue(maxsize=workers * 2)
+
+    def finish(lines, outcome):
+        with lock:
+            results[outcome] += 1
+            bar.update(1)
+            if lines:
+                tqdm.write("\n".join(lines))
+
+    def writer():
+        while True:
+            item = write_queue.get()
+            if item is None:
+                return
+            audio_path, song_info, lyrics, lines = item
+            try:
+                ok = write_track(audio_path, song_info, lyrics, log=lines.append)
+            except Exception as e:
+                lines.append(f"  ❌ 写入失败: {e}")
+                ok = False
+            finish(lines, "成功" if ok else "写入失败")
+
+    def lookup(audio_path, ncm_path, ncm_meta):
+        lines = []
+        try:
+            status, song_info, lyrics = lookup_track(audio_path, ncm_path, force_update, save_lyrics, ncm_meta,
+                                                     log=lines.append, request_pool=request_pool)
+        except Exception as e:
+            lines.append(f"❌ {Path(audio_path).name} 出错: {e}")
+            status = "出错"
+        if status == "找到":
+            write_queue.put((audio_path, song_info, lyrics, lines))
+        else:
+            finish(lines, status)
+
+    # 写入线程不设为守护线程：退出前总是放入结束标记并等它写完当前文件，不会在写标签中途被杀掉
+    writer_thread = threading.Thread(target=writer, name="album-writer")
+    writer_thread.start()
+    request_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="album-request")
+    lookup_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="album-lookup")
+    try:
+        for future in [lookup_pool.submit(lookup, *job) for job in jobs]:
+            future.result()
+    except KeyboardInterrupt:
+        # 取消还在排队的查找和请求，丢弃还没开始写入的结果
+        tqdm.write(f"\n⚠️ 已中断，正在取消剩余任务（已完成 {sum(results.values())} 个）...")
+        lookup_pool.shutdown(wait=True, cancel_futures=True)
+        request_pool.shutdown(wait=True, cancel_futures=True)
+        while True:
+            try:
+                write_queue.get_nowait()
+            except queue.Empty:
+                break
+        raise
+    finally:
+        lookup_pool.shutdown()
+        request_pool.shutdown()
+        write_queue.put(None)
+        writer_thread.join()
+        bar.close()
+    return results
 
 
 def main():
@@ -417,11 +521,23 @@ def main():
     parser = argparse.ArgumentParser(description="专辑信息抓取工具")
     parser.add_argument("audio_dir", help="音频文件目录")
     parser.add_argument("--ncm_dir", help="NCM文件目录（可选）")
+    parser.add_argument("--index", help="NCM元数据索引文件路径（默认 ~/.cache/ncm-decoding/ncm_index.sqlite）")
+    parser.add_argument("--no-index", action="store_true", help="不使用NCM元数据索引，每次直接读取NCM文件")
     parser.add_argument("--force", action="store_true", help="强制更新已有标签的文件")
     parser.add_argument("--no-lyrics", action="store_true", help="不获取歌词")
     parser.add_argument("--limit", type=int, help="限制处理文件数量")
+    parser.add_argument("--no-cache", action="store_true", help="不使用API响应缓存，全部重新请求")
+    parser.add_argument("--workers", type=int, default=1, help="同时处理的文件数（默认 1，逐个处理）")
 
     args = parser.parse_args()
+    client_options = {}
+    if args.no_cache:
+        client_options["use_cache"] = False
+    if args.workers * 2 > 8:
+        # 每个文件同时有详情和歌词两个请求，默认客户端最多同时 8 个请求
+        client_options["concurrency"] = args.workers * 2
+    if client_options:
+        configure_client(**client_options)
 
     audio_dir = Path(args.audio_dir)
     if not audio_dir.exists():
@@ -442,28 +558,72 @@ def main():
 
     print(f"找到 {len(audio_files)} 个音频文件")
 
-    # 处理文件
-    success = 0
-    failed = 0
-
-    for audio_path in tqdm(audio_files, desc="处理进度"):
-        # 查找对应的NCM文件
+    # NCM 元数据索引：未变化的 NCM 文件不再读取
+    ncm_entries = {}
+    if args.ncm_dir and not args.no_index:
+        with open_index(args.ncm_dir, args.index) as ncm_index:
+            ncm_entries = ncm_index.by_stem(args.ncm_dir)
+
+    # 有 NCM 元数据的文件已知 musicId，详情按批量请求一次取回；
+    # 已有完整标签的文件会被跳过，先检查标签（--workers 时多线程读取），不为它们预取详情
+    with_meta = [(str(audio_path), ncm_entries[audio_path.stem]) for audio_path in audio_files
+                 if audio_path.stem in ncm_entries]
+    if not args.force and with_meta:
+        paths = [audio_path for audio_path, _ in with_meta]
+        with ThreadPoolExecutor(max_workers=max(args.workers, 1), thread_name_prefix="album-tags") as pool:
+            _complete_tags.update(zip(paths, pool.map(has_complete_tags, paths)))
+    music_ids = [(entry["meta"] or {}).get("musicId") for audio_path, entry in with_meta
+                 if not _complete_tags.get(audio_path)]
+    if music_ids:
+        client = get_client()
+        before = client.request_count
+        with stage_times.stage("批量详情"):
+            count = prefetch_song_details(music_ids)
+        if count:
+            print(f"批量获取歌曲详情: {count} 个ID，{client.request_count - before} 次请求")
+
+    # 查找对应的NCM文件
+    jobs = []
+    for audio_path in audio_files:
         ncm_path = None
-        if args.ncm_dir:
+        ncm_meta = None
+        entry = ncm_entries.get(audio_path.stem)
+        if entry:
+            ncm_path = entry["path"]
+            ncm_meta = entry["meta"]
+        elif args.ncm_dir and args.no_index:
             ncm_dir = Path(args.ncm_dir)
             ncm_file = ncm_dir / f"{audio_path.stem}.ncm"
             if ncm_file.exists():
                 ncm_path = str(ncm_file)
+        jobs.append((str(audio_path), ncm_path, ncm_meta))
 
-        # 添加延迟避免请求过快
-        time.sleep(0.5)
-
-        if process_audio_file(str(audio_path), ncm_path, args.force, save_lyrics=not args.no_lyrics):
-            success += 1
-        else:
-            failed += 1
-
+    start = time.perf_counter()
+    if args.workers > 1:
+        try:
+            results = process_files_concurrently(jobs, args.workers, args.force, save_lyrics=not args.no_lyrics)
+        except KeyboardInterrupt:
+            print("⚠️ 用户中断")
+            sys.exit(130)
+    else:
+        results = Counter()
+        for audio_path, ncm_path, ncm_meta in tqdm(jobs, desc="处理进度"):
+            if process_audio_file(audio_path, ncm_path, args.force, save_lyrics=not args.no_lyrics,
+                                  ncm_meta=ncm_meta):
+                results["成功"] += 1
+            else:
+                results["失败"] += 1
+    elapsed = time.perf_counter() - start
+
+    success = results.pop("成功", 0) + results.pop("跳过", 0)
+    failed = sum(results.values())
     print(f"\n完成: 成功 {success}, 失败 {failed}")
+    if args.workers > 1 and results:
+        print("失败原因: " + "，".join(f"{reason} {n}" for reason, n in results.most_common()))
+    print(f"耗时 {elapsed:.1f}s（{len(jobs) / max(elapsed, 1e-9):.1f} 首/秒），各阶段累计耗时:")
+    for line in stage_times.report():
+        print(line)
+    print(get_client().summary())
 
 
 if __name__ == "__main__":
@@ -7,9 +7,10 @@
 
 import os
 import sys
-import json
 import time
-import requests
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Dict, Optional, Tuple
 from tqdm import tqdm
@@ -23,121 +24,44 @@ from mutagen.mp3 import MP3
 from mutagen.mp4 import MP4
 
 # NCM元数据读取
-import struct
-import binascii
-import base64
-from Crypto.Cipher import AES
+import ncm_container
+from ncm_index import open_index
+from netease_api import get_client, configure_client
 
-# 固定密钥
-CORE_KEY = binascii.a2b_hex('687A4852416D736F356B496E62617857')
-META_KEY = binascii.a2b_hex('2331346C6A6B5F215C5D2630553C2728')
 
-
-def unpad(s):
-    """移除PKCS7填充"""
-    if not s:
-        return s
-    pad = s[-1] if isinstance(s[-1], int) else ord(s[-1])
-    if pad > len(s) or pad == 0:
-        return s
-    return s[:-pad]
-
-
-def read_ncm_meta(ncm_path: str) -> Optional[dict]:
+def read_ncm_meta(ncm_path: str, log=print) -> Optional[dict]:
     """读取NCM文件的元数据"""
     try:
-        with open(ncm_path, 'rb') as f:
-            # 验证文件头
-            if binascii.b2a_hex(f.read(8)) != b'4354454e4644414d':
-                return None
-            f.seek(2, 1)
-
-            # 读取并解密密钥
-            key_len = struct.unpack('<I', f.read(4))[0]
-            key_data = bytearray(f.read(key_len))
-            for i in range(len(key_data)):
-                key_data[i] ^= 0x64
-
-            cipher = AES.new(CORE_KEY, AES.MODE_ECB)
-            key_data = unpad(cipher.decrypt(bytes(key_data)))[17:]
-
-            # 跳到meta区
-            meta_len = struct.unpack('<I', f.read(4))[0]
-            if meta_len == 0:
-                return None
-
-            meta_data = bytearray(f.read(meta_len))
-            for i in range(len(meta_data)):
-                meta_data[i] ^= 0x63
-
-            meta_data = base64.b64decode(bytes(meta_data)[22:])
-            cipher = AES.new(META_KEY, AES.MODE_ECB)
-            meta_data = unpad(cipher.decrypt(meta_data))
-
-            meta = json.loads(meta_data.decode('utf-8')[6:])
-            return meta
+        return ncm_container.read_ncm_meta(ncm_path)
     except Exception as e:
-        print(f"读取NCM元数据失败: {e}")
+        log(f"  读取NCM元数据失败: {e}")
         return None
 
 
-def search_song(title: str, artist: str = "") -> Optional[int]:
+def search_song(title: str, artist: str = "", log=print) -> Optional[int]:
     """搜索歌曲获取ID"""
-    headers = {
-        "User-Agent": "Mozilla/5.0",
-        "Referer": "https://music.163.com",
-    }
-
     query = f"{artist} {title}".strip() if artist else title
 
     try:
         # 使用网易云搜索API
-        url = "https://music.163.com/api/search/get/web"
-        data = {
-            "csrf_token": "",
-            "type": 1,
-            "s": query,
-            "offset": 0,
-            "total": "true",
-            "limit": 5
-        }
-
-        resp = requests.post(url, data=data, headers=headers, timeout=10)
-        resp.raise_for_status()
-        result = resp.json()
-
-        songs = result.get("result", {}).get("songs", [])
+        songs = get_client().search(query, limit=5)
         if songs:
             return songs[0].get("id")
 
         return None
 
     except Exception as e:
-        print(f"搜索歌曲失败: {e}")
+        log(f"  搜索歌曲失败: {e}")
         return None
 
 
-def get_lyrics(song_id: int) -> Tuple[Optional[str], Optional[str]]:
+def get_lyrics(song_id: int, log=print) -> Tuple[Optional[str], Optional[str]]:
     """
     获取歌词
     返回: (lrc歌词, 翻译歌词)
     """
-    headers = {
-        "User-Agent": "Mozilla/5.0",
-        "Referer": "https://music.163.com"
-    }
-
     try:
-        url = "https://music.163.com/api/song/lyric"
-        params = {
-            "id": song_id,
-            "lv": 1,  # 原始歌词
-            "tv": 1  # 翻译歌词
-        }
-
-        resp = requests.get(url, params=params, headers=headers, timeout=10)
-        resp.raise_for_status()
-        result = resp.json()
+        result = get_client().lyric(song_id)
 
         # 获取原始歌词
         lrc = None
@@ -152,7 +76,7 @@ def get_lyrics(song_id: int) -> Tuple[Optional[str], Optional[str]]:
         return lrc, tlrc
 
     except Exception as e:
-        print(f"获取歌词失败: {e}")
+        log(f"  获取歌词失败: {e}")
         return None, None
 
 
@@ -211,18 +135,18 @@ def merge_lyrics(lrc: str, tlrc: str = None) -> str:
     return '\n'.join(merged)
 
 
-def save_lyrics(lyrics: str, output_path: str):
+def save_lyrics(lyrics: str, output_path: str, log=print):
     """保存歌词到文件"""
     try:
         with open(output_path, 'w', encoding='utf-8') as f:
             f.write(lyrics)
         return True
     except Exception as e:
-        print(f"保存歌词失败: {e}")
+        log(f"  保存歌词失败: {e}")
         return False
 
 
-def embed_lyrics_to_audio(audio_path: str, lyrics: str) -> bool:
+def embed_lyrics_to_audio(audio_path: str, lyrics: str, log=print) -> bool:
     """
     将歌词嵌入音频文件
     注意：只有部分格式支持嵌入歌词
@@ -256,11 +180,11 @@ def embed_lyrics_to_audio(audio_path: str, lyrics: str) -> bool:
             return True
 
         else:
-            print(f"格式 {ext} 不支持嵌入歌词")
+            log(f"  格式 {ext} 不支持嵌入歌词")
             return False
 
     except Exception as e:
-        print(f"嵌入歌词失败: {e}")
+        log(f"  嵌入歌词失败: {e}")
         return False
 
 
@@ -286,32 +210,25 @@ def parse_filename(filename: str) -> tuple:
     return stem, ""
 
 
-def process_audio_file(audio_path: str, ncm_path: str = None,
-                       save_lrc: bool = True, embed: bool = True,
-                       merge_translation: bool = True) -> bool:
+def find_lyrics(audio_path: str, ncm_path: str = None, merge_translation: bool = True,
+                ncm_meta: Optional[dict] = None, log=print) -> Tuple[Optional[str], Optional[str]]:
     """
-    处理单个音频文件
-
-    Args:
-        audio_path: 音频文件路径
-        ncm_path: 对应的NCM文件路径（可选）
-        save_lrc: 是否保存为独立的LRC文件
-        embed: 是否尝试嵌入到音频文件
-        merge_translation: 是否合并翻译
+    查找单个音频文件的歌词（读取标签和网络请求，不写文件）
+    返回: (最终歌词, 失败原因)，找到歌词时失败原因为 None
     """
     filename = Path(audio_path).name
-    print(f"\n处理: {filename}")
 
     # 获取歌曲ID
     song_id = None
 
     # 首先尝试从NCM文件获取
-    if ncm_path and Path(ncm_path).exists():
-        meta = read_ncm_meta(ncm_path)
-        if meta:
-            song_id = meta.get("musicId")
-            if song_id:
-                print(f"  从NCM获取ID: {song_id}")
+    meta = ncm_meta
+    if meta is None and ncm_path and Path(ncm_path).exists():
+        meta = read_ncm_meta(ncm_path, log)
+    if meta:
+        song_id = meta.get("musicId")
+        if song_id:
+            log(f"  从NCM获取ID: {song_id}")
 
     # 如果没有从NCM获取到，尝试搜索
     if not song_id:
@@ -327,65 +244,162 @@ def process_audio_file(audio_path: str, ncm_path: str = None,
                     title, artist = parse_filename(filename)
 
                 if title:
-                    print(f"  搜索: {artist} - {title}" if artist else f"  搜索: {title}")
-                    song_id = search_song(title, artist)
+                    log(f"  搜索: {artist} - {title}" if artist else f"  搜索: {title}")
+                    song_id = search_song(title, artist, log)
         except:
             # 如果读取失败，从文件名解析
             title, artist = parse_filename(filename)
             if title:
-                song_id = search_song(title, artist)
+                song_id = search_song(title, artist, log)
 
     if not song_id:
-        print(f"  ❌ 未找到歌曲ID")
-        return False
+        log(f"  ❌ 未找到歌曲ID")
+        return None, "未找到歌曲ID"
 
     # 获取歌词
-    print(f"  获取歌词...")
-    lrc, tlrc = get_lyrics(song_id)
+    log(f"  获取歌词...")
+    lrc, tlrc = get_lyrics(song_id, log)
 
     if not lrc:
-        print(f"  ❌ 未找到歌词")
-        return False
+        log(f"  ❌ 未找到歌词")
+        return None, "未找到歌词"
 
     # 合并歌词
     if merge_translation and tlrc:
-        final_lyrics = merge_lyrics(lrc, tlrc)
-        print(f"  ✓ 已合并翻译歌词")
-    else:
-        final_lyrics = lrc
+        log(f"  ✓ 已合并翻译歌词")
+        return merge_lyrics(lrc, tlrc), None
+    return lrc, None
+
 
+def write_lyrics(audio_path: str, lyrics: str, save_lrc: bool = True, embed: bool = True, log=print) -> bool:
+    """保存LRC文件并嵌入音频文件（写盘阶段），任一成功即返回 True"""
     success = False
 
     # 保存为LRC文件
     if save_lrc:
         lrc_path = Path(audio_path).with_suffix('.lrc')
-        if save_lyrics(final_lyrics, str(lrc_path)):
-            print(f"  ✓ 已保存LRC: {lrc_path.name}")
+        if save_lyrics(lyrics, str(lrc_path), log):
+            log(f"  ✓ 已保存LRC: {lrc_path.name}")
             success = True
 
     # 嵌入到音频文件
     if embed:
-        if embed_lyrics_to_audio(audio_path, final_lyrics):
-            print(f"  ✓ 已嵌入歌词到音频文件")
+        if embed_lyrics_to_audio(audio_path, lyrics, log):
+            log(f"  ✓ 已嵌入歌词到音频文件")
             success = True
         else:
-            print(f"  ⚠ 无法嵌入歌词（格式限制）")
+            log(f"  ⚠ 无法嵌入歌词（格式限制）")
 
     return success
 
 
+def process_audio_file(audio_path: str, ncm_path: str = None,
+                       save_lrc: bool = True, embed: bool = True,
+                       merge_translation: bool = True,
+                       ncm_meta: Optional[dict] = None) -> bool:
+    """
+    处理单个音频文件
+
+    Args:
+        audio_path: 音频文件路径
+        ncm_path: 对应的NCM文件路径（可选）
+        save_lrc: 是否保存为独立的LRC文件
+        embed: 是否尝试嵌入到音频文件
+        merge_translation: 是否合并翻译
+        ncm_meta: 已从索引取得的NCM元数据（提供时不再读取NCM文件）
+    """
+    print(f"\n处理: {Path(audio_path).name}")
+
+    lyrics, _ = find_lyrics(audio_path, ncm_path, merge_translation, ncm_meta)
+    if not lyrics:
+        return False
+    return write_lyrics(audio_path, lyrics, save_lrc, embed)
+
+
+def process_files_concurrently(jobs, workers: int, writers: int = 2, save_lrc: bool = True,
+                               embed: bool = True, merge_translation: bool = True) -> Counter:
+    """
+    并发处理: workers 个线程同时查找歌词（网络请求重叠进行），
+    找到的歌词交给 writers 个写入线程保存，限制同时写盘的文件数
+    jobs 为 (音频路径, NCM路径, NCM元数据) 列表；每个文件的输出在完成后整体打印，
+    返回结果统计（成功 / 各失败原因的文件数）
+    """
+    results = Counter()
+    lock = threading.Lock()
+    bar = tqdm(total=len(jobs), desc="处理进度")
+
+    def finish(lines, outcome):
+        with lock:
+            results[outcome] += 1
+            bar.update(1)
+            tqdm.write("\n".join(lines))
+
+    def write_stage(audio_path, lyrics, lines):
+        try:
+            ok = write_lyrics(audio_path, lyrics, save_lrc, embed, log=lines.append)
+        except Exception as e:
+            lines.append(f"  ❌ 写入失败: {e}")
+            ok = False
+        finish(lines, "成功" if ok else "写入失败")
+
+    def lookup_stage(audio_path, ncm_path, ncm_meta):
+        lines = [f"\n处理: {Path(audio_path).name}"]
+        try:
+            lyrics, reason = find_lyrics(audio_path, ncm_path, merge_translation, ncm_meta, log=lines.append)
+        except Exception as e:
+            lyrics, reason = None, "出错"
+            lines.append(f"  ❌ 出错: {e}")
+        if lyrics:
+            return writer_pool.submit(write_stage, audio_path, lyrics, lines)
+        finish(lines, reason)
+        return None
+
+    writer_pool = ThreadPoolExecutor(max_workers=max(writers, 1), thread_name_prefix="lyrics-writer")
+    lookup_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="lyrics-lookup")
+    try:
+        lookups = [lookup_pool.submit(lookup_stage, *job) for job in jobs]
+        for future in lookups:
+            write_future = future.result()
+            if write_future is not None:
+                write_future.result()
+    except KeyboardInterrupt:
+        # 取消还在排队的查找和写入，只等正在进行的请求和写入结束
+        tqdm.write(f"\n⚠️ 已中断，正在取消剩余任务（已完成 {sum(results.values())} 个）...")
+        lookup_pool.shutdown(wait=True, cancel_futures=True)
+        writer_pool.shutdown(wait=True, cancel_futures=True)
+        bar.close()
+        raise
+    lookup_pool.shutdown()
+    writer_pool.shutdown()
+    bar.close()
+    return results
+
+
 def main():
     import argparse
 
     parser = argparse.ArgumentParser(description="歌词抓取工具")
     parser.add_argument("audio_dir", help="音频文件目录")
     parser.add_argument("--ncm_dir", help="NCM文件目录（可选）")
+    parser.add_argument("--index", help="NCM元数据索引文件路径（默认 ~/.cache/ncm-decoding/ncm_index.sqlite）")
+    parser.add_argument("--no-index", action="store_true", help="不使用NCM元数据索引，每次直接读取NCM文件")
     parser.add_argument("--no-lrc", action="store_true", help="不保存独立的LRC文件")
     parser.add_argument("--no-embed", action="store_true", help="不嵌入到音频文件")
     parser.add_argument("--no-translation", action="store_true", help="不合并翻译")
     parser.add_argument("--limit", type=int, help="限制处理文件数量")
+    parser.add_argument("--no-cache", action="store_true", help="不使用API响应缓存，全部重新请求")
+    parser.add_argument("--workers", type=int, default=1, help="同时查找歌词的线程数（默认 1，逐个处理）")
+    parser.add_argument("--writers", type=int, default=2, help="并发模式下写入LRC/音频文件的线程数（默认 2）")
 
     args = parser.parse_args()
+    client_options = {}
+    if args.no_cache:
+        client_options["use_cache"] = False
+    if args.workers > 8:
+        # 默认客户端最多同时 8 个请求，线程更多时放宽
+        client_options["concurrency"] = args.workers
+    if client_options:
+        configure_client(**client_options)
 
     audio_dir = Path(args.audio_dir)
     if not audio_dir.exists():
@@ -406,34 +420,63 @@ def main():
 
     print(f"找到 {len(audio_files)} 个音频文件")
 
-    # 处理文件
-    success = 0
-    failed = 0
+    # NCM 元数据索引：未变化的 NCM 文件不再读取
+    ncm_entries = {}
+    if args.ncm_dir and not args.no_index:
+        with open_index(args.ncm_dir, args.index) as ncm_index:
+            ncm_entries = ncm_index.by_stem(args.ncm_dir)
 
-    for audio_path in tqdm(audio_files, desc="处理进度"):
-        # 查找对应的NCM文件
+    # 查找对应的NCM文件
+    jobs = []
+    for audio_path in audio_files:
         ncm_path = None
-        if args.ncm_dir:
+        ncm_meta = None
+        entry = ncm_entries.get(audio_path.stem)
+        if entry:
+            ncm_path = entry["path"]
+            ncm_meta = entry["meta"]
+        elif args.ncm_dir and args.no_index:
             ncm_dir = Path(args.ncm_dir)
             ncm_file = ncm_dir / f"{audio_path.stem}.ncm"
             if ncm_file.exists():
                 ncm_path = str(ncm_file)
+        jobs.append((str(audio_path), ncm_path, ncm_meta))
 
-        # 添加延迟避免请求过快
-        time.sleep(0.3)
-
-        if process_audio_file(
-                str(audio_path),
-                ncm_path,
+    start = time.perf_counter()
+    if args.workers > 1:
+        try:
+            results = process_files_concurrently(
+                jobs, args.workers, args.writers,
                 save_lrc=not args.no_lrc,
                 embed=not args.no_embed,
                 merge_translation=not args.no_translation
-        ):
-            success += 1
-        else:
-            failed += 1
-
+            )
+        except KeyboardInterrupt:
+            print("⚠️ 用户中断")
+            sys.exit(130)
+    else:
+        results = Counter()
+        for audio_path, ncm_path, ncm_meta in tqdm(jobs, desc="处理进度"):
+            if process_audio_file(
+                    audio_path,
+                    ncm_path,
+                    save_lrc=not args.no_lrc,
+                    embed=not args.no_embed,
+                    merge_translation=not args.no_translation,
+                    ncm_meta=ncm_meta
+            ):
+                results["成功"] += 1
+            else:
+                results["失败"] += 1
+    elapsed = time.perf_counter() - start
+
+    success = results.pop("成功", 0)
+    failed = sum(results.values())
     print(f"\n完成: 成功 {success}, 失败 {failed}")
+    if args.workers > 1 and results:
+        print("失败原因: " + "，".join(f"{reason} {n}" for reason, n in results.most_common()))
+    print(f"耗时 {elapsed:.1f}s（{len(jobs) / max(elapsed, 1e-9):.1f} 首/秒）")
+    print(get_client().summary())
 
 
 if __name__ == "__main__":
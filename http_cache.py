@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+网易云 API 响应缓存
+以 接口 + 规范化参数 为键把 JSON 结果保存在 SQLite 中，按接口设置有效期；
+没有结果的查询也会缓存（较短的有效期），总大小超过上限时按最近访问时间淘汰
+"""
+
+import json
+import time
+import zlib
+import sqlite3
+import threading
+import unicodedata
+from collections import Counter
+from pathlib import Path
+from typing import Any, Tuple
+
+from ncm_index import cache_dir
+
+DAY = 86400
+
+# 各接口的有效期（秒）：搜索结果会随曲库变化，详情和歌词基本不变
+TTL = {
+    "search": 7 * DAY,
+    "cloudsearch": 7 * DAY,
+    "detail": 30 * DAY,
+    "lyric": 30 * DAY,
+}
+DEFAULT_TTL = 7 * DAY
+# 没有结果的查询（搜不到、没有歌词）只缓存 1 天，之后重新确认
+NEGATIVE_TTL = DAY
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def default_cache_path() -> Path:
+    return cache_dir() / "http_cache.sqlite"
+
+
+def _normalize(value) -> str:
+    # 搜索词统一全角/半角并合并空白，不同写法的同一查询命中同一条缓存
+    return " ".join(unicodedata.normalize("NFKC", str(value)).split())
+
+
+def cache_key(endpoint: str, params: dict) -> str:
+    return endpoint + "?" + json.dumps({k: _normalize(v) for k, v in sorted(params.items())},
+                                       ensure_ascii=False, separators=(",", ":"))
+
+
+class ResponseCache:
+    """
+    SQLite 响应缓存，可在多个线程间共享
+    stats 统计本次运行的 命中/未命中/负缓存命中/写入/淘汰 次数
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            endpoint TEXT NOT NULL,
+            body BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            negative INTEGER NOT NULL,
+            expires REAL NOT NULL,
+            accessed REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+    """
+
+    # 每写入这么多条检查一次总大小
+    EVICT_CHECK_INTERVAL = 200
+    # 命中时只在内存中记录访问时间，攒够这么多条（或写入、淘汰、关闭时）一起提交
+    ACCESS_FLUSH_INTERVAL = 500
+
+    def __init__(self, db_path=None, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.db_path = Path(db_path) if db_path else default_cache_path()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.executescript(self.SCHEMA)
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._accessed = {}
+        self.stats = Counter()
+
+    def close(self):
+        with self._lock:
+            self._evict()
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, endpoint: str, params: dict) -> Tuple[bool, Any]:
+        """返回 (是否命中, 缓存的值)；过期的条目视为未命中"""
+        key = cache_key(endpoint, params)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body, negative, expires FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or row[2] < now:
+                self.stats["miss"] += 1
+                return False, None
+            self._accessed[key] = now
+            if len(self._accessed) >= self.ACCESS_FLUSH_INTERVAL:
+                with self._conn:
+                    self._flush_accessed()
+            self.stats["negative_hit" if row[1] else "hit"] += 1
+        return True, json.loads(zlib.decompress(row[0]))
+
+    def put(self, endpoint: str, params: dict, value, negative: bool = False):
+        body = zlib.compress(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+        now = time.time()
+        ttl = NEGATIVE_TTL if negative else TTL.get(endpoint, DEFAULT_TTL)
+        key = cache_key(endpoint, params)
+        with self._lock, self._conn:
+            self._accessed.pop(key, None)
+            self._flush_accessed()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, endpoint, body, size, negative, expires, accessed) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, endpoint, body, len(body), int(negative), now + ttl, now))
+            self.stats["store"] += 1
+            self._puts += 1
+            if self._puts % self.EVICT_CHECK_INTERVAL == 0:
+                self._evict()
+
+    def _flush_accessed(self):
+        """把内存中记录的访问时间写入数据库（在调用方的事务中执行）"""
+        if self._accessed:
+            self._conn.executemany("UPDATE responses SET accessed = ? WHERE key = ?",
+                                   [(t, key) for key, t in self._accessed.items()])
+            self._accessed.clear()
+
+    def _evict(self):
+        """删除过期条目；总大小仍超过上限时按最近访问时间淘汰到上限的 90%"""
+        now = time.time()
+        with self._conn:
+            self._flush_accessed()
+            self.stats["evict"] += self._conn.execute(
+                "DELETE FROM responses WHERE expires < ?", (now,)).rowcount
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            target = total - int(self.max_bytes * 0.9)
+            freed = 0
+            victims = []
+            for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY accessed"):
+                victims.append((key,))
+                freed += size
+                if freed >= target:
+                    break
+            self._conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+            self.stats["evict"] += len(victims)
+
+    def summary(self) -> str:
+        s = self.stats
+        lookups = s["hit"] + s["negative_hit"] + s["miss"]
+        rate = (s["hit"] + s["negative_hit"]) / lookups * 100 if lookups else 0
+        return (f"API缓存: 命中 {s['hit']}，负缓存命中 {s['negative_hit']}，未命中 {s['miss']}"
+                f"（命中率 {rate:.0f}%），写入 {s['store']}，淘汰 {s['evict']}")
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+NCM 容器解析
+解码器和各个抓取/封面工具共用的文件头、密钥、元数据、封面偏移解析
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import struct
+import hashlib
+import binascii
+from pathlib import Path
+from typing import Iterator, Optional
+from concurrent.futures import ThreadPoolExecutor
+from Crypto.Cipher import AES
+
+# 固定密钥
+CORE_KEY = binascii.a2b_hex('687A4852416D736F356B496E62617857')
+META_KEY = binascii.a2b_hex('2331346C6A6B5F215C5D2630553C2728')
+
+MAGIC = b'CTENFDAM'
+_U32 = struct.Struct('<I')
+
+# 头部（密钥 + 元数据 + 封面长度）通常不到 4KB；超过 1MB 视为损坏文件
+HEAD_READ_SIZE = 4096
+MAX_HEADER_SIZE = 1 << 20
+
+# 密钥区与元数据区都是与常数异或，用 bytes.translate 一次完成
+_KEY_MASK = bytes(b ^ 0x64 for b in range(256))
+_META_MASK = bytes(b ^ 0x63 for b in range(256))
+
+# ECB 模式没有状态，解密对象可以在所有文件间复用
+_core_cipher = AES.new(CORE_KEY, AES.MODE_ECB)
+_meta_cipher = AES.new(META_KEY, AES.MODE_ECB)
+
+
+def unpad(s):
+    """移除PKCS7填充"""
+    if not s:
+        return s
+    pad = s[-1] if isinstance(s[-1], int) else ord(s[-1])
+    if pad > len(s) or pad == 0:
+        return s
+    return s[:-pad]
+
+
+def build_key_box(key_data):
+    """由解密后的 RC4 密钥生成 256 字节密钥盒"""
+    key_box = bytearray(range(256))
+    c = 0
+    last_byte = 0
+    key_offset = 0
+
+    for i in range(256):
+        swap = key_box[i]
+        c = (swap + last_byte + key_data[key_offset]) & 0xff
+        key_offset += 1
+        if key_offset >= len(key_data):
+            key_offset = 0
+        key_box[i] = key_box[c]
+        key_box[c] = swap
+        last_byte = c
+    return key_box
+
+
+class NCMHeader:
+    """
+    NCM 文件头部
+    解析时只记录各段偏移并保留密钥/元数据的原始字节，元数据 JSON 与密钥盒在首次访问时才解密
+    """
+
+    def __init__(self, buf):
+        with memoryview(buf) as view:
+            if bytes(view[:8]) != MAGIC:
+                raise ValueError("无效的NCM文件头")
+
+            try:
+                self.key_offset = 14
+                self.key_length = _U32.unpack_from(view, 10)[0]
+                pos = self.key_offset + self.key_length
+
+                self.meta_length = _U32.unpack_from(view, pos)[0]
+                self.meta_offset = pos + 4
+                pos = self.meta_offset + self.meta_length
+
+                # CRC32 (4 字节) + 未知数据 (5 字节)
+                self.cover_size = _U32.unpack_from(view, pos + 9)[0]
+                self.cover_offset = pos + 13
+                self.audio_offset = self.cover_offset + self.cover_size
+            except struct.error:
+                raise ValueError("NCM文件头不完整")
+
+            self._key_raw = bytes(view[self.key_offset:self.key_offset + self.key_length])
+            self._meta_raw = bytes(view[self.meta_offset:self.meta_offset + self.meta_length])
+
+        self._key_box = None
+        self._meta = None
+        self._meta_parsed = False
+
+    @classmethod
+    def from_path(cls, path):
+        """只读取文件开头的头部区域（通常一次 pread 即可），不读取封面与音频"""
+        fd = os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        try:
+            return cls.from_fd(fd)
+        finally:
+            os.close(fd)
+
+    @classmethod
+    def from_fd(cls, fd):
+        head = _pread(fd, HEAD_READ_SIZE, 0)
+        if len(head) < 18 or head[:8] != MAGIC:
+            raise ValueError("无效的NCM文件头")
+
+        # 密钥或元数据超出首次读取的范围时再补读，最多两次
+        key_length = _U32.unpack_from(head, 10)[0]
+        needed = 18 + key_length
+        if needed > len(head):
+            head += _pread(fd, _bounded(needed) - len(head), len(head))
+        _require(head, needed)
+        meta_length = _U32.unpack_from(head, 14 + key_length)[0]
+        needed += meta_length + 13
+        if needed > len(head):
+            head += _pread(fd, _bounded(needed) - len(head), len(head))
+        _require(head, needed)
+        return cls(head)
+
+    @classmethod
+    def from_stream(cls, stream):
+        """
+        从不可 seek 的流（管道、标准输入）顺序读取头部，读完后流停在封面数据的开头
+        """
+        head = _read_exact(stream, 14)
+        if len(head) < 14 or head[:8] != MAGIC:
+            raise ValueError("无效的NCM文件头")
+        key_length = _U32.unpack_from(head, 10)[0]
+        head += _read_exact(stream, _bounded(key_length + 4))
+        _require(head, 18 + key_length)
+        meta_length = _U32.unpack_from(head, 14 + key_length)[0]
+        needed = _bounded(len(head) + meta_length + 13)
+        head += _read_exact(stream, needed - len(head))
+        _require(head, needed)
+        return cls(head)
+
+    @property
+    def key_fingerprint(self):
+        """加密密钥区的哈希，用来识别使用同一密钥的文件（无需解密）"""
+        return hashlib.blake2b(self._key_raw, digest_size=8).digest()
+
+    @property
+    def key_data(self):
+        """解密后的 RC4 密钥（去掉 'neteasecloudmusic' 前缀）"""
+        return unpad(_core_cipher.decrypt(self._key_raw.translate(_KEY_MASK)))[17:]
+
+    @property
+    def key_box(self):
+        if self._key_box is None:
+            self._key_box = build_key_box(self.key_data)
+        return self._key_box
+
+    @property
+    def meta(self) -> Optional[dict]:
+        """解密后的元数据 JSON，没有元数据或解析失败时为 None"""
+        if not self._meta_parsed:
+            self._meta_parsed = True
+            if self.meta_length:
+                try:
+                    meta_data = base64.b64decode(self._meta_raw.translate(_META_MASK)[22:])
+                    meta_data = unpad(_meta_cipher.decrypt(meta_data))
+                    self._meta = json.loads(meta_data.decode('utf-8')[6:])
+                except Exception:
+                    self._meta = None
+        return self._meta
+
+
+def _pread(fd, n, offset):
+    if hasattr(os, 'pread'):
+        return os.pread(fd, n, offset)
+    os.lseek(fd, offset, os.SEEK_SET)
+    return os.read(fd, n)
+
+
+def _read_exact(stream, n):
+    """读满 n 字节（管道可能一次只返回一部分），遇到 EOF 时返回已读到的内容"""
+    parts = []
+    while n > 0:
+        chunk = stream.read(n)
+        if not chunk:
+            break
+        parts.append(chunk)
+        n -= len(chunk)
+    return b''.join(parts)
+
+
+def _require(head, size):
+    """截断或未下载完的文件：头部不足 size 字节时按文件头不完整处理"""
+    if len(head) < size:
+        raise ValueError("NCM文件头不完整")
+
+
+def _bounded(size):
+    if size > MAX_HEADER_SIZE:
+        raise ValueError("NCM文件头过大")
+    return size
+
+
+def read_ncm_meta(ncm_path) -> Optional[dict]:
+    """读取NCM文件的元数据，文件头不对或没有元数据时返回 None"""
+    try:
+        header = NCMHeader.from_path(ncm_path)
+    except ValueError:
+        return None
+    return header.meta
+
+
+def scan_record(ncm_path) -> dict:
+    """单个 NCM 文件的扫描结果：路径 + 工具常用的元数据字段"""
+    try:
+        header = NCMHeader.from_path(ncm_path)
+    except (OSError, ValueError) as e:
+        return {"path": str(ncm_path), "error": str(e)}
+    meta = header.meta
+    if meta is None:
+        return {"path": str(ncm_path), "error": "无法解析元数据"}
+    return {
+        "path": str(ncm_path),
+        "musicId": meta.get("musicId") or meta.get("musicid"),
+        "musicName": meta.get("musicName", ""),
+        "artist": [a[0] for a in meta.get("artist", []) if a],
+        "album": meta.get("album", ""),
+        "format": meta.get("format"),
+        "audioOffset": header.audio_offset,
+    }
+
+
+def list_ncm_files(ncm_dir, recursive=False):
+    pattern = '**/*.ncm' if recursive else '*.ncm'
+    return sorted(Path(ncm_dir).glob(pattern))
+
+
+def scan_directory(ncm_dir, workers=8, recursive=False) -> Iterator[dict]:
+    """用线程池并发读取目录下所有 NCM 的头部，按文件名顺序逐个产出 scan_record"""
+    files = list_ncm_files(ncm_dir, recursive)
+    if workers <= 1:
+        yield from map(scan_record, files)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(scan_record, files)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="NCM 容器工具")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    scan = sub.add_parser("scan", help="只读取文件头，把目录中所有 NCM 的元数据输出为 JSON Lines")
+    scan.add_argument("ncm_dir", help="NCM文件目录")
+    scan.add_argument("-o", "--output", help="输出文件（默认标准输出）")
+    scan.add_argument("-r", "--recursive", action="store_true", help="递归扫描子目录")
+    scan.add_argument("--workers", type=int, default=8, help="并发读取的线程数（默认 8）")
+
+    args = parser.parse_args()
+
+    if args.command == "scan":
+        started = time.perf_counter()
+        out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+        count = errors = 0
+        try:
+            for record in scan_directory(args.ncm_dir, args.workers, args.recursive):
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                count += 1
+                errors += "error" in record
+        finally:
+            if args.output:
+                out.close()
+        print(f"扫描完成: {count} 个文件，{errors} 个失败，用时 {time.perf_counter() - started:.2f}s",
+              file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
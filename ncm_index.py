@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+NCM 元数据索引
+以 路径 + 大小 + mtime 为键把 NCM 头部解析结果保存在 SQLite 中，
+文件没有变化时重复运行只需 stat，不再读取任何 NCM 字节
+"""
+
+import os
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+
+from ncm_container import NCMHeader
+
+
+def cache_dir() -> Path:
+    """本工具集的缓存目录，可用 NCM_CACHE_DIR 环境变量覆盖"""
+    d = os.environ.get("NCM_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "ncm-decoding")
+    return Path(d)
+
+
+def default_index_path() -> Path:
+    return cache_dir() / "ncm_index.sqlite"
+
+
+def _parse(path: str) -> Optional[dict]:
+    try:
+        header = NCMHeader.from_path(path)
+    except (OSError, ValueError):
+        return None
+    meta = header.meta
+    return {
+        "meta": meta,
+        "audio_offset": header.audio_offset,
+        "format": (meta or {}).get("format"),
+    }
+
+
+class NCMIndex:
+    """
+    NCM 元数据索引
+    每行记录: path, dir, stem, size, mtime_ns, meta(JSON), audio_offset, method, format
+    method/format 在解码成功后由解码器回填
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS ncm (
+            path TEXT PRIMARY KEY,
+            dir TEXT NOT NULL,
+            stem TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            meta TEXT,
+            audio_offset INTEGER,
+            method INTEGER,
+            format TEXT
+        );
+        CREATE INDEX IF NOT EXISTS ncm_dir ON ncm (dir);
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = Path(db_path) if db_path else default_index_path()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.executescript(self.SCHEMA)
+        self._lock = threading.Lock()
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @staticmethod
+    def _key(path) -> str:
+        return os.path.abspath(path)
+
+    def refresh(self, ncm_dir, recursive=False, workers=8) -> Dict[str, int]:
+        """
+        增量刷新目录：大小和 mtime 未变的文件不读取，新增/变化的文件在线程池中解析头部，
+        已删除的文件从索引中移除。返回 {"unchanged", "parsed", "removed"} 计数
+        """
+        ncm_dir = self._key(ncm_dir)
+        sql, args = self._dir_clause(ncm_dir, recursive)
+        with self._lock:
+            known = {row[0]: (row[1], row[2]) for row in self._conn.execute(
+                f"SELECT path, size, mtime_ns FROM ncm WHERE {sql}", args)}
+
+        seen = {}
+        for path, st in self._walk(ncm_dir, recursive):
+            seen[path] = (st.st_size, st.st_mtime_ns)
+
+        stale = [p for p, sig in seen.items() if known.get(p) != sig]
+        removed = [p for p in known if p not in seen]
+
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            parsed = list(executor.map(_parse, stale))
+
+        with self._lock, self._conn:
+            for path, info in zip(stale, parsed):
+                size, mtime_ns = seen[path]
+                self._upsert(path, size, mtime_ns, info)
+            self._conn.executemany("DELETE FROM ncm WHERE path = ?", [(p,) for p in removed])
+
+        return {"unchanged": len(seen) - len(stale), "parsed": len(stale), "removed": len(removed)}
+
+    @staticmethod
+    def _dir_clause(ncm_dir, recursive):
+        if not recursive:
+            return "dir = ?", (ncm_dir,)
+        prefix = os.path.join(ncm_dir, "")
+        return "(dir = ? OR substr(dir, 1, ?) = ?)", (ncm_dir, len(prefix), prefix)
+
+    @staticmethod
+    def _walk(ncm_dir, recursive):
+        stack = [ncm_dir]
+        while stack:
+            try:
+                it = os.scandir(stack.pop())
+            except OSError:
+                continue
+            with it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive:
+                            stack.append(entry.path)
+                    elif entry.name.endswith(".ncm"):
+                        try:
+                            yield entry.path, entry.stat()
+                        except OSError:
+                            continue
+
+    def _upsert(self, path, size, mtime_ns, info, method=None, fmt=None):
+        info = info or {}
+        self._conn.execute(
+            "INSERT OR REPLACE INTO ncm (path, dir, stem, size, mtime_ns, meta, audio_offset, method, format) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (path, os.path.dirname(path), Path(path).stem, size, mtime_ns,
+             json.dumps(info["meta"], ensure_ascii=False) if info.get("meta") is not None else None,
+             info.get("audio_offset"), method, fmt or info.get("format")))
+
+    def record_decode(self, path, meta, audio_offset, method, fmt):
+        """解码成功后回填检测到的解密方法和输出格式"""
+        path = self._key(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        with self._lock, self._conn:
+            self._upsert(path, st.st_size, st.st_mtime_ns,
+                         {"meta": meta, "audio_offset": audio_offset}, method, fmt)
+
+    def lookup(self, path) -> Optional[dict]:
+        """按路径查询；文件大小或 mtime 与索引不符时视为未命中"""
+        path = self._key(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT path, stem, size, mtime_ns, meta, audio_offset, method, format FROM ncm WHERE path = ?",
+                (path,)).fetchone()
+        if not row or (row[2], row[3]) != (st.st_size, st.st_mtime_ns):
+            return None
+        return self._entry(row)
+
+    def entries(self, ncm_dir, recursive=False) -> List[dict]:
+        """目录下的全部索引项（按路径排序），调用前应先 refresh"""
+        sql, args = self._dir_clause(self._key(ncm_dir), recursive)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path, stem, size, mtime_ns, meta, audio_offset, method, format FROM ncm "
+                f"WHERE {sql} ORDER BY path", args).fetchall()
+        return [self._entry(row) for row in rows]
+
+    def by_stem(self, ncm_dir, recursive=False) -> Dict[str, dict]:
+        """stem -> 索引项，供按音频文件名查找对应 NCM 使用"""
+        return {e["stem"]: e for e in self.entries(ncm_dir, recursive)}
+
+    @staticmethod
+    def _entry(row) -> dict:
+        return {
+            "path": row[0],
+            "stem": row[1],
+            "size": row[2],
+            "mtime_ns": row[3],
+            "meta": json.loads(row[4]) if row[4] else None,
+            "audio_offset": row[5],
+            "method": row[6],
+            "format": row[7],
+        }
+
+
+def open_index(ncm_dir, index_path=None, recursive=False) -> NCMIndex:
+    """打开索引并增量刷新 ncm_dir，打印刷新统计"""
+    index = NCMIndex(index_path)
+    stats = index.refresh(ncm_dir, recursive)
+    print(f"NCM 索引: {stats['unchanged']} 个未变化，{stats['parsed']} 个新解析，{stats['removed']} 个已移除")
+    return index
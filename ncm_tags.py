@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+解码时随输出一起写入的标签
+FLAC 重写开头的元数据块、MP3 在开头插入 ID3v2 标签，
+插入内容作为输出文件开头的一部分写出，不需要事后再重写整个音频文件；
+同时预留填充空间，之后其它工具修改标签时可以原地写入
+"""
+
+import struct
+from typing import Dict, Optional
+
+from cover_cache import image_type
+
+# 预留给后续标签修改（歌词、专辑信息）的填充字节数
+# mutagen 保存时只会裁掉超过 10KB + 文件大小 1% 的填充，8KB 不会被裁掉，后续修改可以原地写入
+DEFAULT_PADDING = 0x2000
+
+_VENDOR = b'ncm-decoding'
+
+
+def tags_from_meta(meta: Optional[dict]) -> Dict[str, str]:
+    """从 NCM 元数据取出标题/艺术家/专辑，艺术家用 " / " 连接（与 fetch_album_info 一致）"""
+    if not meta:
+        return {}
+    tags = {
+        "title": meta.get("musicName", ""),
+        "artist": " / ".join(a[0] for a in meta.get("artist", []) if a),
+        "album": meta.get("album", ""),
+    }
+    return {k: v for k, v in tags.items() if v}
+
+
+# ---------------- FLAC ----------------
+
+def _flac_block_header(block_type, length, last):
+    if length >= 1 << 24:
+        raise ValueError("FLAC元数据块过大")
+    return bytes([(0x80 if last else 0) | block_type]) + length.to_bytes(3, 'big')
+
+
+def _flac_blocks(head: bytes):
+    """遍历 head 范围内可见的元数据块，产出 (偏移, 类型, 长度, 是否最后一块)"""
+    pos = 4
+    while pos + 4 <= len(head):
+        flags = head[pos]
+        length = int.from_bytes(head[pos + 1:pos + 4], 'big')
+        yield pos, flags & 0x7f, length, bool(flags & 0x80)
+        if flags & 0x80:
+            return
+        pos += 4 + length
+
+
+def flac_picture_body(data: bytes, mime: str) -> bytes:
+    """FLAC PICTURE 元数据块内容（图片类型 3 = 封面）"""
+    mime_b = mime.encode('ascii')
+    desc = b'cover'
+    return (struct.pack('>II', 3, len(mime_b)) + mime_b +
+            struct.pack('>I', len(desc)) + desc +
+            struct.pack('>IIIII', 0, 0, 0, 0, len(data)) + data)
+
+
+def _parse_vorbis_comment(body: bytes):
+    vendor_len = struct.unpack_from('<I', body, 0)[0]
+    vendor = body[4:4 + vendor_len]
+    pos = 4 + vendor_len
+    count = struct.unpack_from('<I', body, pos)[0]
+    pos += 4
+    comments = []
+    for _ in range(count):
+        n = struct.unpack_from('<I', body, pos)[0]
+        comments.append(body[pos + 4:pos + 4 + n])
+        pos += 4 + n
+    return vendor, comments
+
+
+def vorbis_comment_body(tags: Dict[str, str], existing: Optional[bytes] = None) -> bytes:
+    """VORBIS_COMMENT 块内容；existing 为原有块时保留原有字段，只补上缺少的"""
+    vendor, comments = _parse_vorbis_comment(existing) if existing else (_VENDOR, [])
+    present = {c.split(b'=', 1)[0].upper() for c in comments}
+    for key, value in tags.items():
+        if key.upper().encode('ascii') not in present:
+            comments.append(f"{key.upper()}={value}".encode('utf-8'))
+    out = [struct.pack('<I', len(vendor)), vendor, struct.pack('<I', len(comments))]
+    for c in comments:
+        out.append(struct.pack('<I', len(c)))
+        out.append(c)
+    return b''.join(out)
+
+
+def _splice_flac(head, tags, cover, mime, padding) -> Optional[bytes]:
+    if head[:4] != b'fLaC':
+        return None
+    blocks = list(_flac_blocks(head))
+    if not blocks or blocks[0][1] != 0 or blocks[0][2] != 34:
+        return None
+    last_off, _, last_len, is_last = blocks[-1]
+    meta_end = last_off + 4 + last_len
+    if not is_last or meta_end > len(head):
+        # 元数据块超出了已解密的开头部分，交给 mutagen
+        return None
+
+    types = {block_type for _, block_type, _, _ in blocks}
+    out = [(0, head[8:42])]
+    if tags and 4 not in types:
+        out.append((4, vorbis_comment_body(tags)))
+    if cover and 6 not in types:
+        out.append((6, flac_picture_body(cover, mime)))
+    for off, block_type, length, _ in blocks[1:]:
+        body = head[off + 4:off + 4 + length]
+        if block_type == 4 and tags:
+            body = vorbis_comment_body(tags, body)
+        elif block_type == 1:
+            # 原有的填充合并到最后的填充块里
+            padding = max(padding, length)
+            continue
+        out.append((block_type, body))
+    if padding:
+        out.append((1, bytes(padding)))
+
+    parts = [b'fLaC']
+    for i, (block_type, body) in enumerate(out):
+        parts.append(_flac_block_header(block_type, len(body), i == len(out) - 1))
+        parts.append(body)
+    parts.append(head[meta_end:])
+    return b''.join(parts)
+
+
+# ---------------- MP3 ----------------
+
+def _syncsafe(n):
+    return bytes([(n >> 21) & 0x7f, (n >> 14) & 0x7f, (n >> 7) & 0x7f, n & 0x7f])
+
+
+def _id3_frame(frame_id: bytes, body: bytes) -> bytes:
+    return frame_id + struct.pack('>I', len(body)) + b'\x00\x00' + body
+
+
+def id3_text_frame(frame_id: bytes, text: str) -> bytes:
+    """ID3v2.3 文本帧，UTF-16 带 BOM（v2.3 不支持 UTF-8）"""
+    return _id3_frame(frame_id, b'\x01' + text.encode('utf-16'))
+
+
+def id3_apic_frame(data: bytes, mime: str) -> bytes:
+    """ID3v2.3 APIC 帧（图片类型 3 = 封面）"""
+    return _id3_frame(b'APIC', b'\x00' + mime.encode('ascii') + b'\x00\x03' + b'\x00' + data)
+
+
+_ID3_FRAMES = {"title": b'TIT2', "artist": b'TPE1', "album": b'TALB'}
+
+
+def _splice_mp3(head, tags, cover, mime, padding) -> Optional[bytes]:
+    if head[:3] == b'ID3':
+        # 已有 ID3v2 标签时需要合并帧，交给 mutagen
+        return None
+    frames = b''.join(id3_text_frame(_ID3_FRAMES[k], v) for k, v in tags.items() if k in _ID3_FRAMES)
+    if cover:
+        frames += id3_apic_frame(cover, mime)
+    frames += bytes(padding)
+    return b'ID3\x03\x00\x00' + _syncsafe(len(frames)) + frames + head
+
+
+def splice_tags(head: bytes, fmt: str, tags: Dict[str, str], cover: Optional[bytes] = None,
+                padding: int = DEFAULT_PADDING) -> Optional[bytes]:
+    """
+    把标签和封面写进解密后音频的开头部分 head，返回替换 head 写出的新内容
+    格式不支持在流中插入（m4a、已有 ID3 的 mp3、元数据超出 head 的 flac）时返回 None
+    """
+    mime = None
+    if cover:
+        _, mime = image_type(cover)
+        if not mime:
+            cover = None
+    if not tags and not cover:
+        return head
+    if fmt == 'flac':
+        return _splice_flac(head, tags, cover, mime, padding)
+    if fmt == 'mp3':
+        return _splice_mp3(head, tags, cover, mime, padding)
+    return None
+
+
+def write_tags_file(audio_path, tags: Dict[str, str], cover: Optional[bytes] = None,
+                    padding: int = DEFAULT_PADDING) -> bool:
+    """
+    无法在流中插入时的后备方案：用 mutagen 把标签/封面写入已解码的文件
+    只补充缺少的字段和封面，不覆盖已有内容
+    """
+    mime = image_type(cover)[1] if cover else None
+    if mime not in ('image/jpeg', 'image/png'):
+        mime = 'image/jpeg'
+    keep_padding = lambda info: max(padding, info.padding)
+    ext = str(audio_path).rsplit('.', 1)[-1].lower()
+    if ext == 'mp3':
+        from mutagen.id3 import ID3, APIC, TIT2, TPE1, TALB, ID3NoHeaderError
+        try:
+            id3 = ID3(audio_path)
+        except ID3NoHeaderError:
+            id3 = ID3()
+        for key, frame in (("title", TIT2), ("artist", TPE1), ("album", TALB)):
+            if tags.get(key) and not id3.getall(frame.__name__):
+                id3.add(frame(encoding=3, text=tags[key]))
+        if cover and not id3.getall('APIC'):
+            id3.add(APIC(encoding=3, mime=mime, type=3, desc='Cover', data=cover))
+        id3.save(audio_path, padding=keep_padding)
+        return True
+    if ext in ('m4a', 'mp4', 'aac'):
+        from mutagen.mp4 import MP4, MP4Cover
+        mp4 = MP4(audio_path)
+        if mp4.tags is None:
+            mp4.add_tags()
+        for key, atom in (("title", "\xa9nam"), ("artist", "\xa9ART"), ("album", "\xa9alb")):
+            if tags.get(key) and not mp4.tags.get(atom):
+                mp4.tags[atom] = tags[key]
+        if cover and not mp4.tags.get('covr'):
+            fmt = MP4Cover.FORMAT_JPEG if mime == 'image/jpeg' else MP4Cover.FORMAT_PNG
+            mp4.tags['covr'] = [MP4Cover(cover, imageformat=fmt)]
+        mp4.save(padding=keep_padding)
+        return True
+    if ext == 'flac':
+        from mutagen.flac import FLAC, Picture
+        audio = FLAC(audio_path)
+        if audio.tags is None:
+            audio.add_tags()
+        for key, value in tags.items():
+            if not audio.get(key):
+                audio[key.upper()] = value
+        if cover and not audio.pictures:
+            pic = Picture()
+            pic.type = 3
+            pic.mime = mime
+            pic.desc = 'cover'
+            pic.data = cover
+            audio.add_picture(pic)
+        audio.save(padding=keep_padding)
+        return True
+    return False
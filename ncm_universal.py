@@ -1,27 +1,74 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import io
 import os
+import sys
+import mmap
+import time
+import signal
 import json
-import base64
-import struct
+import sqlite3
 import binascii
 from pathlib import Path
-from Crypto.Cipher import AES
+from functools import lru_cache
+from collections import Counter
 
+from ncm_container import CORE_KEY, META_KEY, NCMHeader, unpad, build_key_box, _read_exact, _pread
+from ncm_index import NCMIndex
+from cover_cache import CoverCache
+from ncm_tags import DEFAULT_PADDING, tags_from_meta, splice_tags, write_tags_file
 
-class NCMUniversalDecoder:
-    CORE_KEY = binascii.a2b_hex('687A4852416D736F356B496E62617857')
-    META_KEY = binascii.a2b_hex('2331346C6A6B5F215C5D2630553C2728')
 
-    @staticmethod
-    def unpad(s):
-        if not s:
-            return s
-        padding = s[-1] if isinstance(s[-1], int) else ord(s[-1])
-        if padding > len(s):
-            return s
-        return s[:-padding]
+# 整数对象的固定开销，统计中间缓冲区大小时扣除
+_INT_OVERHEAD = sys.getsizeof(1) - 4
+
+
+@lru_cache(maxsize=8)
+def _keystream_int(keystream, start, n):
+    """把周期密钥流展开成长度 n 的整数，整块解密时反复复用"""
+    stream = (keystream * ((start + n) // 256 + 1))[start:start + n]
+    return int.from_bytes(stream, 'little')
+
+
+class NCMUniversalDecoder:
+    CORE_KEY = CORE_KEY
+    META_KEY = META_KEY
+    CHUNK_SIZE = 0x100000
+
+    # 分段并行解密：段大小为 CHUNK_SIZE 的整数倍，小于 SEGMENT_MIN_SIZE 的文件不拆分
+    SEGMENT_SIZE = 0x1000000
+    SEGMENT_MIN_SIZE = 0x4000000
+    # 判断解密方法时试解密的字节数，足以识别各格式的文件头
+    PROBE_SIZE = 16
+    METHOD_NAMES = {1: "方法1 (原始)", 2: "方法2 (RC4)", 3: "方法3 (新版)"}
+    METHOD_SOURCES = {'index': "索引记录", 'key': "同密钥缓存", 'probe': "探测"}
+    # 写入标签时预先解密的开头长度（足以容纳常见 FLAC 的全部元数据块）
+    TAG_HEAD_SIZE = 0x10000
+
+    def __init__(self, verbose=True, segment_jobs=1, use_mmap=False, embed_cover=False, cover_cache=None,
+                 write_tags=False, tag_padding=DEFAULT_PADDING):
+        self.verbose = verbose
+        self.segment_jobs = segment_jobs
+        self.use_mmap = use_mmap
+        # NCM 内嵌的专辑封面：写入输出文件，和/或保存到内容寻址的封面缓存目录
+        self.embed_cover = embed_cover
+        self.cover_cache = CoverCache(cover_cache) if cover_cache is not None else None
+        # 按 NCM 元数据写入标题/艺术家/专辑，与音频在同一次写入中完成，并预留 tag_padding 字节填充
+        self.write_tags = write_tags
+        self.tag_padding = tag_padding
+        # 密钥指纹 -> 解密方法；以及各方法在本次运行中的命中次数
+        self.method_cache = {}
+        self.method_stats = Counter()
+        # 解密循环中音频数据经过的用户态缓冲区累计字节数（按实际生成的缓冲区大小统计），基准测试用来计算每字节复制次数
+        self.copied_bytes = 0
+
+    def _log(self, msg):
+        if self.verbose:
+            print(msg)
+
+    unpad = staticmethod(unpad)
+    build_key_box = staticmethod(build_key_box)
 
     def detect_format(self, data):
         if len(data) < 4:
@@ -42,12 +89,64 @@ class NCMUniversalDecoder:
 
         return None
 
-    def try_decode_method1(self, key_box, data):
-        result = bytearray(data)
-        for i in range(len(result)):
+    @staticmethod
+    def method1_keystream(key_box):
+        """方法1 的密钥流只与 (i + 1) & 0xff 有关，预先算出 256 字节"""
+        keystream = bytearray(256)
+        for i in range(256):
             j = (i + 1) & 0xff
-            result[i] ^= key_box[(key_box[j] + key_box[(key_box[j] + j) & 0xff]) & 0xff]
-        return bytes(result)
+            keystream[i] = key_box[(key_box[j] + key_box[(key_box[j] + j) & 0xff]) & 0xff]
+        return bytes(keystream)
+
+    @staticmethod
+    def method3_keystream(key_box):
+        """方法3 的密钥流只与 i & 0xff 有关，预先算出 256 字节"""
+        keystream = bytearray(256)
+        for i in range(256):
+            keystream[i] = key_box[(key_box[i] + i) & 0xff]
+        return bytes(keystream)
+
+    @staticmethod
+    def xor_keystream(data, keystream, offset=0):
+        """
+        用 256 字节周期密钥流整块异或 data
+        offset 为 data 在音频数据中的起始位置，用于对齐密钥流
+        """
+        n = len(data)
+        if not n:
+            return b''
+        stream = _keystream_int(keystream, offset & 0xff, n)
+        return (int.from_bytes(data, 'little') ^ stream).to_bytes(n, 'little')
+
+    def _method_func(self, number):
+        return {1: self.try_decode_method1, 2: self.try_decode_method2, 3: self.try_decode_method3}[number]
+
+    def detect_method(self, header, key_box, probe, hint=None):
+        """
+        用音频开头的 probe（PROBE_SIZE 字节）判断解密方法
+        依次尝试: 调用方给出的提示（NCM 索引记录）、同一密钥上次的结果、方法1→2→3
+        返回 (方法编号, 解密后的 probe, 格式, 来源)，全部失败时方法编号为 None
+        """
+        fingerprint = header.key_fingerprint
+        candidates = [(hint, 'index'), (self.method_cache.get(fingerprint), 'key')]
+        candidates += [(number, 'probe') for number in (1, 2, 3)]
+
+        tried = set()
+        for number, source in candidates:
+            if not number or number in tried:
+                continue
+            tried.add(number)
+            decrypted = self._method_func(number)(bytearray(key_box), probe)
+            detected_format = self.detect_format(decrypted)
+            if detected_format:
+                self.method_cache[fingerprint] = number
+                return number, decrypted, detected_format, source
+            if source == 'probe':
+                self._log(f"    ❌ {self.METHOD_NAMES[number]} 失败")
+        return None, None, None, None
+
+    def try_decode_method1(self, key_box, data, offset=0):
+        return self.xor_keystream(data, self.method1_keystream(key_box), offset)
 
     def try_decode_method2(self, key_box, data, offset=0):
         result = bytearray(data)
@@ -62,7 +161,21 @@ class NCMUniversalDecoder:
 
         return bytes(result)
 
-    def try_decode_method3(self, key_box, data):
+    def try_decode_method3(self, key_box, data, offset=0):
+        return self.xor_keystream(data, self.method3_keystream(key_box), offset)
+
+    @staticmethod
+    def reference_method1(key_box, data):
+        """方法1 的逐字节参考实现，仅用于校验和基准测试"""
+        result = bytearray(data)
+        for i in range(len(result)):
+            j = (i + 1) & 0xff
+            result[i] ^= key_box[(key_box[j] + key_box[(key_box[j] + j) & 0xff]) & 0xff]
+        return bytes(result)
+
+    @staticmethod
+    def reference_method3(key_box, data):
+        """方法3 的逐字节参考实现，仅用于校验和基准测试"""
         result = bytearray(data)
 
         for i in range(len(result)):
@@ -73,11 +186,65 @@ class NCMUniversalDecoder:
 
         return bytes(result)
 
+    def decode_segments(self, ncm_path, output_file, keystream, audio_start, payload_size, head=None, shift=0):
+        """
+        把音频数据按 SEGMENT_SIZE 切段，在进程池中各自 pread/解密/pwrite 到预分配的输出文件
+        只适用于密钥流与位置相关的方法1/3，RC4 (方法2) 必须顺序解密
+        head/shift: 输出开头插入了标签时，各段整体后移 shift 字节，最后再写入开头的 head
+        """
+        from concurrent.futures import ProcessPoolExecutor
+
+        with open(output_file, 'wb') as out:
+            out.truncate(payload_size + shift)
+
+        segments = [(pos, min(self.SEGMENT_SIZE, payload_size - pos))
+                    for pos in range(0, payload_size, self.SEGMENT_SIZE)]
+        with ProcessPoolExecutor(max_workers=min(self.segment_jobs, len(segments))) as executor:
+            futures = [executor.submit(_decrypt_segment, str(ncm_path), str(output_file), keystream,
+                                       audio_start, pos, length, shift)
+                       for pos, length in segments]
+            total_size = sum(future.result() for future in futures)
+        if head is not None:
+            with open(output_file, 'r+b') as out:
+                out.write(head)
+        return total_size + shift
+
     def decode(self, ncm_path, output_dir=None):
+        return self.decode_file(ncm_path, output_dir)['success']
+
+    def decode_file(self, ncm_path, output_dir=None, method_hint=None):
+        """
+        解码单个 NCM 文件
+        method_hint 为已知的解密方法（如 NCM 索引中的记录），仍会用探测数据校验
+        返回结果字典: name, path, success, format, method, method_source, output, bytes, elapsed, error,
+        meta/audio_offset（供 NCM 索引回填），以及 cover（封面缓存路径）
+        """
         ncm_path = Path(ncm_path)
+        started = time.perf_counter()
+        result = {
+            'name': ncm_path.name,
+            'path': str(ncm_path),
+            'success': False,
+            'format': None,
+            'method': None,
+            'method_source': None,
+            'meta': None,
+            'audio_offset': None,
+            'cover': None,
+            'output': None,
+            'bytes': 0,
+            'elapsed': 0.0,
+            'error': None,
+        }
+
+        def failed(error):
+            result['error'] = error
+            result['elapsed'] = time.perf_counter() - started
+            return result
+
         if not ncm_path.exists() or not ncm_path.suffix == '.ncm':
-            print(f"❌ 无效的NCM文件: {ncm_path}")
-            return False
+            self._log(f"❌ 无效的NCM文件: {ncm_path}")
+            return failed("无效的NCM文件")
 
         if output_dir:
             output_dir = Path(output_dir)
@@ -91,151 +258,558 @@ class NCMUniversalDecoder:
 
         try:
             with open(ncm_path, 'rb') as f:
-                header = f.read(8)
-                if binascii.b2a_hex(header) != b'4354454e4644414d':
-                    print(f"❌ 无效的NCM文件头")
-                    return False
-
-                print(f"处理文件: {ncm_path.name}")
-
-                f.seek(2, 1)
-
-                key_length = struct.unpack('<I', f.read(4))[0]
-                print(f"  密钥长度: {key_length} 字节")
-
-                key_data = bytearray(f.read(key_length))
-                for i in range(len(key_data)):
-                    key_data[i] ^= 0x64
-
-                cipher = AES.new(self.CORE_KEY, AES.MODE_ECB)
-                key_data = self.unpad(cipher.decrypt(bytes(key_data)))
-                key_data = key_data[17:]
-
-                key_box_original = bytearray(range(256))
-                c = 0
-                last_byte = 0
-                key_offset = 0
-
-                for i in range(256):
-                    swap = key_box_original[i]
-                    c = (swap + last_byte + key_data[key_offset]) & 0xff
-                    key_offset += 1
-                    if key_offset >= len(key_data):
-                        key_offset = 0
-                    key_box_original[i] = key_box_original[c]
-                    key_box_original[c] = swap
-                    last_byte = c
-
-                meta_length = struct.unpack('<I', f.read(4))[0]
-                output_format = 'mp3'
-
-                if meta_length > 0:
-                    meta_data = bytearray(f.read(meta_length))
-                    for i in range(len(meta_data)):
-                        meta_data[i] ^= 0x63
-
-                    try:
-                        meta_data = base64.b64decode(bytes(meta_data)[22:])
-                        cipher = AES.new(self.META_KEY, AES.MODE_ECB)
-                        meta_data = self.unpad(cipher.decrypt(meta_data))
-                        meta_json = json.loads(meta_data.decode('utf-8')[6:])
-                        output_format = meta_json.get('format', 'mp3')
-                        print(f"  元数据格式: {output_format}")
-                    except:
-                        print(f"  ⚠️ 无法解析元数据，使用默认格式")
-
-                f.seek(4, 1)
-                f.seek(5, 1)
-                image_size = struct.unpack('<I', f.read(4))[0]
-                if image_size > 0:
-                    f.seek(image_size, 1)
-
-                audio_start = f.tell()
-                print(f"  音频起始: 0x{audio_start:x}")
-
-                test_data = f.read(1024)
-                if not test_data:
-                    print(f"  ❌ 没有音频数据")
-                    return False
-
-                print(f"  尝试解密方法...")
-
-                methods = [
-                    ("方法1 (原始)", self.try_decode_method1),
-                    ("方法2 (RC4)", self.try_decode_method2),
-                    ("方法3 (新版)", self.try_decode_method3)
-                ]
-
-                successful_method = None
-                decrypted_test = None
-
-                for method_name, method_func in methods:
-                    key_box_copy = bytearray(key_box_original)
-                    decrypted = method_func(key_box_copy, test_data)
-
-                    detected_format = self.detect_format(decrypted)
-                    if detected_format:
-                        print(f"    ✅ {method_name} 成功！检测到 {detected_format}")
-                        successful_method = method_func
-                        decrypted_test = decrypted
-                        output_format = detected_format
-                        break
-                    else:
-                        print(f"    ❌ {method_name} 失败")
-
-                if not successful_method:
-                    print(f"  ❌ 所有方法都失败了")
-                    print(f"  调试信息:")
-                    print(f"    原始前16字节: {binascii.b2a_hex(test_data[:16])}")
-
-                    debug_file = debug_dir / f"{ncm_path.stem}.debug"
-                    with open(debug_file, 'wb') as df:
-                        df.write(test_data)
-                    print(f"    已保存调试文件: {debug_file}")
-                    return False
-
-                output_file = output_dir / f"{ncm_path.stem}.{output_format}"
-
-                with open(output_file, 'wb') as out:
-                    out.write(decrypted_test)
-
-                    f.seek(audio_start + 1024)
-                    key_box_copy = bytearray(key_box_original)
-
-                    total_size = len(decrypted_test)
-                    while True:
-                        chunk = f.read(0x8000)
-                        if not chunk:
-                            break
-
-                        decrypted_chunk = successful_method(key_box_copy, chunk)
-                        out.write(decrypted_chunk)
-                        total_size += len(decrypted_chunk)
-
-                        if total_size % (1024 * 1024 * 10) == 0:
-                            print(f"    已处理: {total_size / 1024 / 1024:.1f} MB")
-
-                print(f"  ✅ 成功！输出: {output_file}")
-                print(f"     大小: {total_size / 1024 / 1024:.2f} MB")
-                return True
+                file_size = os.fstat(f.fileno()).st_size
+                if file_size < 8:
+                    self._log(f"❌ 无效的NCM文件头")
+                    return failed("无效的NCM文件头")
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    return self._decode_mapped(ncm_path, f, mm, output_dir, debug_dir, result, failed, started,
+                                               method_hint)
 
         except Exception as e:
-            print(f"❌ 解码失败: {e}")
-            import traceback
-            traceback.print_exc()
-            return False
+            self._log(f"❌ 解码失败: {e}")
+            if self.verbose:
+                import traceback
+                traceback.print_exc()
+            return failed(str(e))
 
+    def _decode_mapped(self, ncm_path, f, mm, output_dir, debug_dir, result, failed, started, method_hint=None):
+        try:
+            header = NCMHeader(mm)
+        except ValueError:
+            self._log(f"❌ 无效的NCM文件头")
+            return failed("无效的NCM文件头")
+
+        self._log(f"处理文件: {ncm_path.name}")
+        self._log(f"  密钥长度: {header.key_length} 字节")
+
+        key_box_original = header.key_box
+        output_format = 'mp3'
+        if header.meta_length > 0:
+            if header.meta is not None:
+                output_format = header.meta.get('format', 'mp3')
+                self._log(f"  元数据格式: {output_format}")
+            else:
+                self._log(f"  ⚠️ 无法解析元数据，使用默认格式")
+
+        audio_start = header.audio_offset
+        self._log(f"  音频起始: 0x{audio_start:x}")
+
+        probe = mm[audio_start:audio_start + self.PROBE_SIZE]
+        if not probe:
+            self._log(f"  ❌ 没有音频数据")
+            return failed("没有音频数据")
+
+        method_number, decrypted_probe, detected_format, source = self.detect_method(
+            header, key_box_original, probe, method_hint)
+
+        if method_number is None:
+            test_data = mm[audio_start:audio_start + 1024]
+            self._log(f"  ❌ 所有方法都失败了")
+            self._log(f"  调试信息:")
+            self._log(f"    原始前16字节: {binascii.b2a_hex(test_data[:16])}")
+
+            debug_file = debug_dir / f"{ncm_path.stem}.debug"
+            with open(debug_file, 'wb') as df:
+                df.write(test_data)
+            self._log(f"    已保存调试文件: {debug_file}")
+            return failed("所有解密方法都失败")
+
+        self.method_stats[method_number] += 1
+        self._log(f"  解密方法: {self.METHOD_NAMES[method_number]}（{self.METHOD_SOURCES[source]}），检测到 {detected_format}")
+        output_format = detected_format
+        successful_method = self._method_func(method_number)
+        output_file = output_dir / f"{ncm_path.stem}.{output_format}"
+
+        # 方法1/3 的密钥流只与位置有关，整个文件只计算一次
+        keystream = None
+        if method_number == 1:
+            keystream = self.method1_keystream(key_box_original)
+        elif method_number == 3:
+            keystream = self.method3_keystream(key_box_original)
+
+        # 封面就在音频数据前面，直接从映射区取出，不再额外读取
+        cover = None
+        if header.cover_size and (self.embed_cover or self.cover_cache is not None):
+            cover = mm[header.cover_offset:header.cover_offset + header.cover_size]
+            if self.cover_cache is not None:
+                cover_path = self.cover_cache.put(cover)
+                if cover_path:
+                    result['cover'] = str(cover_path)
+                    self._log(f"  封面: {cover_path}")
+
+        tags = tags_from_meta(header.meta) if self.write_tags else {}
+        embed = cover if self.embed_cover else None
+
+        # 输出开头单独解密的部分：方法1/3 接着探测数据继续解密，写标签时解密得更长，让 FLAC 的元数据块完整落在其中；
+        # 方法2 每次调用都会重置 RC4 状态，开头仍按原来的 1024 字节作为一块解密
+        if keystream is not None:
+            head_size = self.TAG_HEAD_SIZE if (tags or embed) else 1024
+            decrypted_test = decrypted_probe + self.xor_keystream(
+                mm[audio_start + len(probe):audio_start + head_size], keystream, len(probe))
+        else:
+            decrypted_test = self.try_decode_method2(bytearray(key_box_original), mm[audio_start:audio_start + 1024])
+
+        # 标签/封面能在流中插入时，插入后的开头部分作为输出的前 len(head) 字节一起写出
+        head = decrypted_test
+        tag_later = False
+        if tags or embed:
+            spliced = splice_tags(decrypted_test, output_format, tags, embed, self.tag_padding)
+            if spliced is None:
+                tag_later = True
+            else:
+                head = spliced
+        shift = len(head) - len(decrypted_test)
+
+        payload_size = len(mm) - audio_start
+        if (keystream is not None and self.segment_jobs > 1 and hasattr(os, 'pwrite')
+                and payload_size >= self.SEGMENT_MIN_SIZE):
+            total_size = self.decode_segments(ncm_path, output_file, keystream,
+                                              audio_start, payload_size, head, shift)
+            self._log(f"  ✅ 成功！输出: {output_file}（{self.segment_jobs} 个进程分段解密）")
+        elif self.use_mmap:
+            total_size = self._decrypt_to_mmap(mm, audio_start, output_file, successful_method,
+                                               key_box_original, keystream, decrypted_test, head)
+            self._log(f"  ✅ 成功！输出: {output_file}")
+        else:
+            total_size = self._decrypt_buffered(f, audio_start, output_file, successful_method,
+                                                key_box_original, keystream, decrypted_test, head)
+            self._log(f"  ✅ 成功！输出: {output_file}")
+
+        if head is not decrypted_test:
+            self._log(f"  已写入标签: {', '.join(list(tags) + (['cover'] if embed else []))}")
+        elif tag_later:
+            # m4a 等无法在流中插入的格式，解码后用 mutagen 补写一次
+            try:
+                if write_tags_file(output_file, tags, embed, self.tag_padding):
+                    self._log(f"  已写入标签（mutagen）")
+                total_size = os.path.getsize(output_file)
+            except Exception as e:
+                self._log(f"  ⚠️ 写入标签失败: {e}")
+
+        self._log(f"     大小: {total_size / 1024 / 1024:.2f} MB")
+        result.update(success=True, format=output_format, method=method_number, method_source=source,
+                      meta=header.meta,
+                      audio_offset=audio_start, output=str(output_file),
+                      bytes=total_size, elapsed=time.perf_counter() - started)
+        return result
+
+    def _chunk_size(self, keystream):
+        # 方法2 每块都会重置 RC4 状态，必须保持原来的 0x8000 分块
+        return self.CHUNK_SIZE if keystream is not None else 0x8000
+
+    def _decrypt_chunk(self, chunk, method, key_box, keystream, offset):
+        """
+        解密一块音频数据，并把过程中实际生成的中间缓冲区大小累计到 copied_bytes：
+        整块异或时为 data 转成的整数、异或结果整数和转回的 bytes，方法2 为逐字节处理的 bytearray 和结果 bytes
+        """
+        n = len(chunk)
+        if keystream is None:
+            decrypted = method(key_box, chunk)
+            self.copied_bytes += n + len(decrypted)
+            return decrypted
+        value = int.from_bytes(chunk, 'little')
+        copied = sys.getsizeof(value)
+        value ^= _keystream_int(keystream, offset & 0xff, n)
+        copied += sys.getsizeof(value)
+        decrypted = value.to_bytes(n, 'little')
+        self.copied_bytes += copied + len(decrypted) - 2 * _INT_OVERHEAD
+        return decrypted
+
+    def _decrypt_buffered(self, f, audio_start, output_file, method, key_box, keystream, decrypted_test,
+                          head=None):
+        """
+        逐块 read/解密/write 的普通文件路径（默认）
+        输入读入同一个预先分配的 bytearray，不为每块新建 bytes
+        head 为替换 decrypted_test 写在输出开头的内容（插入了标签时比 decrypted_test 长）
+        """
+        head = decrypted_test if head is None else head
+        key_box_copy = bytearray(key_box)
+        chunk_size = self._chunk_size(keystream)
+        buf = bytearray(chunk_size)
+        f.seek(audio_start + len(decrypted_test))
+        with open(output_file, 'wb') as out, memoryview(buf) as view:
+            out.write(head)
+            total_size = len(decrypted_test)
+            while True:
+                n = f.readinto(buf)
+                if not n:
+                    break
+                # 内核 -> buf 一次，解密的中间缓冲区，buf 之外的 write 再从解密结果复制到内核一次
+                self.copied_bytes += n
+                with view[:n] as chunk:
+                    decrypted_chunk = self._decrypt_chunk(chunk, method, key_box_copy, keystream, total_size)
+                out.write(decrypted_chunk)
+                self.copied_bytes += len(decrypted_chunk)
+                total_size += len(decrypted_chunk)
+                self._report_progress(total_size, len(decrypted_chunk))
+        return total_size + len(head) - len(decrypted_test)
+
+    def _decrypt_to_mmap(self, mm, audio_start, output_file, method, key_box, keystream, decrypted_test,
+                         head=None):
+        """
+        把输出文件预分配到完整大小并映射到内存，解密结果直接写入映射区（--mmap）
+        输入通过 memoryview 直接从映射区读取，不切出 bytes；已处理的输入/输出页随即通知内核回收
+        """
+        head = decrypted_test if head is None else head
+        shift = len(head) - len(decrypted_test)
+        total_size = len(mm) - audio_start
+        key_box_copy = bytearray(key_box)
+        with open(output_file, 'w+b') as out:
+            out.truncate(total_size + shift)
+            with mmap.mmap(out.fileno(), total_size + shift) as out_mm, memoryview(mm) as view:
+                out_mm[:len(head)] = head
+                chunk_size = self._chunk_size(keystream)
+                for pos in range(len(decrypted_test), total_size, chunk_size):
+                    with view[audio_start + pos:audio_start + pos + chunk_size] as chunk:
+                        decrypted_chunk = self._decrypt_chunk(chunk, method, key_box_copy, keystream, pos)
+                    out_mm[pos + shift:pos + shift + len(decrypted_chunk)] = decrypted_chunk
+                    self.copied_bytes += len(decrypted_chunk)
+                    end = pos + len(decrypted_chunk)
+                    self._release_pages(mm, audio_start + pos, audio_start + end)
+                    self._release_pages(out_mm, pos + shift, end + shift)
+                    self._report_progress(end, len(decrypted_chunk))
+        return total_size + shift
+
+    @staticmethod
+    def _release_pages(mm, start, end):
+        """通知内核回收 [start, end) 内已处理完的页（共享映射的脏页仍保留在页缓存中等待回写）"""
+        if not hasattr(mm, 'madvise') or not hasattr(mmap, 'MADV_DONTNEED'):
+            return
+        start -= start % mmap.PAGESIZE
+        end -= end % mmap.PAGESIZE
+        if end > start:
+            mm.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+    def _report_progress(self, total_size, n):
+        if total_size // (1024 * 1024 * 10) != (total_size - n) // (1024 * 1024 * 10):
+            self._log(f"    已处理: {total_size / 1024 / 1024:.1f} MB")
+
+
+def _decrypt_segment(ncm_path, output_file, keystream, audio_start, pos, length, shift=0):
+    """解密音频数据 [pos, pos + length) 并写入输出文件的 pos + shift 处"""
+    src = os.open(ncm_path, os.O_RDONLY)
+    dst = os.open(output_file, os.O_WRONLY)
+    try:
+        done = 0
+        while done < length:
+            n = min(NCMUniversalDecoder.CHUNK_SIZE, length - done)
+            chunk = os.pread(src, n, audio_start + pos + done)
+            if not chunk:
+                break
+            os.pwrite(dst, NCMUniversalDecoder.xor_keystream(chunk, keystream, pos + done), pos + done + shift)
+            done += len(chunk)
+        return done
+    finally:
+        os.close(src)
+        os.close(dst)
+
+
+class DecodedStream(io.RawIOBase):
+    """
+    只读的解码音频流，由 open_decoded() 返回
+    打开时即完成头部解析和方法检测，format/meta/method 可在读取前使用；内存占用与文件大小无关
+    """
+
+    def __init__(self, source, chunk_size=NCMUniversalDecoder.CHUNK_SIZE, method_hint=None, decoder=None):
+        super().__init__()
+        self._own = isinstance(source, (str, os.PathLike))
+        self._f = open(source, 'rb') if self._own else source
+        self.name = str(source) if self._own else getattr(source, 'name', '<stream>')
+        try:
+            self.header, self.format, self.method, self._chunks = _start_decoded_stream(
+                self._f, chunk_size, method_hint, decoder)
+        except Exception:
+            self.close()
+            raise
+        self.meta = self.header.meta
+        self._pending = b''
+        self._pending_pos = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self._pending_pos >= len(self._pending):
+            self._pending = next(self._chunks, b'')
+            self._pending_pos = 0
+            if not self._pending:
+                return 0
+        n = min(len(b), len(self._pending) - self._pending_pos)
+        b[:n] = self._pending[self._pending_pos:self._pending_pos + n]
+        self._pending_pos += n
+        return n
+
+    def close(self):
+        if not self.closed and self._own:
+            self._f.close()
+        super().close()
+
+
+def _start_decoded_stream(f, chunk_size, method_hint=None, decoder=None):
+    """顺序读取 f：解析头部、跳过封面、判断解密方法，返回 (header, 格式, 方法编号, 解码数据块迭代器)"""
+    decoder = decoder or NCMUniversalDecoder(verbose=False)
+    header = NCMHeader.from_stream(f)
+
+    # 封面在流中位于音频之前，能 seek 时直接跳过，否则读掉
+    if f.seekable():
+        f.seek(header.cover_size, os.SEEK_CUR)
+    else:
+        remaining = header.cover_size
+        while remaining > 0:
+            n = len(f.read(min(remaining, NCMUniversalDecoder.CHUNK_SIZE)))
+            if not n:
+                break
+            remaining -= n
+
+    head = _read_exact(f, 1024)
+    if not head:
+        raise ValueError("没有音频数据")
+    key_box = header.key_box
+    number, decrypted_probe, detected_format, _ = decoder.detect_method(
+        header, key_box, head[:NCMUniversalDecoder.PROBE_SIZE], method_hint)
+    if number is None:
+        raise ValueError("所有解密方法都失败")
+    return header, detected_format, number, _decoded_chunks(decoder, f, key_box, number, head, chunk_size)
+
+
+def _decoded_chunks(decoder, f, key_box, number, head, chunk_size):
+    if number == 2:
+        # 与落盘解码相同的分块：开头 1024 字节单独一块，之后每 0x8000 字节一块并共享密钥盒状态
+        yield decoder.try_decode_method2(bytearray(key_box), head)
+        key_box_copy = bytearray(key_box)
+        while True:
+            chunk = _read_exact(f, 0x8000)
+            if not chunk:
+                return
+            yield decoder.try_decode_method2(key_box_copy, chunk)
+
+    keystream = (decoder.method1_keystream if number == 1 else decoder.method3_keystream)(key_box)
+    yield decoder.xor_keystream(head, keystream)
+    pos = len(head)
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            return
+        yield decoder.xor_keystream(chunk, keystream, pos)
+        pos += len(chunk)
+
+
+class _DecodedReader(io.BufferedReader):
+    """带缓冲的 DecodedStream，转发 format/meta/method"""
+
+    format = property(lambda self: self.raw.format)
+    meta = property(lambda self: self.raw.meta)
+    method = property(lambda self: self.raw.method)
+
+
+def open_decoded(source, chunk_size=NCMUniversalDecoder.CHUNK_SIZE, method_hint=None):
+    """
+    以文件对象的形式读取解码后的音频，不写入磁盘
+    source 可以是 NCM 文件路径，也可以是已打开的二进制流（如 sys.stdin.buffer）；
+    返回的对象带有 format/meta/method 属性
+    """
+    return _DecodedReader(DecodedStream(source, chunk_size, method_hint), buffer_size=chunk_size)
+
+
+def iter_decoded_chunks(source, chunk_size=NCMUniversalDecoder.CHUNK_SIZE, method_hint=None):
+    """逐块产出解码后的音频数据（方法2 固定按 0x8000 字节分块）"""
+    with DecodedStream(source, chunk_size, method_hint) as stream:
+        yield from stream._chunks
+
+
+def decode_to_stream(source, out, chunk_size=NCMUniversalDecoder.CHUNK_SIZE):
+    """把解码后的音频写入 out（如 sys.stdout.buffer），返回 (格式, 字节数)"""
+    with DecodedStream(source, chunk_size) as stream:
+        total = 0
+        for chunk in stream._chunks:
+            out.write(chunk)
+            total += len(chunk)
+        out.flush()
+        return stream.format, total
+
+
+class DecodedNCMReader(io.RawIOBase):
+    """
+    可随机访问的解码音频读取器（read/seek/tell/readinto），不需要先完整解码
+    方法1/3 的密钥流只与位置有关，任意偏移都可以直接 pread + 异或得到明文，
+    可用于 HTTP Range 请求，或让 mutagen 直接从 NCM 文件读取时长等信息
+    方法2 (RC4) 的状态依赖之前所有数据，不支持随机访问，请改用 open_decoded()
+    """
+
+    def __init__(self, ncm_path, method_hint=None, decoder=None):
+        super().__init__()
+        decoder = decoder or NCMUniversalDecoder(verbose=False)
+        self.name = str(ncm_path)
+        self._fd = os.open(ncm_path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        try:
+            self.header = NCMHeader.from_fd(self._fd)
+            self._offset = self.header.audio_offset
+            self.size = max(os.fstat(self._fd).st_size - self._offset, 0)
+            probe = _pread(self._fd, NCMUniversalDecoder.PROBE_SIZE, self._offset)
+            key_box = self.header.key_box
+            self.method, _, self.format, _ = decoder.detect_method(self.header, key_box, probe, method_hint)
+            if self.method is None:
+                raise ValueError("所有解密方法都失败")
+            if self.method == 2:
+                raise ValueError("方法2 (RC4) 不支持随机访问，请使用 open_decoded()")
+            self._keystream = (decoder.method1_keystream if self.method == 1
+                               else decoder.method3_keystream)(key_box)
+        except Exception:
+            os.close(self._fd)
+            raise
+        self.meta = self.header.meta
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError(f"无效的 whence: {whence}")
+        if pos < 0:
+            raise ValueError("不能 seek 到负数位置")
+        self._pos = pos
+        return pos
+
+    def read_range(self, start, length):
+        """读取解码后 [start, start + length) 的数据，不改变当前位置，可在多个线程中同时调用"""
+        if start >= self.size or length <= 0:
+            return b''
+        data = _pread(self._fd, min(length, self.size - start), self._offset + start)
+        return NCMUniversalDecoder.xor_keystream(data, self._keystream, start)
+
+    def readinto(self, b):
+        data = self.read_range(self._pos, len(b))
+        b[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            os.close(self._fd)
+        super().close()
+
+
+_worker_decoder = None
+
+
+def _init_worker(decoder_options):
+    # Ctrl-C 由主进程统一处理，子进程忽略 SIGINT 以免打印一堆 traceback
+    global _worker_decoder
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker_decoder = NCMUniversalDecoder(verbose=False, **decoder_options)
+
+
+def _decode_worker(ncm_path, output_dir, method_hint=None):
+    return _worker_decoder.decode_file(ncm_path, output_dir, method_hint)
+
+
+def _decode_parallel(ncm_files, output_dir, jobs, results, decoder_options, method_hints=None):
+    """用进程池解码，按输入顺序把结果追加到 results；Ctrl-C 时取消尚未开始的任务"""
+    from concurrent.futures import ProcessPoolExecutor
+
+    executor = ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(decoder_options,))
+    try:
+        method_hints = method_hints or {}
+        futures = [executor.submit(_decode_worker, ncm_file, output_dir, method_hints.get(ncm_file))
+                   for ncm_file in ncm_files]
+        for i, future in enumerate(futures, 1):
+            r = future.result()
+            results.append(r)
+            if r['success']:
+                print(f"[{i}/{len(ncm_files)}] ✅ {r['name']} → {r['format']} "
+                      f"{r['bytes'] / 1024 / 1024:.2f} MB {r['elapsed']:.2f}s")
+            else:
+                print(f"[{i}/{len(ncm_files)}] ❌ {r['name']}: {r['error']}")
+    except KeyboardInterrupt:
+        print(f"\n⚠️ 已中断，正在取消剩余任务（已完成 {len(results)} 个）...")
+        executor.shutdown(wait=True, cancel_futures=True)
+        raise
+    executor.shutdown(wait=True)
+
+
+class DecodeManifest:
+    """
+    增量解码清单，保存在输出目录的 .ncm_manifest.json
+    每个源文件记录: size, mtime_ns, output, payload_size
+    payload_size 为 NCM 中音频数据的字节数：输出文件存在且不小于它时视为已完整解码。
+    不对输出内容做哈希，之后写入的标签/封面（fetch_album_info、attach_artwork 等）不会让输出被当作过期而重新解码
+    """
+
+    FILENAME = '.ncm_manifest.json'
+    VERSION = 2
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.entries = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f).get('files', {})
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"⚠️ 无法读取解码清单，将全部重新解码: {e}")
+
+    def is_current(self, ncm_path):
+        """源文件未变化，且记录的输出文件存在、不小于源文件中的音频数据"""
+        entry = self.entries.get(str(Path(ncm_path).resolve()))
+        if not entry:
+            return False
+        try:
+            st = os.stat(ncm_path)
+            if (st.st_size, st.st_mtime_ns) != (entry['size'], entry['mtime_ns']):
+                return False
+            return os.path.getsize(entry['output']) >= entry['payload_size']
+        except (OSError, KeyError):
+            return False
 
-def decode_directory(input_dir, output_dir=None):
+    def record(self, result):
+        """记录一次成功的解码"""
+        ncm_path = Path(result['path']).resolve()
+        try:
+            st = os.stat(ncm_path)
+        except OSError:
+            return
+        self.entries[str(ncm_path)] = {
+            'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns,
+            'output': str(Path(result['output']).resolve()),
+            'payload_size': st.st_size - result['audio_offset'],
+        }
+
+    def save(self):
+        # 先写临时文件再替换，中断时不会留下半个清单
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'version': self.VERSION, 'files': self.entries}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.path)
+
+
+def decode_directory(input_dir, output_dir=None, jobs=1, segment_jobs=1, use_mmap=False, index_path=None,
+                     use_index=True, incremental=False, embed_cover=False, cover_cache=None,
+                     write_tags=False, tag_padding=DEFAULT_PADDING):
     input_dir = Path(input_dir)
 
     if not input_dir.exists():
         print(f"❌ 输入目录不存在: {input_dir}")
         return
 
-    ncm_files = list(input_dir.glob('*.ncm'))
+    ncm_files = sorted(input_dir.glob('*.ncm'))
     if not ncm_files:
-        ncm_files = list(input_dir.rglob('*.ncm'))
+        ncm_files = sorted(input_dir.rglob('*.ncm'))
 
     if not ncm_files:
         print("没有找到NCM文件")
@@ -243,47 +817,154 @@ def decode_directory(input_dir, output_dir=None):
 
     print(f"找到 {len(ncm_files)} 个NCM文件")
 
-    decoder = NCMUniversalDecoder()
-    success_count = 0
-    failed_files = []
-
-    for ncm_file in ncm_files:
-        if decoder.decode(ncm_file, output_dir):
-            success_count += 1
+    manifest = None
+    skipped = []
+    if incremental:
+        manifest = DecodeManifest(Path(output_dir or input_dir) / DecodeManifest.FILENAME)
+        pending = []
+        for ncm_file in ncm_files:
+            (skipped if manifest.is_current(ncm_file) else pending).append(ncm_file)
+        if skipped:
+            print(f"增量模式: 跳过 {len(skipped)} 个已解码且未变化的文件")
+        ncm_files = pending
+
+    # 索引中记录过解密方法的文件直接校验该方法，不再逐个试解密
+    method_hints = {}
+    if use_index:
+        try:
+            with NCMIndex(index_path) as index:
+                for ncm_file in ncm_files:
+                    entry = index.lookup(ncm_file)
+                    if entry and entry['method']:
+                        method_hints[ncm_file] = entry['method']
+        except sqlite3.Error as e:
+            print(f"⚠️ 读取NCM索引失败: {e}")
+
+    decoder_options = dict(use_mmap=use_mmap, embed_cover=embed_cover, cover_cache=cover_cache,
+                           write_tags=write_tags, tag_padding=tag_padding)
+    started = time.perf_counter()
+    results = []
+    try:
+        if jobs > 1:
+            print(f"并行解码: {jobs} 个进程")
+            _decode_parallel(ncm_files, output_dir, jobs, results, decoder_options, method_hints)
         else:
-            failed_files.append(ncm_file.name)
-        print()
+            # 进程池模式下每个文件已独占一个进程，只有顺序模式才分段并行
+            decoder = NCMUniversalDecoder(segment_jobs=segment_jobs, **decoder_options)
+            for ncm_file in ncm_files:
+                results.append(decoder.decode_file(ncm_file, output_dir, method_hints.get(ncm_file)))
+                print()
+    except KeyboardInterrupt:
+        print("⚠️ 用户中断")
+    elapsed = time.perf_counter() - started
+
+    success = [r for r in results if r['success']]
+    if manifest is not None and success:
+        for r in success:
+            manifest.record(r)
+        try:
+            manifest.save()
+        except OSError as e:
+            print(f"⚠️ 保存解码清单失败: {e}")
+    if use_index and success:
+        # 回填检测到的解密方法与输出格式，后续工具可直接从索引读取元数据
+        try:
+            with NCMIndex(index_path) as index:
+                for r in success:
+                    index.record_decode(r['path'], r['meta'], r['audio_offset'], r['method'], r['format'])
+        except sqlite3.Error as e:
+            print(f"⚠️ 更新NCM索引失败: {e}")
+
+    failed_files = [r for r in results if not r['success']]
+    total_bytes = sum(r['bytes'] for r in success)
+
+    formats = {}
+    methods = Counter(r['method'] for r in success)
+    sources = Counter(r['method_source'] for r in success)
+    for r in success:
+        formats[r['format']] = formats.get(r['format'], 0) + 1
 
     print("=" * 60)
-    print(f"完成: {success_count}/{len(ncm_files)} 成功")
+    print(f"完成: {len(success)}/{len(ncm_files)} 成功")
+    if skipped:
+        print(f"跳过: {len(skipped)} 个未变化")
+    if formats:
+        print("格式: " + ", ".join(f"{fmt} {n}" for fmt, n in sorted(formats.items())))
+        print("解密方法: " + ", ".join(f"{NCMUniversalDecoder.METHOD_NAMES[m]} {n}" for m, n in sorted(methods.items())) +
+              "（" + ", ".join(f"{NCMUniversalDecoder.METHOD_SOURCES[src]} {n}" for src, n in sources.items()) + "）")
+    print(f"输出: {total_bytes / 1024 / 1024:.1f} MB，用时 {elapsed:.1f}s"
+          f"（{total_bytes / 1024 / 1024 / max(elapsed, 1e-9):.1f} MB/s）")
 
     if failed_files:
         print(f"\n失败的文件:")
-        for name in failed_files[:10]:
-            print(f"  • {name}")
+        for r in failed_files[:10]:
+            print(f"  • {r['name']}: {r['error']}")
+
+    return results
 
 
 def main():
-    import sys
     import argparse
 
     parser = argparse.ArgumentParser(description="NCM 通用解码器 v2.0")
-    parser.add_argument('input', help='NCM文件或包含NCM文件的目录')
-    parser.add_argument('-o', '--output', help='输出目录（可选）', default=None)
+    parser.add_argument('input', help='NCM文件或包含NCM文件的目录；"-" 表示从标准输入读取单个 NCM')
+    parser.add_argument('-o', '--output', help='输出目录（可选）；"-" 表示把解码后的音频写到标准输出', default=None)
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='并行解码的进程数（目录模式，默认 1；0 表示使用全部 CPU）')
+    parser.add_argument('--segment-jobs', type=int, default=1,
+                        help='单个大文件（≥64MB）分段并行解密的进程数（默认 1；0 表示使用全部 CPU）')
+    parser.add_argument('--mmap', action='store_true',
+                        help='把输出文件映射到内存后直接写入解密结果（默认逐块 read/write，通常更快、占用内存更少）')
+    # 逐块 read/write 已是默认，保留旧参数以兼容原有脚本
+    parser.add_argument('--no-mmap', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--embed-cover', action='store_true',
+                        help='把 NCM 内嵌的专辑封面写入输出文件（FLAC/MP3 在解码时一次写出）')
+    parser.add_argument('--cover-cache', nargs='?', const='', default=None, metavar='DIR',
+                        help='把 NCM 内嵌的专辑封面按内容哈希保存到封面缓存目录（默认 ~/.cache/ncm-decoding/covers）')
+    parser.add_argument('--tags', action='store_true',
+                        help='按 NCM 元数据写入标题/艺术家/专辑标签（FLAC/MP3 在解码时一次写出）')
+    parser.add_argument('--tag-padding', type=int, default=DEFAULT_PADDING, metavar='BYTES',
+                        help=f'写入标签时预留的填充字节数，之后修改标签可原地完成（默认 {DEFAULT_PADDING}）')
+    parser.add_argument('--incremental', action='store_true',
+                        help='增量模式：按输出目录中的解码清单跳过已完整解码且未变化的文件')
+    parser.add_argument('--index', help='NCM元数据索引文件路径（默认 ~/.cache/ncm-decoding/ncm_index.sqlite）')
+    parser.add_argument('--no-index', action='store_true', help='目录模式下不把解码结果写入NCM元数据索引')
 
     args = parser.parse_args()
 
+    if args.input == '-' or args.output == '-':
+        # 流式模式：不落盘，日志写到标准错误，标准输出只有音频数据
+        source = sys.stdin.buffer if args.input == '-' else args.input
+        try:
+            fmt, total = decode_to_stream(source, sys.stdout.buffer)
+        except BrokenPipeError:
+            # 下游（如 head、提前退出的播放器）关闭了管道
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            sys.exit(1)
+        except (OSError, ValueError) as e:
+            print(f"❌ 解码失败: {e}", file=sys.stderr)
+            sys.exit(1)
+        print(f"✅ {fmt} {total / 1024 / 1024:.2f} MB", file=sys.stderr)
+        return
+
     source = Path(args.input)
 
     if not source.exists():
         print(f"❌ 路径不存在: {source}")
         sys.exit(1)
 
+    segment_jobs = args.segment_jobs if args.segment_jobs > 0 else (os.cpu_count() or 1)
     if source.is_file():
-        decoder = NCMUniversalDecoder()
+        decoder = NCMUniversalDecoder(segment_jobs=segment_jobs, use_mmap=args.mmap and not args.no_mmap,
+                                      embed_cover=args.embed_cover, cover_cache=args.cover_cache,
+                                      write_tags=args.tags, tag_padding=args.tag_padding)
         decoder.decode(source, args.output)
     else:
-        decode_directory(source, args.output)
+        jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+        decode_directory(source, args.output, jobs, segment_jobs, use_mmap=args.mmap and not args.no_mmap,
+                         index_path=args.index, use_index=not args.no_index, incremental=args.incremental,
+                         embed_cover=args.embed_cover, cover_cache=args.cover_cache,
+                         write_tags=args.tags, tag_padding=args.tag_padding)
 
 
 if __name__ == '__main__':
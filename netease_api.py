@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+网易云音乐 API 客户端
+fetch_lyrics / fetch_album_info / attach_artwork 共用：连接池复用 keep-alive 连接，
+限制并发数，每个主机的请求速率随限流情况自适应调整，超时后按带抖动的指数退避重试；
+客户端是线程安全的，需要同时保持 N 个请求时在线程池（ThreadPoolExecutor）中调用各方法
+"""
+
+import os
+import time
+import random
+import threading
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from http_cache import ResponseCache
+
+BASE_URL = "https://music.163.com"
+
+# 环境变量：NETEASE_API_BASE 改用其它服务器（如 netease_stub.py 启动的本地回放服务器），
+# NETEASE_API_RATE 设置默认客户端每秒的初始请求数（0 表示不限速）
+BASE_URL_ENV = "NETEASE_API_BASE"
+RATE_ENV = "NETEASE_API_RATE"
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0",
+    "Referer": "https://music.163.com",
+}
+
+# /api/song/detail 一次请求的 ID 数（ID 放在查询串里，100 个约 1KB）
+DETAIL_BATCH_SIZE = 100
+
+# 这些状态码表示服务端暂时不可用，值得重试
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# HTTP 200 但 JSON 里的 code 表示请求过于频繁（-460 "Cheating"、405 等），同样降速重试
+THROTTLE_CODES = {-460, -462, 405, 429}
+
+# 空结果（搜不到、没有歌词）可能是被限流，也可能是真的没有，只轻微降速
+EMPTY_FACTOR = 0.9
+
+
+class NeteaseAPIError(Exception):
+    """重试用尽后仍然失败的请求"""
+
+
+class TokenBucket:
+    """
+    自适应令牌桶：平均每秒 rate 个请求，允许 burst 个突发
+    服务端限流（429/5xx、空响应）时降低速率，之后每次成功请求逐步回升到 max_rate，
+    吞吐量由服务端能承受的速率决定，而不是固定的等待时间
+    """
+
+    def __init__(self, rate: float, burst: int = 1, max_rate: Optional[float] = None,
+                 min_rate: float = 0.5):
+        self.rate = rate
+        self.max_rate = max(max_rate or rate, rate)
+        self.min_rate = min(min_rate, rate) if rate > 0 else 0
+        self.capacity = max(burst, 1)
+        self._tokens = float(self.capacity)
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+            wait = max(wait, self._paused_until - now)
+        # 令牌已预扣，在锁外等待，其它线程继续排在后面
+        if wait > 0:
+            time.sleep(wait)
+
+    def success(self):
+        """成功请求：加性增长，约每秒把速率提高 1 个请求"""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + 1.0 / self.rate)
+
+    def throttled(self, factor: float = 0.5, retry_after: float = 0):
+        """被限流：速率乘以 factor，丢掉积攒的突发令牌；retry_after 秒内不再放行"""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * factor)
+            self._tokens = min(self._tokens, 0.0)
+            if retry_after > 0:
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+
+
+def _retry_after(resp) -> float:
+    try:
+        return min(float(resp.headers.get("Retry-After", 0)), 60.0)
+    except ValueError:
+        return 0
+
+
+class NeteaseClient:
+    """
+    网易云 API 客户端
+    concurrency: 同时进行的请求数（也是连接池大小）
+    rate: 每个主机每秒的初始请求数（<= 0 表示不限速），没有被限流时逐步提高到 max_rate
+    cache: 响应缓存（ResponseCache），为 None 时每次都请求网络
+    """
+
+    def __init__(self, base_url: str = BASE_URL, concurrency: int = 8, rate: float = 5.0,
+                 timeout: float = 10.0, retries: int = 3, backoff: float = 0.5,
+                 cache: Optional[ResponseCache] = None, max_rate: float = 20.0):
+        self.base_url = base_url.rstrip("/")
+        self.concurrency = max(concurrency, 1)
+        self.rate = rate
+        self.max_rate = max_rate
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.cache = cache
+
+        self.session = requests.Session()
+        self.session.headers.update(DEFAULT_HEADERS)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+        self._limiters: Dict[str, TokenBucket] = {}
+        self._limiters_lock = threading.Lock()
+        self._count_lock = threading.Lock()
+        self.request_count = 0
+
+    def close(self):
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _limiter(self, url) -> TokenBucket:
+        host = urlsplit(url).netloc
+        with self._limiters_lock:
+            if host not in self._limiters:
+                self._limiters[host] = TokenBucket(self.rate, burst=self.concurrency, max_rate=self.max_rate)
+            return self._limiters[host]
+
+    def _sleep_backoff(self, attempt):
+        # 指数退避 + 全抖动，避免多个线程同时重试
+        time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+
+    def request_json(self, method: str, path: str, params=None, data=None) -> dict:
+        """发送请求并返回 JSON；连接错误、超时、429/5xx 会重试，重试用尽后抛出 NeteaseAPIError"""
+        url = path if path.startswith("http") else self.base_url + path
+        limiter = self._limiter(url)
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self._sleep_backoff(attempt - 1)
+            limiter.acquire()
+            with self._count_lock:
+                self.request_count += 1
+            with self._slots:
+                try:
+                    resp = self.session.request(method, url, params=params, data=data, timeout=self.timeout)
+                except requests.RequestException as e:
+                    last_error = e
+                    continue
+            if resp.status_code in RETRY_STATUS:
+                limiter.throttled(retry_after=_retry_after(resp))
+                last_error = NeteaseAPIError(f"HTTP {resp.status_code}")
+                continue
+            try:
+                resp.raise_for_status()
+                js = resp.json()
+            except (requests.RequestException, ValueError) as e:
+                raise NeteaseAPIError(f"{method} {path}: {e}") from e
+            if isinstance(js, dict) and js.get("code") in THROTTLE_CODES:
+                limiter.throttled()
+                last_error = NeteaseAPIError(f"code {js.get('code')}")
+                continue
+            limiter.success()
+            return js
+        raise NeteaseAPIError(f"{method} {path}: {last_error}")
+
+    # ---------------- 接口 ----------------
+
+    def _empty_response(self):
+        self._limiter(self.base_url).throttled(EMPTY_FACTOR)
+
+    def _cache_params(self, params: dict) -> dict:
+        # 非默认服务器（本地回放等）的响应单独缓存，不会混进真实数据
+        if self.base_url != BASE_URL:
+            return dict(params, base=self.base_url)
+        return params
+
+    def _cached(self, endpoint, params, fetch, is_negative):
+        """先查响应缓存，未命中时调用 fetch() 并写入缓存（is_negative(结果) 为真时按负缓存保存并轻微降速）"""
+        params = self._cache_params(params)
+        if self.cache is not None:
+            hit, value = self.cache.get(endpoint, params)
+            if hit:
+                return value
+        value = fetch()
+        negative = is_negative(value)
+        if negative:
+            self._empty_response()
+        if self.cache is not None:
+            self.cache.put(endpoint, params, value, negative=negative)
+        return value
+
+    def search(self, query: str, limit: int = 10, cloud: bool = False) -> List[dict]:
+        """搜索单曲；cloud=True 使用 cloudsearch/pc（返回 ar/dt 字段），否则使用 search/get/web"""
+        def fetch():
+            if cloud:
+                js = self.request_json("POST", "/api/cloudsearch/pc",
+                                       data={"type": 1, "s": query, "offset": 0, "total": "true", "limit": limit})
+            else:
+                js = self.request_json("POST", "/api/search/get/web",
+                                       data={"csrf_token": "", "type": 1, "s": query, "offset": 0,
+                                             "total": "true", "limit": limit})
+            return (js or {}).get("result", {}).get("songs", []) or []
+
+        return self._cached("cloudsearch" if cloud else "search", {"s": query, "limit": limit},
+                            fetch, lambda songs: not songs)
+
+    def song_detail(self, ids) -> List[dict]:
+        """歌曲详情，ids 为单个 ID 或 ID 列表；按 ids 的顺序返回找到的歌曲"""
+        if not isinstance(ids, (list, tuple)):
+            ids = [ids]
+        details = self.song_details(ids)
+        return [details[int(i)] for i in ids if i and int(i) in details]
+
+    def song_details(self, ids, batch_size: int = DETAIL_BATCH_SIZE) -> Dict[int, dict]:
+        """
+        批量获取歌曲详情：已缓存的 ID 直接取缓存，其余每次请求最多 batch_size 个，返回 {ID: 歌曲}
+        服务端没有返回的 ID 不出现在结果中（并按负缓存保存）
+        """
+        unique = list(dict.fromkeys(int(i) for i in ids if i))
+        details = {}
+        missing = []
+        for song_id in unique:
+            hit, song = (self.cache.get("detail", self._cache_params({"id": song_id}))
+                         if self.cache is not None else (False, None))
+            if not hit:
+                missing.append(song_id)
+            elif song:
+                details[song_id] = song
+
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            js = self.request_json("GET", "/api/song/detail",
+                                   params={"id": batch[0], "ids": "[" + ",".join(str(i) for i in batch) + "]"})
+            found = {int(song["id"]): song for song in js.get("songs", []) or [] if song.get("id") is not None}
+            details.update(found)
+            if not found:
+                self._empty_response()
+            if self.cache is not None:
+                for song_id in batch:
+                    self.cache.put("detail", self._cache_params({"id": song_id}), found.get(song_id),
+                                   negative=song_id not in found)
+        return details
+
+    def lyric(self, song_id) -> dict:
+        """歌词接口的原始结果（lrc / tlyric）"""
+        return self._cached("lyric", {"id": song_id},
+                            lambda: self.request_json("GET", "/api/song/lyric",
+                                                      params={"id": song_id, "lv": 1, "tv": 1}),
+                            lambda js: not (js.get("lrc") or {}).get("lyric"))
+
+    def summary(self) -> str:
+        """本次运行的网络请求数和缓存命中情况"""
+        line = f"网络请求: {self.request_count} 次"
+        rates = [f"{limiter.rate:.1f}" for limiter in self._limiters.values() if limiter.rate > 0]
+        if rates:
+            line += f"（结束时速率 {'/'.join(rates)} 次/秒）"
+        if self.cache is not None:
+            line += "；" + self.cache.summary()
+        return line
+
+
+_default_client: Optional[NeteaseClient] = None
+_default_options = {}
+_default_lock = threading.Lock()
+
+
+def configure_client(**options):
+    """设置默认客户端的参数（在第一次调用 get_client 之前）；use_cache=False 关闭响应缓存"""
+    global _default_client
+    with _default_lock:
+        if _default_client is not None:
+            _default_client.close()
+            _default_client = None
+        _default_options.update(options)
+
+
+def get_client() -> NeteaseClient:
+    """
+    进程内共享的默认客户端（默认启用 ~/.cache/ncm-decoding 下的响应缓存）
+    未通过 configure_client 指定时，服务器地址和速率取自 NETEASE_API_BASE / NETEASE_API_RATE
+    """
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            options = dict(_default_options)
+            if os.environ.get(BASE_URL_ENV):
+                options.setdefault("base_url", os.environ[BASE_URL_ENV])
+            if os.environ.get(RATE_ENV):
+                rate = float(os.environ[RATE_ENV])
+                options.setdefault("rate", rate)
+                options.setdefault("max_rate", max(rate, 20.0))
+            if options.pop("use_cache", True) and "cache" not in options:
+                options["cache"] = ResponseCache()
+            _default_client = NeteaseClient(**options)
+        return _default_client
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地网易云 API 回放服务器
+回放录制的 cloudsearch/pc、search/get/web、song/detail、song/lyric 响应，可设置延迟、错误率和限流率，
+用于在不访问 music.163.com 的情况下测试和基准测试 fetch_lyrics / fetch_album_info / attach_artwork；
+没有录制的请求返回按查询生成的合成数据，指定 --upstream 时转发到真实服务器并录制
+
+    python netease_stub.py --port 8163 --recordings rec.json --latency 50 --error-rate 0.02
+    NETEASE_API_BASE=http://127.0.0.1:8163 python fetch_lyrics.py 音乐目录
+"""
+
+import json
+import time
+import random
+import zlib
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Optional
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from http_cache import _normalize
+
+ENDPOINTS = {
+    "/api/cloudsearch/pc": "cloudsearch",
+    "/api/search/get/web": "search",
+    "/api/song/detail": "detail",
+    "/api/song/lyric": "lyric",
+}
+
+
+def _synthetic_id(text: str) -> int:
+    return 100000 + zlib.crc32(text.encode("utf-8")) % 10000000
+
+
+def synthetic_song(song_id: int, name: Optional[str] = None) -> dict:
+    """合成的歌曲对象，同时带 search/get/web（artists/album/duration）和 cloudsearch（ar/al/dt）的字段"""
+    artists = [{"id": 1, "name": "Artist"}]
+    album = {"id": song_id // 10, "name": f"Album {song_id // 10}", "artists": artists,
+             "publishTime": 1500000000000, "picUrl": ""}
+    return {"id": song_id, "name": name or f"Song {song_id}", "artists": artists, "ar": artists,
+            "album": album, "al": album, "duration": 180000, "dt": 180000, "position": 1, "disc": "1"}
+
+
+def synthetic_lyric(song_id: int) -> dict:
+    lines = "\n".join(f"[00:{i * 5:02d}.00]Line {i} of {song_id}" for i in range(12))
+    return {"code": 200, "lrc": {"version": 1, "lyric": lines}, "tlyric": {"version": 0, "lyric": ""}}
+
+
+class Recordings:
+    """
+    录制的响应：{"cloudsearch"/"search": {规范化查询: 歌曲列表}, "detail": {ID: 歌曲}, "lyric": {ID: 响应}}
+    synthetic=True 时没有录制的请求返回合成数据，否则按没有结果处理
+    """
+
+    def __init__(self, path=None, synthetic: bool = True):
+        self.path = Path(path) if path else None
+        self.synthetic = synthetic
+        self.data = {name: {} for name in ENDPOINTS.values()}
+        self._lock = threading.Lock()
+        if self.path and self.path.exists():
+            with open(self.path, encoding="utf-8") as f:
+                for name, entries in json.load(f).items():
+                    self.data.setdefault(name, {}).update(entries)
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            tmp = self.path.with_name(self.path.name + ".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.data, f, ensure_ascii=False)
+            tmp.replace(self.path)
+
+    def get(self, endpoint: str, key: str):
+        with self._lock:
+            return self.data[endpoint].get(key)
+
+    def put(self, endpoint: str, key: str, value):
+        with self._lock:
+            self.data[endpoint][key] = value
+
+    def search(self, endpoint: str, query: str, limit: int):
+        songs = self.get(endpoint, _normalize(query))
+        if songs is None:
+            songs = [synthetic_song(_synthetic_id(query), query)] if self.synthetic else []
+        return {"code": 200, "result": {"songs": songs[:limit], "songCount": len(songs)}}
+
+    def detail(self, ids):
+        songs = []
+        for song_id in ids:
+            song = self.get("detail", str(song_id))
+            if song is None and self.synthetic:
+                song = synthetic_song(song_id)
+            if song:
+                songs.append(song)
+        return {"code": 200, "songs": songs}
+
+    def lyric(self, song_id: int):
+        js = self.get("lyric", str(song_id))
+        if js is None:
+            js = synthetic_lyric(song_id) if self.synthetic else {"code": 200, "nolyric": True}
+        return js
+
+
+class StubServer:
+    """
+    在后台线程中运行的回放服务器
+    latency: 每个请求的平均延迟（秒），实际延迟在 ±jitter 比例内随机
+    error_rate / throttle_rate: 返回 503 / 429 的比例
+    upstream: 设置后没有录制的请求转发到该服务器，并把响应写入 recordings
+    counts 按接口统计收到的请求数
+    """
+
+    def __init__(self, recordings: Optional[Recordings] = None, host: str = "127.0.0.1", port: int = 0,
+                 latency: float = 0.0, jitter: float = 0.5, error_rate: float = 0.0,
+                 throttle_rate: float = 0.0, upstream: Optional[str] = None, seed: Optional[int] = None):
+        self.recordings = recordings or Recordings()
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.upstream = upstream.rstrip("/") if upstream else None
+        self.counts = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._session = requests.Session() if upstream else None
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self.upstream:
+            self.recordings.save()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def reset_counts(self):
+        with self._lock:
+            self.counts.clear()
+
+    def _roll(self):
+        """返回 (延迟, 要模拟的错误状态码或 None)"""
+        with self._lock:
+            delay = self.latency * (1 + self._random.uniform(-self.jitter, self.jitter)) if self.latency else 0
+            r = self._random.random()
+        if r < self.error_rate:
+            return delay, 503
+        if r < self.error_rate + self.throttle_rate:
+            return delay, 429
+        return delay, None
+
+    def _forward(self, method, path, params):
+        resp = self._session.request(method, self.upstream + path,
+                                     params=params if method == "GET" else None,
+                                     data=params if method == "POST" else None,
+                                     headers={"User-Agent": "Mozilla/5.0", "Referer": "https://music.163.com"},
+                                     timeout=10)
+        resp.raise_for_status()
+        return resp.json()
+
+    def respond(self, method: str, path: str, params: dict) -> dict:
+        """按接口回放（或录制）一个请求的 JSON 响应"""
+        endpoint = ENDPOINTS[path]
+        rec = self.recordings
+        if endpoint in ("cloudsearch", "search"):
+            query = params.get("s", "")
+            limit = int(params.get("limit", 10))
+            if self.upstream and rec.get(endpoint, _normalize(query)) is None:
+                songs = (self._forward(method, path, params).get("result") or {}).get("songs") or []
+                rec.put(endpoint, _normalize(query), songs)
+            return rec.search(endpoint, query, limit)
+        if endpoint == "detail":
+            ids = [int(i) for i in json.loads(params.get("ids") or f"[{params.get('id', '')}]")]
+            missing = [i for i in ids if rec.get("detail", str(i)) is None]
+            if self.upstream and missing:
+                js = self._forward(method, path, {"id": missing[0], "ids": json.dumps(missing)})
+                for song in js.get("songs") or []:
+                    rec.put("detail", str(song["id"]), song)
+            return rec.detail(ids)
+        song_id = int(params.get("id", 0))
+        if self.upstream and rec.get("lyric", str(song_id)) is None:
+            rec.put("lyric", str(song_id), self._forward(method, path, params))
+        return rec.lyric(song_id)
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body=b"", headers=()):
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json;charset=UTF-8")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _handle(self, method, params):
+                path = urlsplit(self.path).path
+                if path not in ENDPOINTS:
+                    self._send(404, b'{"code":404}')
+                    return
+                with server._lock:
+                    server.counts[ENDPOINTS[path]] += 1
+                delay, status = server._roll()
+                if delay:
+                    time.sleep(delay)
+                if status == 429:
+                    self._send(429, b'{"code":429}', [("Retry-After", "0")])
+                    return
+                if status:
+                    self._send(status, b'{"code":503}')
+                    return
+                try:
+                    js = server.respond(method, path, params)
+                except Exception as e:
+                    self._send(502, json.dumps({"code": 502, "msg": str(e)}).encode("utf-8"))
+                    return
+                self._send(200, json.dumps(js, ensure_ascii=False).encode("utf-8"))
+
+            def do_GET(self):
+                query = parse_qs(urlsplit(self.path).query)
+                self._handle("GET", {k: v[0] for k, v in query.items()})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = parse_qs(self.rfile.read(length).decode("utf-8"))
+                self._handle("POST", {k: v[0] for k, v in body.items()})
+
+        return Handler
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="本地网易云 API 回放服务器")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址（默认 127.0.0.1）")
+    parser.add_argument("--port", type=int, default=8163, help="监听端口（默认 8163）")
+    parser.add_argument("--recordings", help="录制文件（JSON）；配合 --upstream 时把新响应写入此文件")
+    parser.add_argument("--no-synthetic", action="store_true", help="没有录制的请求按没有结果处理，不生成合成数据")
+    parser.add_argument("--upstream", help="转发没有录制的请求并录制，例如 https://music.163.com")
+    parser.add_argument("--latency", type=float, default=0, help="每个请求的平均延迟（毫秒）")
+    parser.add_argument("--jitter", type=float, default=0.5, help="延迟的随机波动比例（默认 0.5）")
+    parser.add_argument("--error-rate", type=float, default=0, help="返回 503 的比例（0-1）")
+    parser.add_argument("--throttle-rate", type=float, default=0, help="返回 429 的比例（0-1）")
+    parser.add_argument("--seed", type=int, help="随机数种子")
+    args = parser.parse_args()
+
+    recordings = Recordings(args.recordings, synthetic=not args.no_synthetic)
+    server = StubServer(recordings, args.host, args.port, latency=args.latency / 1000, jitter=args.jitter,
+                        error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+                        upstream=args.upstream, seed=args.seed)
+    server.start()
+    print(f"回放服务器: {server.url}")
+    print(f"使用方法: NETEASE_API_BASE={server.url} python fetch_lyrics.py 音乐目录")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        print("请求数: " + "，".join(f"{k} {v}" for k, v in sorted(server.counts.items())))
+
+
+if __name__ == "__main__":
+    main()